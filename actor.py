@@ -0,0 +1,106 @@
+import asyncio
+import collections
+import logging
+
+from util import HttpCodeException
+
+MOVE = 1
+PING = 2
+
+
+class Actors:
+	"""Applies the commands for each game in order, from one task per game
+	(its actor) instead of from every handler that receives a command.
+
+	The commands that arrive while the actor is busy wait in its mailbox
+	and are handled together as a batch: the game is updated once, the
+	moves are made in order and then one update is sent to the observers.
+	An actor only runs while its mailbox has commands.
+	"""
+
+	def __init__(self, game_manager, broadcast, scheduler=None):
+		self.game_manager = game_manager
+		# Coroutine function that sends a game to its observers at once.
+		self.broadcast = broadcast
+		self.scheduler = scheduler
+		# Deque of (command, args, future) for each game with a running
+		# actor.
+		self.mailboxes = {}
+
+	def move(self, key, user, from_pos, to_pos):
+		"""Returns a future with the result of Game.move."""
+		return self._submit(key, MOVE, (user, from_pos, to_pos))
+
+	def ping(self, key):
+		"""Returns a future that is done when the game has been sent to the
+		observers."""
+		return self._submit(key, PING, ())
+
+	def _submit(self, key, command, args):
+		future = asyncio.get_event_loop().create_future()
+		mailbox = self.mailboxes.get(key)
+		if mailbox is None:
+			mailbox = self.mailboxes[key] = collections.deque()
+			asyncio.ensure_future(self._run(key, mailbox))
+		mailbox.append((command, args, future))
+		return future
+
+	async def _run(self, key, mailbox):
+		try:
+			while mailbox:
+				# Let the commands sent in the same event loop iteration
+				# join the batch.
+				await asyncio.sleep(0)
+				batch = list(mailbox)
+				mailbox.clear()
+				try:
+					await self._handle_batch(key, batch)
+				except Exception as ex:
+					logging.exception("Failed to handle commands for %s.", key)
+					for _, _, future in batch:
+						_set_exception(future, ex)
+		finally:
+			del self.mailboxes[key]
+
+	async def _handle_batch(self, key, batch):
+		# Getting the game updates it.
+		game = self.game_manager.get(key)
+		if game is None:
+			for _, _, future in batch:
+				_set_exception(future, HttpCodeException(404))
+			return
+
+		moved = False
+		pinged = False
+		for command, args, future in batch:
+			if command == MOVE:
+				try:
+					result = game.move(*args)
+				except HttpCodeException as ex:
+					_set_exception(future, ex)
+					continue
+				moved = moved or result
+				_set_result(future, result)
+			else:
+				pinged = True
+
+		if moved and self.scheduler:
+			self.scheduler.schedule(game)
+		if pinged:
+			await self.broadcast(game)
+		elif moved:
+			await game.queue_update()
+		for command, _, future in batch:
+			if command == PING:
+				_set_result(future, None)
+
+
+def _set_result(future, result):
+	# The handler waiting for the future may have been cancelled.
+	if not future.done():
+		future.set_result(result)
+
+
+def _set_exception(future, exception):
+	if not future.done():
+		future.set_exception(exception)
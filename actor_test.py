@@ -0,0 +1,75 @@
+import asyncio
+import unittest
+
+import actor
+import clock
+import game_storage
+import testutil
+from util import HttpCodeException
+
+
+class TestActors(unittest.TestCase):
+	def setUp(self):
+		self.loop = asyncio.new_event_loop()
+		asyncio.set_event_loop(self.loop)
+		self.clock = clock.VirtualClock(testutil.START_TIME)
+		# Send the updates at once, so that they can be counted.
+		self.game_manager = game_storage.GameManager(self.clock,
+		                                             broadcast_window=None)
+		self.white, self.black = testutil.players()
+		self.game, self.key = self.game_manager.new(self.white)
+		testutil.start_game(self.game, self.white, self.black)
+		self.ws = testutil.FakeConnection()
+		self.game.add_observer(self.ws)
+
+		self.broadcasts = 0
+
+		async def broadcast(game):
+			self.broadcasts += 1
+			await game.send_update()
+
+		self.actors = actor.Actors(self.game_manager, broadcast)
+
+	def tearDown(self):
+		self.loop.close()
+		asyncio.set_event_loop(None)
+
+	def run_all(self, *futures):
+		return self.loop.run_until_complete(
+		    asyncio.gather(*futures, return_exceptions=True))
+
+	def test_batch(self):
+		results = self.run_all(
+		    self.actors.move(self.key, self.white, "E2", "E4"),
+		    self.actors.move(self.key, self.black, "E7", "E5"),
+		    self.actors.move(self.key, self.white, "E2", "E3"))
+		self.assertEqual(results[:2], [True, True])
+		# The pawn has already moved.
+		self.assertIsInstance(results[2], HttpCodeException)
+		# One update for the batch.
+		self.assertEqual(1, len(self.ws.frames))
+		self.assertEqual(0, self.broadcasts)
+		self.assertEqual({}, self.actors.mailboxes)
+
+	def test_ping_sends_batch(self):
+		results = self.run_all(
+		    self.actors.move(self.key, self.white, "E2", "E4"),
+		    self.actors.ping(self.key))
+		self.assertEqual(results, [True, None])
+		self.assertEqual(1, self.broadcasts)
+		self.assertEqual(1, len(self.ws.frames))
+		self.assertIn('"1,6;M,', self.ws.frames[0])
+
+	def test_batches_in_order(self):
+		self.run_all(self.actors.move(self.key, self.white, "E2", "E4"))
+		self.run_all(self.actors.ping(self.key))
+		self.assertEqual(2, len(self.ws.frames))
+
+	def test_no_game(self):
+		results = self.run_all(self.actors.ping("deadbeef"))
+		self.assertEqual(404, results[0].status)
+		self.assertEqual({}, self.actors.mailboxes)
+
+
+if __name__ == '__main__':
+	unittest.main()
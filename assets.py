@@ -0,0 +1,171 @@
+"""Static files, fingerprinted by content and compressed at startup.
+
+Every file is served under its plain name and under a name with the hash
+of its content, e.g. game.0123456789ab.js. The hashed names are what the
+pages link to. They never change meaning, so browsers may cache them for
+a year and only download the files that changed after a deploy. The
+plain names are revalidated with their ETag.
+
+The imports between the JavaScript modules are rewritten to the hashed
+names, so that a module's hash also changes when a module it imports
+changes.
+
+Text files are compressed once with gzip, and with brotli if it is
+installed.
+"""
+
+import collections
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+
+import aiohttp.web
+
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
+# Number of hexadecimal digits of the hash in the names.
+HASH_LENGTH = 12
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+COMPRESSED_TYPES = {
+    "application/javascript",
+    "application/json",
+    "image/svg+xml",
+}
+# import ... from "./name.js"
+_IMPORT = re.compile(r'(\bfrom\s*["\'])\./([\w.-]+)(["\'])')
+
+# body is {encoding: bytes}, with the uncompressed one under "identity".
+Asset = collections.namedtuple("Asset",
+                               ["name", "hashed_name", "content_type", "body"])
+
+
+def _content_type(name):
+	content_type, _ = mimetypes.guess_type(name)
+	if name.endswith(".js"):
+		# Some systems map .js to text/plain or application/x-javascript.
+		return "application/javascript"
+	return content_type or "application/octet-stream"
+
+
+def _compressible(content_type):
+	return content_type.startswith("text/") or content_type in COMPRESSED_TYPES
+
+
+def _hashed_name(name, data):
+	digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+	stem, extension = os.path.splitext(name)
+	return "{}.{}{}".format(stem, digest, extension)
+
+
+def compress(data):
+	"""Returns {encoding: bytes} with the variants that are smaller."""
+	body = {"identity": data}
+	# mtime=0 keeps the output the same in every process.
+	variants = [("gzip", gzip.compress(data, compresslevel=9, mtime=0))]
+	if brotli is not None:
+		variants.append(("br", brotli.compress(data)))
+	for encoding, compressed in variants:
+		if len(compressed) < len(data):
+			body[encoding] = compressed
+	return body
+
+
+def accepted_encodings(header):
+	"""The encodings of an Accept-Encoding header, without the ones with
+	q=0."""
+	encodings = set()
+	for part in header.split(","):
+		encoding, _, params = part.partition(";")
+		params = params.replace(" ", "")
+		if params.startswith("q=") and not params[2:].strip("0."):
+			continue
+		encodings.add(encoding.strip().lower())
+	return encodings
+
+
+class AssetStore:
+	"""The files of a directory, read once."""
+
+	def __init__(self, directory):
+		self.directory = directory
+		self.assets = {}
+		self._sources = {
+		    name: open(os.path.join(directory, name), "rb").read()
+		    for name in sorted(os.listdir(directory))
+		    if os.path.isfile(os.path.join(directory, name))
+		}
+		for name in self._sources:
+			self._build(name, ())
+		del self._sources
+
+	def _build(self, name, importers):
+		asset = self.assets.get(name)
+		if asset is not None:
+			return asset
+		if name in importers:
+			raise ValueError("Circular import of {}.".format(name))
+		data = self._sources[name]
+		content_type = _content_type(name)
+		if content_type == "application/javascript":
+			data = self._rewrite_imports(data, importers + (name, ))
+		if _compressible(content_type):
+			body = compress(data)
+		else:
+			body = {"identity": data}
+		asset = Asset(name, _hashed_name(name, data), content_type, body)
+		self.assets[name] = asset
+		self.assets[asset.hashed_name] = asset
+		return asset
+
+	def _rewrite_imports(self, data, importers):
+		def replace(match):
+			imported = match.group(2)
+			if imported not in self._sources:
+				return match.group(0)
+			asset = self._build(imported, importers)
+			return "{}./{}{}".format(match.group(1), asset.hashed_name,
+			                         match.group(3))
+
+		return _IMPORT.sub(replace, data.decode("utf-8")).encode("utf-8")
+
+	def hashed_name(self, name):
+		return self.assets[name].hashed_name
+
+	async def handler(self, request):
+		name = request.match_info["filename"]
+		asset = self.assets.get(name)
+		if asset is None:
+			raise aiohttp.web.HTTPNotFound()
+
+		encodings = accepted_encodings(
+		    request.headers.get("Accept-Encoding", ""))
+		encoding = "identity"
+		for candidate in ("br", "gzip"):
+			if candidate in asset.body and candidate in encodings:
+				encoding = candidate
+				break
+
+		etag = asset.hashed_name
+		if encoding != "identity":
+			etag += "-" + encoding
+		headers = {
+		    "Cache-Control":
+		    IMMUTABLE if name == asset.hashed_name else REVALIDATE,
+		    "ETag": '"{}"'.format(etag),
+		    "Vary": "Accept-Encoding",
+		}
+		if_none_match = request.headers.get("If-None-Match", "")
+		if headers["ETag"] in if_none_match or if_none_match == "*":
+			return aiohttp.web.Response(status=304, headers=headers)
+
+		if encoding != "identity":
+			headers["Content-Encoding"] = encoding
+		return aiohttp.web.Response(body=asset.body[encoding],
+		                            content_type=asset.content_type,
+		                            headers=headers)
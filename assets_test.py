@@ -0,0 +1,67 @@
+import gzip
+import os
+import tempfile
+import unittest
+
+import assets
+
+
+class TestAssetStore(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def write(self, name, text):
+		with open(os.path.join(self.tmp.name, name), "w") as f:
+			f.write(text)
+
+	def test_hashed_names(self):
+		self.write("game.css", "body {}\n" * 100)
+		self.write("image.png", "png")
+		store = assets.AssetStore(self.tmp.name)
+		name = store.hashed_name("game.css")
+		self.assertRegex(name, r"^game\.[0-9a-f]{12}\.css$")
+		self.assertIs(store.assets["game.css"], store.assets[name])
+		self.assertEqual(
+		    "body {}\n" * 100,
+		    gzip.decompress(store.assets[name].body["gzip"]).decode())
+		self.assertEqual({"identity": b"png"}, store.assets["image.png"].body)
+
+		self.write("game.css", "body {}\n")
+		self.assertNotEqual(
+		    name,
+		    assets.AssetStore(self.tmp.name).hashed_name("game.css"))
+
+	def test_imports(self):
+		self.write("game.js", 'import {A} from "./constants.js";\n')
+		self.write("constants.js", "export const A = 1;\n")
+		store = assets.AssetStore(self.tmp.name)
+		self.assertEqual(
+		    'import {{A}} from "./{}";\n'.format(
+		        store.hashed_name("constants.js")).encode(),
+		    store.assets["game.js"].body["identity"])
+		name = store.hashed_name("game.js")
+
+		# Changing an imported module changes the importing one.
+		self.write("constants.js", "export const A = 2;\n")
+		self.assertNotEqual(
+		    name,
+		    assets.AssetStore(self.tmp.name).hashed_name("game.js"))
+
+	def test_circular_import(self):
+		self.write("a.js", 'import "./b.js";\nexport * from "./b.js";\n')
+		self.write("b.js", 'export * from "./a.js";\n')
+		with self.assertRaises(ValueError):
+			assets.AssetStore(self.tmp.name)
+
+	def test_accepted_encodings(self):
+		self.assertEqual(
+		    {"gzip", "br"},
+		    assets.accepted_encodings("gzip, deflate;q=0, br;q=0.5"))
+		self.assertEqual({""}, assets.accepted_encodings(""))
+
+
+if __name__ == '__main__':
+	unittest.main()
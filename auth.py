@@ -55,6 +55,9 @@ class UserManager:
 		                       rating INTEGER DEFAULT 1000 NOT NULL,
 		                       wins INTEGER DEFAULT 0 NOT NULL,
 		                       losses INTEGER DEFAULT 0 NOT NULL);""")
+		# The top players table by limit, until the ratings change.
+		self._top_players = {}
+		self._data_version = None
 
 	def get_current_user(self, request):
 		name = request.cookies.get("name")
@@ -92,12 +95,19 @@ class UserManager:
 		return password
 
 	def top_players_html(self, limit=4):
-		cur = self.conn.execute(
-		    "SELECT name, rating FROM user ORDER BY rating DESC LIMIT ?;",
-		    (limit, ))
-		text = ""
-		for name, rating in cur.fetchall():
-			text += """<tr><td>%s</td><td>%s</td></tr>\n""" % (name, rating)
+		# Other processes may share the database.
+		version, = self.conn.execute("PRAGMA data_version;").fetchone()
+		if version != self._data_version:
+			self._data_version = version
+			self._top_players = {}
+		text = self._top_players.get(limit)
+		if text is None:
+			cur = self.conn.execute(
+			    "SELECT name, rating FROM user ORDER BY rating DESC LIMIT ?;",
+			    (limit, ))
+			text = "".join("<tr><td>%s</td><td>%s</td></tr>\n" % row
+			               for row in cur.fetchall())
+			self._top_players[limit] = text
 		return text
 
 	def _create_new_user(self, name):
@@ -108,6 +118,7 @@ class UserManager:
 		self.conn.execute("INSERT OR REPLACE INTO user(name) VALUES (?)",
 		                  (name, ))
 		self.conn.commit()
+		self._top_players = {}
 
 	def _password(self, name):
 		sha256 = hashlib.sha256()
@@ -129,6 +140,7 @@ class UserManager:
 		winner.put(self.conn)
 		loser.put(self.conn)
 		self.conn.commit()
+		self._top_players = {}
 
 
 def authenticated(handler):
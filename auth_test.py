@@ -1,9 +1,12 @@
+import os
 import sqlite3
+import tempfile
 import unittest
 from unittest import mock
 
 from aiohttp.test_utils import AioHTTPTestCase, unittest_run_loop
 
+import auth
 import realtimechess
 
 
@@ -78,6 +81,11 @@ class TestAuthNoDebug(AioHTTPTestCase):
 		response = await self.client.post("/setdebug", data={})
 		assert response.status == 404
 
+	@unittest_run_loop
+	async def test_stats_not_present(self):
+		response = await self.client.get("/stats")
+		assert response.status == 404
+
 	@unittest_run_loop
 	async def test_user_already_exists(self):
 		data = {"name": "Petter3"}
@@ -89,5 +97,37 @@ class TestAuthNoDebug(AioHTTPTestCase):
 		assert response.status == 401
 
 
+class TestTopPlayers(unittest.TestCase):
+	def setUp(self):
+		# Two processes that share a database.
+		self.tmp = tempfile.TemporaryDirectory()
+		path = os.path.join(self.tmp.name, "auth.db")
+		real_sqlite3_connect = sqlite3.connect
+		with mock.patch("sqlite3.connect",
+		                lambda _: real_sqlite3_connect(path)):
+			self.managers = [auth.UserManager() for _ in range(2)]
+
+	def tearDown(self):
+		for manager in self.managers:
+			manager.conn.close()
+		self.tmp.cleanup()
+
+	def test_cache(self):
+		self.managers[0].login("a")
+		self.managers[0].login("b")
+		self.assertEqual(
+		    "<tr><td>a</td><td>1000</td></tr>\n"
+		    "<tr><td>b</td><td>1000</td></tr>\n",
+		    self.managers[0].top_players_html())
+		self.assertEqual("<tr><td>a</td><td>1000</td></tr>\n",
+		                 self.managers[1].top_players_html(1))
+
+		self.managers[0].change_ratings(auth.User("b", 1000, 0, 0),
+		                                auth.User("a", 1000, 0, 0))
+		for manager in self.managers:
+			self.assertEqual("<tr><td>b</td><td>1016</td></tr>\n",
+			                 manager.top_players_html(1))
+
+
 if __name__ == '__main__':
 	unittest.main()
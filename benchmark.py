@@ -0,0 +1,340 @@
+#!/usr/bin/python3
+"""Measures the speed of the board engines, the game, the piece
+serialization, the lobby and the installed event loops and JSON
+implementations on fixed positions.
+
+	$ python3 benchmark.py --save before.json
+	$ python3 benchmark.py --compare before.json
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import platform
+import random
+import time
+import timeit
+
+import auth
+import board
+import clock
+from constants import *
+import game_storage
+import protocol
+import speedups
+
+
+def initial_position():
+	game = game_storage.Game("benchmark")
+	return [piece.state() for piece in game.pieces]
+
+
+def random_position(seed, num_pieces=24):
+	"""A reproducible position with some sleeping and moving pieces."""
+	rng = random.Random(seed)
+	pieces = []
+	for pos in rng.sample(board.SQUARE_NAMES, num_pieces):
+		color = rng.choice([WHITE, BLACK])
+		type = rng.choice([ROOK, KNIGHT, BISHOP, QUEEN, KING, PAWN])
+		if type == PAWN and pos[1] in "18":
+			type = QUEEN
+		action = pos
+		r = rng.random()
+		if r < 0.1:
+			action = "S,1.5," + pos
+		elif r < 0.2:
+			action = "M,1.5," + pos
+		pieces.append(str(color) + "," + str(type) + ";" + action)
+	return pieces
+
+
+POSITIONS = [initial_position()] + [random_position(seed) for seed in range(4)]
+
+# A position prepared for the board benchmarks: the piece states, the
+# parsed pieces and the squares with pieces standing on them.
+Position = collections.namedtuple("Position", ["states", "pieces", "origins"])
+
+
+def bench_init(cls, position, b):
+	cls(position.states)
+
+
+def bench_init_parsed(cls, position, b):
+	cls(position.pieces)
+
+
+def bench_is_valid_move(cls, position, b):
+	for from_pos in position.origins:
+		for to_pos in board.SQUARE_NAMES:
+			b.is_valid_move(from_pos, to_pos)
+
+
+def bench_get_moves(cls, position, b):
+	for pos in position.origins:
+		b.get_moves(pos)
+
+
+def bench_get_possible_moves(cls, position, b):
+	b.get_possible_moves(WHITE)
+	b.get_possible_moves(BLACK)
+
+
+BENCHMARKS = [
+    ("__init__", bench_init, 200),
+    ("__init__ (parsed)", bench_init_parsed, 200),
+    ("is_valid_move", bench_is_valid_move, 50),
+    ("get_moves", bench_get_moves, 200),
+    ("get_possible_moves", bench_get_possible_moves, 200),
+]
+
+
+def measure(function, cls, number):
+	"""Seconds per run over all positions. The boards the functions get
+	are constructed outside of the timing, bench_init measures the
+	construction."""
+	boards = []
+	for states in POSITIONS:
+		b = cls(states)
+		pieces = [protocol.Piece.from_state(state) for state in states]
+		origins = [pos for pos in board.SQUARE_NAMES if b.has_piece(pos)]
+		boards.append((Position(states, pieces, origins), b))
+
+	def run():
+		for position, b in boards:
+			function(cls, position, b)
+
+	return min(timeit.repeat(run, number=number, repeat=5)) / number
+
+
+def playing_game():
+	"""A game in the initial position that both players can move in."""
+	game = game_storage.Game("benchmark", clock.VirtualClock(1000.0))
+	game.userX = auth.User("white", 1000, 0, 0)
+	game.userO = auth.User("black", 1000, 0, 0)
+	game.state = STATE_PLAY
+	return game
+
+
+def arriving_game():
+	"""A game where all knights and seven capturing pawns are moving and
+	arrive in the next update."""
+	game = playing_game()
+	# Move the pawns next to each other so that the white pawns can capture.
+	for a in "ABCDEFGH":
+		game.move(game.userX, a + "2", a + "4")
+		game.move(game.userO, a + "7", a + "5")
+	game.clock.advance(10)
+	game.update()
+
+	for a, b in zip("ABCDEFG", "BCDEFGH"):
+		game.move(game.userX, a + "4", b + "5")
+	for user, frm, to in [(game.userX, "B1", "C3"), (game.userX, "G1", "F3"),
+	                      (game.userO, "B8", "C6"), (game.userO, "G8", "F6")]:
+		game.move(user, frm, to)
+	game.clock.advance(10)
+	return game
+
+
+class NullConnection:
+	closed = False
+
+	def send(self, data, full=True):
+		pass
+
+
+def spectated_game(spectators, **options):
+	"""A game with spectators that get the updates with options, see
+	Game.add_observer."""
+	game = arriving_game()
+	for _ in range(spectators):
+		game.add_observer(NullConnection(), **options)
+	return game
+
+
+def measure_each(make, function, number=200):
+	"""Seconds per call of function on objects from make(), which are
+	created outside of the timing. For functions that change the object."""
+	objects = [make() for _ in range(number)]
+	start = timeit.default_timer()
+	for obj in objects:
+		function(obj)
+	return (timeit.default_timer() - start) / number
+
+
+def measure_repeated(function, number):
+	"""Seconds per call of a function that can be called repeatedly."""
+	return min(timeit.repeat(function, number=number, repeat=5)) / number
+
+
+def game_benchmarks():
+	idle_game = arriving_game()
+	idle_game.update()
+	message_game = arriving_game()
+	states = [state for pieces in POSITIONS for state in pieces if state]
+	parsed = [protocol.Piece.from_state(state) for state in states]
+
+	def changed(get_message):
+		"""Calls get_message as if the game had changed since the last
+		call."""
+		def run():
+			message_game._cached_key = None
+			get_message()
+
+		return run
+
+	loop = asyncio.new_event_loop()
+
+	def broadcast(game):
+		"""Sends an update of the changed game to its observers."""
+		def run():
+			game._cached_key = None
+			loop.run_until_complete(game.send_update())
+
+		return run
+
+	def parse():
+		for state in states:
+			protocol.Piece.from_state(state)
+
+	def format():
+		for piece in parsed:
+			piece.state()
+
+	return [
+	    ("Game.update (idle)",
+	     lambda: measure_repeated(idle_game.update, 2000)),
+	    ("Game.update (arrivals)",
+	     lambda: measure_each(arriving_game, game_storage.Game.update)),
+	    ("Game.move", lambda: measure_each(
+	        playing_game, lambda game: game.move(game.userX, "E2", "E4"))),
+	    ("Game.get_game_message",
+	     lambda: measure_repeated(message_game.get_game_message, 500)),
+	    ("Game.get_game_message (changed)",
+	     lambda: measure_repeated(changed(message_game.get_game_message), 500)),
+	    ("Game.get_binary_message (changed)",
+	     lambda: measure_repeated(changed(message_game.get_binary_message),
+	                              500)),
+	    ("Game.send_update (1000 JSON)",
+	     lambda: measure_repeated(broadcast(spectated_game(1000)), 20)),
+	    ("Game.send_update (1000 deflate)",
+	     lambda: measure_repeated(
+	         broadcast(spectated_game(1000, binary=True, deflate=True)), 20)),
+	    ("Piece.from_state ({})".format(len(states)),
+	     lambda: measure_repeated(parse, 200)),
+	    ("Piece.state ({})".format(len(parsed)),
+	     lambda: measure_repeated(format, 200)),
+	]
+
+
+def lobby_benchmarks():
+	game_manager = game_storage.GameManager()
+	users = [auth.User("user{}".format(i), 1000, 0, 0) for i in range(1000)]
+	for user in users:
+		game_manager.new(user)
+	user_manager = auth.UserManager(unsafe_debug=True)
+	for user in users:
+		user_manager.login(user.name)
+
+	return [
+	    ("GameManager.get_recent (1000)",
+	     lambda: measure_repeated(lambda: game_manager.get_recent(users[0]),
+	                              200)),
+	    ("UserManager.top_players_html",
+	     lambda: measure_repeated(user_manager.top_players_html, 200)),
+	]
+
+
+def speedup_benchmarks():
+	"""Compares the installed event loops and JSON implementations, see
+	speedups.py."""
+	message = arriving_game()._game_message()
+	benchmarks = []
+	for name in speedups.available(speedups.JSON_CODECS,
+	                               speedups.json_codec):
+		dumps, loads = speedups.json_codec(name)
+		text = dumps(message)
+		benchmarks.append(("json dumps [{}]".format(name),
+		                   lambda dumps=dumps: measure_repeated(
+		                       lambda: dumps(message), 500)))
+		benchmarks.append(("json loads [{}]".format(name),
+		                   lambda loads=loads, text=text: measure_repeated(
+		                       lambda: loads(text), 500)))
+
+	def callbacks(loop, number=1000):
+		"""Runs number callbacks that each schedule the next one."""
+		done = loop.create_future()
+
+		def callback(i):
+			if i == number:
+				done.set_result(None)
+			else:
+				loop.call_soon(callback, i + 1)
+
+		loop.call_soon(callback, 0)
+		loop.run_until_complete(done)
+
+	for name in speedups.available(speedups.EVENT_LOOPS,
+	                               speedups.event_loop_policy):
+		loop = speedups.event_loop_policy(name).new_event_loop()
+		benchmarks.append(("1000 callbacks [{}]".format(name),
+		                   lambda loop=loop: measure_repeated(
+		                       lambda: callbacks(loop), 20)))
+	return benchmarks
+
+
+def run_all():
+	"""Returns a dict from benchmark name to seconds per run."""
+	results = {}
+	for name, function, number in BENCHMARKS:
+		for cls in [board.Board, board.BitBoard]:
+			results[cls.__name__ + "." + name] = measure(function, cls, number)
+	for name, run in (game_benchmarks() + lobby_benchmarks() +
+	                  speedup_benchmarks()):
+		results[name] = run()
+	return results
+
+
+def print_results(results, baseline=None):
+	if baseline is None:
+		print("{:<32} {:>10}".format("", "ms"))
+	else:
+		print("{:<32} {:>10} {:>10} {:>8}".format("", "ms", "before",
+		                                          "speedup"))
+	for name, seconds in results.items():
+		line = "{:<32} {:>10.4f}".format(name, 1000 * seconds)
+		if baseline is not None and name in baseline:
+			line += " {:>10.4f} {:>7.2f}x".format(1000 * baseline[name],
+			                                      baseline[name] / seconds)
+		print(line)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--save",
+	                    help="Write the results as JSON to this file.")
+	parser.add_argument("--compare",
+	                    help="Compare with results saved earlier with --save.")
+	args = parser.parse_args()
+	# Moves are logged.
+	logging.basicConfig(level=logging.ERROR)
+
+	results = run_all()
+	baseline = None
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = json.load(f)["results"]
+	print_results(results, baseline)
+
+	if args.save:
+		with open(args.save, "w") as f:
+			json.dump(
+			    {
+			        "python": platform.python_version(),
+			        "machine": platform.machine(),
+			        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+			        "results": results,
+			    },
+			    f,
+			    indent=2)
@@ -2,7 +2,152 @@ from typing import List, Tuple
 
 from constants import *
 import protocol
-from protocol import Piece, coord
+from protocol import Piece, SQUARE_INDEX, SQUARE_NAMES, coord
+
+KNIGHT_OFFSETS = [(1, 2), (-1, 2), (1, -2), (-1, -2), (2, 1), (-2, 1), (2, -1),
+                  (-2, -1)]
+KING_OFFSETS = [(-1, 1), (-1, 0), (-1, -1), (0, 1), (0, -1), (1, 1), (1, 0),
+                (1, -1)]
+ROOK_DIRECTIONS = [(1, 0), (0, 1), (-1, 0), (0, -1)]
+BISHOP_DIRECTIONS = [(1, 1), (-1, -1), (-1, 1), (1, -1)]
+QUEEN_DIRECTIONS = BISHOP_DIRECTIONS + ROOK_DIRECTIONS
+PAWN_DIRECTION = {WHITE: 1, BLACK: -1}
+PAWN_START_ROW = {WHITE: 1, BLACK: 6}
+
+
+def _square(a, i):
+	if a < 0 or a >= 8 or i < 0 or i >= 8:
+		return None
+	return a * 8 + i
+
+
+def _mask(squares):
+	mask = 0
+	for sq in squares:
+		mask |= 1 << sq
+	return mask
+
+
+def _offset_targets(offsets):
+	"""For every square, the squares reachable with the given offsets,
+	in the order of the offsets."""
+	targets = []
+	for sq in range(64):
+		a, i = divmod(sq, 8)
+		targets.append([
+		    _square(a + da, i + di) for da, di in offsets
+		    if _square(a + da, i + di) is not None
+		])
+	return targets
+
+
+def _ray(sq, da, di):
+	"""Squares from sq (exclusive) to the edge of the board in the
+	direction (da, di), nearest first."""
+	a, i = divmod(sq, 8)
+	squares = []
+	while True:
+		a += da
+		i += di
+		if _square(a, i) is None:
+			return squares
+		squares.append(_square(a, i))
+
+
+KNIGHT_TARGETS = _offset_targets(KNIGHT_OFFSETS)
+KNIGHT_MASKS = [_mask(targets) for targets in KNIGHT_TARGETS]
+KING_TARGETS = _offset_targets(KING_OFFSETS)
+KING_MASKS = [_mask(targets) for targets in KING_TARGETS]
+
+
+def _pawn_targets(color):
+	"""For every square, the squares a pawn of the given color might move
+	to: single push, double push and the two captures, in that order."""
+	d = PAWN_DIRECTION[color]
+	targets = []
+	for sq in range(64):
+		a, i = divmod(sq, 8)
+		offsets = [(0, d)]
+		if i == PAWN_START_ROW[color]:
+			offsets.append((0, 2 * d))
+		offsets += [(1, d), (-1, d)]
+		targets.append([
+		    _square(a + da, i + di) for da, di in offsets
+		    if _square(a + da, i + di) is not None
+		])
+	return targets
+
+
+PAWN_TARGETS = {color: _pawn_targets(color) for color in PAWN_DIRECTION}
+PAWN_PUSH_MASKS = {
+    color: [_mask(targets) for targets in _offset_targets([(0, d)])]
+    for color, d in PAWN_DIRECTION.items()
+}
+PAWN_DOUBLE_PUSH_MASKS = {
+    color: [
+        _mask(targets) if sq % 8 == PAWN_START_ROW[color] else 0
+        for sq, targets in enumerate(_offset_targets([(0, 2 * d)]))
+    ]
+    for color, d in PAWN_DIRECTION.items()
+}
+PAWN_CAPTURE_MASKS = {
+    color: [_mask(targets) for targets in _offset_targets([(1, d), (-1, d)])]
+    for color, d in PAWN_DIRECTION.items()
+}
+
+RAYS = {(da, di): [_ray(sq, da, di) for sq in range(64)]
+        for da, di in QUEEN_DIRECTIONS}
+RAY_MASKS = {
+    direction: [_mask(ray) for ray in rays]
+    for direction, rays in RAYS.items()
+}
+RAY_NAMES = {
+    direction: [[SQUARE_NAMES[sq] for sq in ray] for ray in rays]
+    for direction, rays in RAYS.items()
+}
+
+
+def _between():
+	"""For every pair of squares on a common line, the mask of the squares
+	strictly between them. Zero for all other pairs."""
+	between = [[0] * 64 for sq in range(64)]
+	for rays in RAYS.values():
+		for from_sq, ray in enumerate(rays):
+			for distance, to_sq in enumerate(ray):
+				between[from_sq][to_sq] = _mask(ray[:distance])
+	return between
+
+
+BETWEEN = _between()
+
+SLIDING_DIRECTIONS = {
+    ROOK: ROOK_DIRECTIONS,
+    BISHOP: BISHOP_DIRECTIONS,
+    QUEEN: QUEEN_DIRECTIONS,
+}
+
+# The squares each piece type (except pawns) can move to from every square
+# on an empty board.
+MOVE_MASKS = {
+    type: [
+        _mask(sq for direction in directions
+              for sq in RAYS[direction][from_sq]) for from_sq in range(64)
+    ]
+    for type, directions in SLIDING_DIRECTIONS.items()
+}
+MOVE_MASKS[KNIGHT] = KNIGHT_MASKS
+MOVE_MASKS[KING] = KING_MASKS
+
+
+def _parse_pieces(pieces):
+	"""The boards take either Piece objects or their string states. Captured
+	pieces are None or the empty string."""
+	for piece in pieces:
+		if not piece:
+			continue
+		if isinstance(piece, str):
+			piece = Piece.from_state(piece)
+		yield piece
 
 
 class Board:
@@ -16,11 +161,8 @@ class Board:
 			self.moving[WHITE].append([False] * 8)
 			self.moving[BLACK].append([False] * 8)
 
-		for pi in range(len(pieces)):
-			if pieces[pi] == "":
-				continue
-			piece = Piece(pieces[pi])
-			a, i = coord(piece.pos)
+		for piece in _parse_pieces(pieces):
+			a, i = piece.square >> 3, piece.square & 7
 			if piece.moving:
 				assert (not self.moving[piece.color][a][i])
 				self.moving[piece.color][a][i] = True
@@ -267,3 +409,201 @@ class Board:
 			moves.append(protocol.pos(a, i))
 			if self.state[a][i] is not None:
 				break
+
+
+class BitBoard:
+	"""Drop-in replacement for Board that stores the occupancy as 64-bit
+	masks (see SQUARE_NAMES for the square numbering).
+
+	Gives the same results as Board, but answers the questions about moves
+	with mask operations and the precomputed tables above instead of
+	walking the squares one by one.
+	"""
+
+	def __init__(self, pieces):
+		# Standing (static or sleeping) pieces by square.
+		self.pieces = [None] * 64
+		# Squares with standing pieces, in total, per color and per type.
+		occupied = 0
+		by_color = {WHITE: 0, BLACK: 0}
+		by_type = {}
+		# Squares pieces of each color are moving to.
+		moving = {WHITE: 0, BLACK: 0}
+
+		# The same as calling add for every piece, in one pass with the masks
+		# in local variables.
+		standing = self.pieces
+		from_state = Piece.from_state
+		for piece in pieces:
+			if not piece:
+				continue
+			if isinstance(piece, str):
+				piece = from_state(piece)
+			bit = 1 << piece.square
+			if piece.status == protocol.MOVING:
+				assert not moving[piece.color] & bit
+				moving[piece.color] |= bit
+			else:
+				assert not occupied & bit
+				standing[piece.square] = piece
+				occupied |= bit
+				by_color[piece.color] |= bit
+				by_type[piece.type] = by_type.get(piece.type, 0) | bit
+
+		self.occupied = occupied
+		self.by_color = by_color
+		self.by_type = by_type
+		self.moving = moving
+
+	def add(self, piece):
+		"""Adds a piece. The board keeps a reference to it, so the piece must
+		be removed before its position, status or type is changed and added
+		again afterwards."""
+		sq = piece.square
+		bit = 1 << sq
+		if piece.moving:
+			assert not self.moving[piece.color] & bit
+			self.moving[piece.color] |= bit
+		else:
+			assert self.pieces[sq] is None
+			self.pieces[sq] = piece
+			self.occupied |= bit
+			self.by_color[piece.color] = self.by_color.get(piece.color,
+			                                               0) | bit
+			self.by_type[piece.type] = self.by_type.get(piece.type, 0) | bit
+
+	def remove(self, piece):
+		sq = piece.square
+		bit = 1 << sq
+		if piece.moving:
+			self.moving[piece.color] &= ~bit
+		else:
+			assert self.pieces[sq] is piece
+			self.pieces[sq] = None
+			self.occupied &= ~bit
+			self.by_color[piece.color] &= ~bit
+			self.by_type[piece.type] &= ~bit
+
+	def is_valid_position(self, pos):
+		return pos in SQUARE_INDEX
+
+	def has_piece(self, pos):
+		return self.pieces[SQUARE_INDEX[pos]] is not None
+
+	def piece(self, pos):
+		return self.pieces[SQUARE_INDEX[pos]]
+
+	def piece_name(self, pos):
+		return str(self.pieces[SQUARE_INDEX[pos]])
+
+	def is_white(self, pos):
+		return self.pieces[SQUARE_INDEX[pos]].color == WHITE
+
+	def is_valid_move(self, from_pos, to_pos):
+		from_sq = SQUARE_INDEX.get(from_pos)
+		to_sq = SQUARE_INDEX.get(to_pos)
+		if from_sq is None or to_sq is None:
+			return False
+
+		# No piece can move to the square it is on, since none of the
+		# tables below contain it.
+		piece = self.pieces[from_sq]
+		if piece is None or piece.sleeping:
+			return False
+
+		to_bit = 1 << to_sq
+		# Is a piece of the same color moving here?
+		if self.moving[piece.color] & to_bit:
+			return False
+		own = self.by_color[piece.color]
+
+		if piece.type == PAWN:
+			if self.occupied & to_bit:
+				# Capture
+				return bool(PAWN_CAPTURE_MASKS[piece.color][from_sq] & to_bit
+				            & ~own)
+			if PAWN_PUSH_MASKS[piece.color][from_sq] & to_bit:
+				return True
+			return bool(PAWN_DOUBLE_PUSH_MASKS[piece.color][from_sq] & to_bit
+			            and not self.occupied & BETWEEN[from_sq][to_sq])
+
+		# Knights and kings never have squares between, so the same test
+		# works for all other pieces.
+		masks = MOVE_MASKS.get(piece.type)
+		if masks is None or not masks[from_sq] & to_bit:
+			return False
+		if self.occupied & BETWEEN[from_sq][to_sq]:
+			return False
+		return not own & to_bit
+
+	# This method is not used for the game, only as a helper method
+	# for the AI.
+	def get_possible_moves(self, color: int) -> List[Tuple[str, List[str]]]:
+		result = []
+		remaining = self.by_color.get(color, 0)
+		while remaining:
+			bit = remaining & -remaining
+			remaining ^= bit
+			sq = bit.bit_length() - 1
+			moves = self._get_moves(sq)
+			if moves:
+				result.append((SQUARE_NAMES[sq], moves))
+		return result
+
+	# This method is not used for the game, only as a helper method
+	# for the AI.
+	def get_moves(self, from_pos: str) -> List[str]:
+		return self._get_moves(SQUARE_INDEX[from_pos])
+
+	def _get_moves(self, sq: int) -> List[str]:
+		piece = self.pieces[sq]
+		if not piece:
+			return []
+
+		if piece.type in SLIDING_DIRECTIONS:
+			# Like Board, this does not look at sleeping or moving pieces.
+			own = self.by_color[piece.color]
+			moves = []  # type: List[str]
+			for direction in SLIDING_DIRECTIONS[piece.type]:
+				names = RAY_NAMES[direction][sq]
+				blockers = RAY_MASKS[direction][sq] & self.occupied
+				if not blockers:
+					moves.extend(names)
+					continue
+				# The nearest blocker has the lowest index if the squares are
+				# increasing along the ray and the highest otherwise.
+				if 8 * direction[0] + direction[1] > 0:
+					blocker = (blockers & -blockers).bit_length() - 1
+				else:
+					blocker = blockers.bit_length() - 1
+				length = len(names) - len(RAYS[direction][blocker])
+				if own >> blocker & 1:
+					length -= 1
+				moves.extend(names[:length])
+			return moves
+
+		if piece.sleeping:
+			return []
+		own = self.by_color[piece.color]
+		if piece.type == PAWN:
+			empty = ~self.occupied
+			targets = PAWN_TARGETS[piece.color][sq]
+			allowed = (PAWN_PUSH_MASKS[piece.color][sq] & empty
+			           | PAWN_CAPTURE_MASKS[piece.color][sq] & self.occupied
+			           & ~own)
+			double_push = PAWN_DOUBLE_PUSH_MASKS[piece.color][sq] & empty
+			if double_push and allowed & PAWN_PUSH_MASKS[piece.color][sq]:
+				allowed |= double_push
+		elif piece.type == KNIGHT:
+			targets = KNIGHT_TARGETS[sq]
+			allowed = ~own
+		elif piece.type == KING:
+			targets = KING_TARGETS[sq]
+			allowed = ~own
+		else:
+			return []
+		# Squares a piece of the same color is moving to are not allowed.
+		allowed &= ~self.moving[piece.color]
+		return [
+		    SQUARE_NAMES[to_sq] for to_sq in targets if allowed >> to_sq & 1
+		]
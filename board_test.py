@@ -1,3 +1,4 @@
+import random
 import unittest
 
 import board
@@ -31,96 +32,98 @@ class TestBoard(unittest.TestCase):
 
 
 class TestIsValidMove(unittest.TestCase):
+	board_class = board.Board
+
 	def test_ok(self):
-		b = board.Board(["2,5;B5"])
+		b = self.board_class(["2,5;B5"])
 		self.assertTrue(b.is_valid_move("B5", "B6"))
 
 	def test_invalid_pos(self):
-		b = board.Board(["2,5;B5"])
+		b = self.board_class(["2,5;B5"])
 		self.assertFalse(b.is_valid_move("B5", "B6s"))
 		self.assertFalse(b.is_valid_move("B55", "B6"))
 		self.assertFalse(b.is_valid_move("Z5", "B6"))
 
 	def test_same_pos(self):
-		b = board.Board(["2,5;B5"])
+		b = self.board_class(["2,5;B5"])
 		self.assertFalse(b.is_valid_move("B5", "B5"))
 
 	def test_no_piece(self):
-		b = board.Board(["2,5;B5"])
+		b = self.board_class(["2,5;B5"])
 		self.assertFalse(b.is_valid_move("A1", "A2"))
 
 	def test_sleeping(self):
-		b = board.Board(["2,5;S,1518694394.674937,B5"])
+		b = self.board_class(["2,5;S,1518694394.674937,B5"])
 		self.assertFalse(b.is_valid_move("B5", "B6"))
 
 	def test_moving(self):
-		b = board.Board(["2,5;M,1518694394.674937,B5"])
+		b = self.board_class(["2,5;M,1518694394.674937,B5"])
 		self.assertFalse(b.is_valid_move("B5", "B6"))
 
 	def test_rook_ok(self):
-		b = board.Board(["2,1;B5"])
+		b = self.board_class(["2,1;B5"])
 		self.assertTrue(b.is_valid_move("B5", "B8"))
 
 	def test_rook_diagonal(self):
-		b = board.Board(["2,1;B5"])
+		b = self.board_class(["2,1;B5"])
 		self.assertFalse(b.is_valid_move("B5", "C6"))
 
 	def test_rook_block(self):
-		b = board.Board(["2,1;B5", "2,1;B7"])
+		b = self.board_class(["2,1;B5", "2,1;B7"])
 		self.assertFalse(b.is_valid_move("B5", "B8"))
 
 	def test_bishop_ok(self):
-		b = board.Board(["2,3;B5"])
+		b = self.board_class(["2,3;B5"])
 		self.assertTrue(b.is_valid_move("B5", "D7"))
 
 	def test_bishop_straight(self):
-		b = board.Board(["2,3;B5"])
+		b = self.board_class(["2,3;B5"])
 		self.assertFalse(b.is_valid_move("B5", "B7"))
 
 	def test_bishop_block(self):
-		b = board.Board(["2,3;B5", "2,1;C6"])
+		b = self.board_class(["2,3;B5", "2,1;C6"])
 		self.assertFalse(b.is_valid_move("B5", "D7"))
 
 	def test_queen_ok_diagonal(self):
-		b = board.Board(["2,4;B5"])
+		b = self.board_class(["2,4;B5"])
 		self.assertTrue(b.is_valid_move("B5", "D7"))
 
 	def test_queen_ok_straight(self):
-		b = board.Board(["2,4;B5"])
+		b = self.board_class(["2,4;B5"])
 		self.assertTrue(b.is_valid_move("B5", "B7"))
 
 	def test_queen_irregular(self):
-		b = board.Board(["2,4;B5"])
+		b = self.board_class(["2,4;B5"])
 		self.assertFalse(b.is_valid_move("B5", "C7"))
 
 	def test_queen_block(self):
-		b = board.Board(["2,4;B5", "2,1;C6"])
+		b = self.board_class(["2,4;B5", "2,1;C6"])
 		self.assertFalse(b.is_valid_move("B5", "D7"))
 
 	def test_king_ok(self):
-		b = board.Board(["2,5;D5"])
+		b = self.board_class(["2,5;D5"])
 		self.assertTrue(b.is_valid_move("D5", "D6"))
 		self.assertTrue(b.is_valid_move("D5", "D4"))
 		self.assertTrue(b.is_valid_move("D5", "C4"))
 		self.assertTrue(b.is_valid_move("D5", "E6"))
 
 	def test_king_too_far(self):
-		b = board.Board(["2,5;D5"])
+		b = self.board_class(["2,5;D5"])
 		self.assertFalse(b.is_valid_move("D5", "D7"))
 
 	def test_knight_ok(self):
-		b = board.Board(["2,2;D5"])
+		b = self.board_class(["2,2;D5"])
 		self.assertTrue(b.is_valid_move("D5", "C7"))
 		self.assertTrue(b.is_valid_move("D5", "E7"))
 		self.assertTrue(b.is_valid_move("D5", "F4"))
 		self.assertTrue(b.is_valid_move("D5", "F6"))
 
 	def test_knight_invalid(self):
-		b = board.Board(["2,2;D5"])
+		b = self.board_class(["2,2;D5"])
 		self.assertFalse(b.is_valid_move("D5", "D7"))
 
 	def test_white_pawn_move_start(self):
-		b = board.Board(["1,6;D2"])
+		b = self.board_class(["1,6;D2"])
 		self.assertTrue(b.is_valid_move("D2", "D3"))
 		self.assertTrue(b.is_valid_move("D2", "D4"))
 
@@ -128,7 +131,7 @@ class TestIsValidMove(unittest.TestCase):
 		self.assertFalse(b.is_valid_move("D2", "E3"))
 
 	def test_black_pawn_move_start(self):
-		b = board.Board(["2,6;D7"])
+		b = self.board_class(["2,6;D7"])
 		self.assertTrue(b.is_valid_move("D7", "D6"))
 		self.assertTrue(b.is_valid_move("D7", "D5"))
 
@@ -136,55 +139,57 @@ class TestIsValidMove(unittest.TestCase):
 		self.assertFalse(b.is_valid_move("D7", "E6"))
 
 	def test_white_pawn_capture(self):
-		b = board.Board(["1,6;D2", "1,6;E3"])
+		b = self.board_class(["1,6;D2", "1,6;E3"])
 		self.assertFalse(b.is_valid_move("D2", "E3"))
 
 	def test_black_pawn_capture(self):
-		b = board.Board(["2,6;D7", "2,6;E6"])
+		b = self.board_class(["2,6;D7", "2,6;E6"])
 		self.assertFalse(b.is_valid_move("D7", "E6"))
 
 	def test_invalid_type(self):
-		b = board.Board(["2,12;D5"])
+		b = self.board_class(["2,12;D5"])
 		self.assertFalse(b.is_valid_move("D5", "D6"))
 
 
 class TestPossibleMoves(unittest.TestCase):
+	board_class = board.Board
+
 	def test_empty(self):
-		b = board.Board(["1,6;D2"])
+		b = self.board_class(["1,6;D2"])
 		self.assertEqual(b.get_moves("A2"), [])
 
 	def test_pawn_start(self):
-		b = board.Board(["1,6;D2"])
+		b = self.board_class(["1,6;D2"])
 		self.assertCountEqual(b.get_moves("D2"), ["D3", "D4"])
 
 	def test_pawn_capture(self):
-		b = board.Board(["1,6;D3", "1,6;E4", "2,6;C4"])
+		b = self.board_class(["1,6;D3", "1,6;E4", "2,6;C4"])
 		self.assertCountEqual(b.get_moves("D3"), ["D4", "C4"])
 
 	def test_black_pawn_(self):
-		b = board.Board(["2,6;D2"])
+		b = self.board_class(["2,6;D2"])
 		self.assertCountEqual(b.get_moves("D2"), ["D1"])
 
 	def test_rook(self):
-		b = board.Board(["1,1;D3", "2,6;D5", "1,6;D1"])
+		b = self.board_class(["1,1;D3", "2,6;D5", "1,6;D1"])
 		self.assertCountEqual(
 		    b.get_moves("D3"),
 		    ["D2", "D4", "D5", "A3", "B3", "C3", "E3", "F3", "G3", "H3"])
 
 	def test_knight(self):
-		b = board.Board(["1,2;D3"])
+		b = self.board_class(["1,2;D3"])
 		self.assertCountEqual(
 		    b.get_moves("D3"),
 		    ["F2", "F4", "B2", "B4", "C1", "E1", "C5", "E5"])
 
 	def test_bishop(self):
-		b = board.Board(["2,3;B2"])
+		b = self.board_class(["2,3;B2"])
 		self.assertCountEqual(
 		    b.get_moves("B2"),
 		    ["A1", "C3", "D4", "E5", "F6", "G7", "H8", "A3", "C1"])
 
 	def test_queen(self):
-		b = board.Board(["2,4;B2", "1,6;C2", "1,6;B4"])
+		b = self.board_class(["2,4;B2", "1,6;C2", "1,6;B4"])
 		self.assertCountEqual(
 		    b.get_moves("B2"), [
 		        "A1", "C3", "D4", "E5", "F6", "G7", "H8", "A3", "C1", "A2",
@@ -192,12 +197,12 @@ class TestPossibleMoves(unittest.TestCase):
 		    ])
 
 	def test_king(self):
-		b = board.Board(["2,5;B1"])
+		b = self.board_class(["2,5;B1"])
 		self.assertCountEqual(
 		    b.get_moves("B1"), ["A1", "A2", "B2", "C2", "C1"])
 
 	def test_all(self):
-		b = board.Board(["2,5;B1", "2,3;B2"])
+		b = self.board_class(["2,5;B1", "2,3;B2"])
 		moves = {key: val for key, val in b.get_possible_moves(2)}
 		self.assertCountEqual(moves["B1"], ["A1", "A2", "C2", "C1"])
 		self.assertCountEqual(
@@ -205,5 +210,47 @@ class TestPossibleMoves(unittest.TestCase):
 		    ["A1", "C3", "D4", "E5", "F6", "G7", "H8", "A3", "C1"])
 
 
+class TestBitBoardIsValidMove(TestIsValidMove):
+	board_class = board.BitBoard
+
+
+class TestBitBoardPossibleMoves(TestPossibleMoves):
+	board_class = board.BitBoard
+
+
+def random_pieces(rng):
+	pieces = []
+	for pos in rng.sample(board.SQUARE_NAMES, rng.randint(1, 32)):
+		color = rng.choice([constants.WHITE, constants.BLACK])
+		type = rng.randint(constants.ROOK, constants.PAWN)
+		if type == constants.PAWN and pos[1] in "18":
+			# Pawns are promoted there.
+			type = constants.QUEEN
+		action = rng.choice([pos, pos, pos, "S,1.5," + pos, "M,1.5," + pos])
+		pieces.append(str(color) + "," + str(type) + ";" + action)
+	return pieces
+
+
+class TestBitBoardSameAsBoard(unittest.TestCase):
+	def test_random_positions(self):
+		rng = random.Random(0)
+		for _ in range(100):
+			pieces = random_pieces(rng)
+			expected = board.Board(pieces)
+			actual = board.BitBoard(pieces)
+			for color in [constants.WHITE, constants.BLACK]:
+				self.assertEqual(expected.get_possible_moves(color),
+				                 actual.get_possible_moves(color))
+			for from_pos in board.SQUARE_NAMES:
+				self.assertEqual(expected.has_piece(from_pos),
+				                 actual.has_piece(from_pos))
+				self.assertEqual(expected.get_moves(from_pos),
+				                 actual.get_moves(from_pos))
+				for to_pos in board.SQUARE_NAMES:
+					self.assertEqual(expected.is_valid_move(from_pos, to_pos),
+					                 actual.is_valid_move(from_pos, to_pos),
+					                 pieces)
+
+
 if __name__ == '__main__':
 	unittest.main()
@@ -0,0 +1,44 @@
+import time
+
+
+class RealClock:
+	"""The wall clock."""
+	def time(self):
+		return time.time()
+
+	def wall_delay(self, seconds):
+		"""The wall clock seconds until the clock has advanced seconds."""
+		return seconds
+
+
+class VirtualClock:
+	"""A clock that only moves when advanced manually. Used to run games
+	faster than real time and for deterministic tests."""
+	def __init__(self, start=0.0):
+		self.now = start
+
+	def time(self):
+		return self.now
+
+	def wall_delay(self, seconds):
+		# The clock does not advance by itself, so this only decides when
+		# timers check the time again.
+		return seconds
+
+	def advance(self, seconds):
+		assert seconds >= 0
+		self.now += seconds
+
+
+class AcceleratedClock:
+	"""A clock that runs factor times faster than the wall clock."""
+	def __init__(self, factor, start=None):
+		self.factor = factor
+		self.wall_start = time.time()
+		self.start = self.wall_start if start is None else start
+
+	def time(self):
+		return self.start + (time.time() - self.wall_start) * self.factor
+
+	def wall_delay(self, seconds):
+		return seconds / self.factor
@@ -0,0 +1,30 @@
+import time
+import unittest
+
+import clock
+
+
+class TestClock(unittest.TestCase):
+	def test_real(self):
+		before = time.time()
+		now = clock.RealClock().time()
+		self.assertLessEqual(before, now)
+		self.assertLessEqual(now, time.time())
+
+	def test_virtual(self):
+		c = clock.VirtualClock(100.0)
+		self.assertEqual(c.time(), 100.0)
+		self.assertEqual(c.time(), 100.0)
+		c.advance(2.5)
+		self.assertEqual(c.time(), 102.5)
+
+	def test_accelerated(self):
+		c = clock.AcceleratedClock(1000.0, start=0.0)
+		before = c.time()
+		time.sleep(0.01)
+		self.assertGreaterEqual(c.time() - before, 10.0)
+		self.assertEqual(c.wall_delay(3.0), 0.003)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,110 @@
+import asyncio
+import collections
+import logging
+
+# The most frames that can wait to be sent to a client. A client that is
+# further behind is disconnected.
+MAX_QUEUE = 32
+# Seconds that sending a single frame may take before the client is
+# disconnected.
+SEND_TIMEOUT = 10.0
+
+
+class Stats:
+	"""Totals for all connections."""
+
+	def __init__(self):
+		self.dropped_frames = 0
+		self.slow_disconnects = 0
+
+
+stats = Stats()
+
+
+class Connection:
+	"""A websocket with its own queue and writer task.
+
+	Sending only adds the frame to the queue, so a slow client never makes
+	the game or the other clients wait. A full frame replaces the frames
+	still in the queue, since it contains everything they do.
+	"""
+
+	def __init__(self, ws, max_queue=MAX_QUEUE, send_timeout=SEND_TIMEOUT):
+		self.ws = ws
+		self.max_queue = max_queue
+		self.send_timeout = send_timeout
+		self.queue = collections.deque()
+		# Replies to the commands of the client, sent before the queue.
+		self.replies = collections.deque()
+		self.dropped_frames = 0
+		self._closing = False
+		self._ready = asyncio.Event()
+		self._writer = asyncio.ensure_future(self._write())
+
+	@property
+	def closed(self):
+		return self._closing or self.ws.closed
+
+	def send(self, data, full=True):
+		"""Queues a str or bytes frame. full means that the frame does not
+		depend on the frames before it."""
+		if self.closed:
+			return
+		if full and self.queue:
+			self.dropped_frames += len(self.queue)
+			stats.dropped_frames += len(self.queue)
+			self.queue.clear()
+		elif len(self.queue) >= self.max_queue:
+			logging.warning("Disconnecting a client that is %d frames behind.",
+			                len(self.queue))
+			self._disconnect()
+			return
+		self.queue.append(data)
+		self._ready.set()
+
+	def reply(self, data):
+		"""Queues a short frame in reply to a command of the client. Full
+		frames do not replace it. Replies beyond max_queue are dropped."""
+		if self.closed or len(self.replies) >= self.max_queue:
+			return
+		self.replies.append(data)
+		self._ready.set()
+
+	def close(self):
+		"""Stops the writer task. Frames that have not been sent are
+		dropped."""
+		self._closing = True
+		self._writer.cancel()
+
+	def disconnect(self):
+		"""Closes the connection and the websocket."""
+		self.close()
+		asyncio.ensure_future(self.ws.close())
+
+	def _disconnect(self):
+		stats.slow_disconnects += 1
+		self.disconnect()
+
+	async def _write(self):
+		while True:
+			await self._ready.wait()
+			self._ready.clear()
+			while self.replies or self.queue:
+				if self.replies:
+					data = self.replies.popleft()
+				else:
+					data = self.queue.popleft()
+				if isinstance(data, bytes):
+					send = self.ws.send_bytes(data)
+				else:
+					send = self.ws.send_str(data)
+				try:
+					await asyncio.wait_for(send, self.send_timeout)
+				except asyncio.TimeoutError:
+					logging.warning("Disconnecting a client that is too slow.")
+					self._disconnect()
+					return
+				except (ConnectionError, RuntimeError):
+					# The websocket is closing.
+					self.close()
+					return
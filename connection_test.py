@@ -0,0 +1,104 @@
+import asyncio
+import unittest
+
+import connection
+
+
+class FakeWebSocket:
+	def __init__(self):
+		self.closed = False
+		self.sent = []
+		# Sending waits until this is set.
+		self.can_send = asyncio.Event()
+		self.can_send.set()
+
+	async def send_str(self, data):
+		await self.can_send.wait()
+		self.sent.append(data)
+
+	async def send_bytes(self, data):
+		await self.send_str(data)
+
+	async def close(self):
+		self.closed = True
+
+
+class TestConnection(unittest.TestCase):
+	def setUp(self):
+		self.loop = asyncio.new_event_loop()
+		asyncio.set_event_loop(self.loop)
+		self.ws = FakeWebSocket()
+
+	def tearDown(self):
+		# Lets the cancelled writer tasks finish.
+		self.run_loop()
+		self.loop.close()
+		asyncio.set_event_loop(None)
+
+	def run_loop(self):
+		self.loop.run_until_complete(asyncio.sleep(0.01))
+
+	def test_send(self):
+		conn = connection.Connection(self.ws)
+		conn.send("a")
+		conn.send(b"b", full=False)
+		self.run_loop()
+		self.assertEqual(self.ws.sent, ["a", b"b"])
+		self.assertEqual(len(conn.queue), 0)
+		conn.close()
+
+	def test_full_frame_replaces_queue(self):
+		self.ws.can_send.clear()
+		conn = connection.Connection(self.ws)
+		conn.send("first")
+		self.run_loop()
+		# "first" is being sent. The others wait in the queue.
+		conn.send("delta", full=False)
+		conn.send("full")
+		self.assertEqual(list(conn.queue), ["full"])
+		self.assertEqual(conn.dropped_frames, 1)
+
+		self.ws.can_send.set()
+		self.run_loop()
+		self.assertEqual(self.ws.sent, ["first", "full"])
+		conn.close()
+
+	def test_reply(self):
+		self.ws.can_send.clear()
+		conn = connection.Connection(self.ws, max_queue=2)
+		conn.send("first")
+		self.run_loop()
+		conn.send("delta", full=False)
+		for i in range(3):
+			conn.reply(str(i))
+		conn.send("full")
+		self.assertEqual(list(conn.replies), ["0", "1"])
+
+		self.ws.can_send.set()
+		self.run_loop()
+		self.assertEqual(self.ws.sent, ["first", "0", "1", "full"])
+		conn.close()
+
+	def test_disconnect_when_behind(self):
+		self.ws.can_send.clear()
+		conn = connection.Connection(self.ws, max_queue=2)
+		for i in range(4):
+			conn.send(str(i), full=False)
+		self.run_loop()
+		self.assertTrue(conn.closed)
+		self.assertTrue(self.ws.closed)
+		# Nothing more is queued.
+		conn.send("full")
+		self.assertNotIn("full", conn.queue)
+
+	def test_disconnect_on_timeout(self):
+		self.ws.can_send.clear()
+		conn = connection.Connection(self.ws, send_timeout=0.001)
+		conn.send("a")
+		self.run_loop()
+		self.assertTrue(conn.closed)
+		self.assertTrue(self.ws.closed)
+
+
+if __name__ == '__main__':
+	unittest.main()
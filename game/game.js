@@ -12,6 +12,7 @@ import {
 	STATE_START,
 	WHITE
 } from "./constants.js";
+import {FRAME_THROTTLED, decodeFrame} from "./protocol.js";
 
 jQuery.fn.rotate = function(degrees) {
 	$(this).css({transform: "rotate(" + degrees + "deg)"});
@@ -31,9 +32,19 @@ class ServerConnection {
 		if (location.protocol === "http:") {
 			socketProtocol = "ws:";
 		}
+		// With binary=1 in the page URL, the updates are binary frames.
+		const binary =
+			new URLSearchParams(location.search).get("binary") === "1";
 		const ws = new WebSocket(
-			socketProtocol + "//" + location.host + "/websocket?&g=" + gameKey
+			socketProtocol +
+				"//" +
+				location.host +
+				"/websocket?g=" +
+				gameKey +
+				"&delta=1" +
+				(binary ? "&binary=1" : "")
 		);
+		ws.binaryType = "arraybuffer";
 		ws.onopen = event => {
 			console.log("WebSocket open.", event);
 			this.rpc("/opened");
@@ -45,8 +56,21 @@ class ServerConnection {
 			);
 		};
 		ws.onmessage = m => {
+			if (m.data instanceof ArrayBuffer) {
+				if (new Uint8Array(m.data)[0] === FRAME_THROTTLED) {
+					console.warn("Command throttled.");
+					return;
+				}
+				jsonHandler(decodeFrame(m.data, gameKey));
+				return;
+			}
 			console.log("Parsing JSON: " + m.data);
 			const json = JSON.parse(m.data);
+			if (json.hasOwnProperty("throttled")) {
+				// The server dropped a command because we sent too many.
+				console.warn("Command throttled: " + json["throttled"]);
+				return;
+			}
 			jsonHandler(json);
 		};
 	}
@@ -183,37 +207,6 @@ function updateStaticPiece(i, pos) {
 	piece.rotate(0);
 }
 
-function localTransitionToSleeping(i, endTimeStamp, pos) {
-	if (pieces[i].color !== state.myColor) {
-		// Not my piece; the other player will take care of this.
-		return;
-	}
-
-	// Is there another piece in this square?
-	for (let j = 0; j < 32; ++j) {
-		let capture = false;
-		if (i !== j && pos === pieces[j].pos) {
-			capture = true;
-		}
-
-		const sleepingPattern = /S,(\d+\.?\d*),([A-H][1-8])/g;
-		const sleepingMatch = sleepingPattern.exec(pieces[j].pos);
-		if (sleepingMatch !== null) {
-			const endPos = sleepingMatch[2];
-			if (pos === endPos) {
-				capture = true;
-			}
-		}
-		if (capture) {
-			// We need to let the server resolve this.
-			console.log(
-				"Piece " + i + " has moved into square occupied by " + j
-			);
-			serverConnection.send("/ping");
-		}
-	}
-}
-
 function updateSleepingPiece(i, endTimeStamp, pos) {
 	pieces[i].pos = pos;
 	pieces[i].moving = false;
@@ -293,7 +286,8 @@ function updateMovingPiece(i, endTimeStamp, endPos) {
 	const duration = endTimeStamp - state["time_stamp"];
 	function animationComplete() {
 		assert(pieces[i].moving);
-		localTransitionToSleeping(i, null, endPos);
+		// The server resolves captures and sends an update when the
+		// piece arrives.
 		updateSleepingPiece(i, null, endPos);
 	}
 	function animationProgress(animation, progress) {
@@ -453,6 +447,17 @@ function onMessage(newState) {
 		return;
 	}
 
+	// Delta messages only contain the fields that changed since the
+	// message with sequence number delta_from.
+	if (
+		newState.hasOwnProperty("delta_from") &&
+		parseInt(newState["delta_from"]) !== sequenceNumber
+	) {
+		console.log("onMessage() missed an update. Requesting all state.");
+		serverConnection.send("/snapshot");
+		return;
+	}
+
 	// Check sequence numbers.
 	const newSequenceNumber = parseInt(newState["seq"]);
 	if (newSequenceNumber > 1) {
@@ -0,0 +1,90 @@
+// Decodes the binary game frames of protocol.py to the same objects as
+// the JSON messages. The server sends them with binary=1.
+
+export const FRAME_STATE = 1;
+export const FRAME_DELTA = 2;
+export const FRAME_THROTTLED = 7;
+
+// Status of a piece.
+const STATIC = 0;
+const CAPTURED = 0xff;
+const STATUS_PREFIX = {1: "M", 2: "S"};
+
+const STRING_FIELDS = ["key", "userX", "userXname", "userO", "userOname"];
+
+// Sizes of the structs in protocol.py.
+const FRAME_HEADER_SIZE = 9;
+const GAME_HEADER_SIZE = 8;
+const DELTA_HEADER_SIZE = 5;
+const PIECE_SIZE = 11;
+
+function squareName(square) {
+	return String.fromCharCode(65 + (square >> 3)) + ((square & 7) + 1);
+}
+
+// Microseconds since the epoch to seconds.
+function readTime(view, offset) {
+	return Number(view.getBigInt64(offset)) / 1000000;
+}
+
+// The piece at offset in the format of Piece.state() in protocol.py, or
+// "" if it has been captured.
+function readPiece(view, offset) {
+	const status = view.getUint8(offset);
+	if (status === CAPTURED) {
+		return "";
+	}
+	const colorType = view.getUint8(offset + 1);
+	let state = (colorType >> 4) + "," + (colorType & 15) + ";";
+	if (status !== STATIC) {
+		state += STATUS_PREFIX[status] + "," + readTime(view, offset + 3) + ",";
+	}
+	return state + squareName(view.getUint8(offset + 2));
+}
+
+// Decodes a state or delta frame. The delta frames do not contain the
+// game key, so it is taken from gameKey.
+export function decodeFrame(buffer, gameKey) {
+	const view = new DataView(buffer);
+	const frameType = view.getUint8(0);
+	let offset = FRAME_HEADER_SIZE;
+	const message = {
+		key: gameKey,
+		seq: view.getUint32(offset),
+		state: view.getUint8(offset + 4),
+		userXReady: view.getUint8(offset + 6) !== 0,
+		userOReady: view.getUint8(offset + 7) !== 0
+	};
+	message["time_stamp"] = readTime(view, 1);
+	const winner = view.getUint8(offset + 5);
+	if (winner) {
+		message.winner = winner;
+	}
+	offset += GAME_HEADER_SIZE;
+
+	if (frameType === FRAME_STATE) {
+		for (let i = 0; i < 32; ++i) {
+			message["p" + i] = readPiece(view, offset);
+			offset += PIECE_SIZE;
+		}
+		const decoder = new TextDecoder();
+		for (const field of STRING_FIELDS) {
+			const length = view.getUint8(offset);
+			message[field] = decoder.decode(
+				new Uint8Array(buffer, offset + 1, length)
+			);
+			offset += 1 + length;
+		}
+	} else if (frameType === FRAME_DELTA) {
+		message["delta_from"] = view.getUint32(offset);
+		const count = view.getUint8(offset + 4);
+		offset += DELTA_HEADER_SIZE;
+		for (let i = 0; i < count; ++i) {
+			message["p" + view.getUint8(offset)] = readPiece(view, offset + 1);
+			offset += 1 + PIECE_SIZE;
+		}
+	} else {
+		throw new Error("Invalid frame type: " + frameType);
+	}
+	return message;
+}
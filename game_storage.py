@@ -1,16 +1,76 @@
 import asyncio
+import collections
 import datetime
-import json
+import heapq
 import logging
 import random
-import time
 import os
+import sqlite3
 
 import board
+from clock import RealClock
 from constants import *
-from protocol import Piece
+import protocol
+from protocol import Piece, SQUARE_INDEX
+import speedups
 from util import HttpCodeException, log_error
 
+# Color, type and position of the pieces at the start of the game, by
+# piece id.
+INITIAL_PIECES = [
+    (WHITE, ROOK, "A1"),
+    (WHITE, KNIGHT, "B1"),
+    (WHITE, BISHOP, "C1"),
+    (WHITE, QUEEN, "D1"),
+    (WHITE, KING, "E1"),
+    (WHITE, BISHOP, "F1"),
+    (WHITE, KNIGHT, "G1"),
+    (WHITE, ROOK, "H1"),
+    (WHITE, PAWN, "A2"),
+    (WHITE, PAWN, "B2"),
+    (WHITE, PAWN, "C2"),
+    (WHITE, PAWN, "D2"),
+    (WHITE, PAWN, "E2"),
+    (WHITE, PAWN, "F2"),
+    (WHITE, PAWN, "G2"),
+    (WHITE, PAWN, "H2"),
+    (BLACK, ROOK, "A8"),
+    (BLACK, KNIGHT, "B8"),
+    (BLACK, BISHOP, "C8"),
+    (BLACK, QUEEN, "D8"),
+    (BLACK, KING, "E8"),
+    (BLACK, BISHOP, "F8"),
+    (BLACK, KNIGHT, "G8"),
+    (BLACK, ROOK, "H8"),
+    (BLACK, PAWN, "A7"),
+    (BLACK, PAWN, "B7"),
+    (BLACK, PAWN, "C7"),
+    (BLACK, PAWN, "D7"),
+    (BLACK, PAWN, "E7"),
+    (BLACK, PAWN, "F7"),
+    (BLACK, PAWN, "G7"),
+    (BLACK, PAWN, "H7"),
+]
+
+# The keys of the pieces in the game message.
+PIECE_IDS = ["p" + str(piece_id) for piece_id in range(len(INITIAL_PIECES))]
+
+WHITE_KING = 4
+BLACK_KING = 20
+
+# Seconds that updates from moves wait to be merged with later updates into
+# one broadcast. 0 merges the updates from the same event loop iteration
+# and None sends every update at once.
+DEFAULT_BROADCAST_WINDOW = 0.0
+
+# The lobby offers the newest RECENT_GAMES games that are younger than
+# RECENT_AGE. Games older than MAX_AGE are deleted, at most once per
+# CLEANUP_INTERVAL.
+RECENT_GAMES = 20
+RECENT_AGE = datetime.timedelta(minutes=2)
+MAX_AGE = datetime.timedelta(minutes=60)
+CLEANUP_INTERVAL = datetime.timedelta(minutes=1)
+
 
 class Game():
 	"""All the data we store for a game.
@@ -20,14 +80,49 @@ class Game():
 	version on App Engine, the Game was stored in a database.
 	"""
 
-	def __init__(self, key):
+	def __init__(self, key, clock=None):
 		self.key = key
+		# Source of the time for the piece timers and the game messages.
+		self.clock = clock or RealClock()
 
 		# Which users are allowed to play this game.
 		self.userX = None
 		self.userO = None
-		# Users allowed to watch the game.
-		self.observers = []
+		# The connections that get the game updates, mapped to the id of
+		# their user, or None for anonymous observers.
+		self.observers = {}
+		# The connection of each logged in observer. A user that opens the
+		# game again, e.g. in another tab, replaces their old connection.
+		self._observer_by_user = {}
+		# The observers that want delta messages, and those of them that
+		# need a full message before they can apply deltas.
+		self.delta_observers = set()
+		self.needs_snapshot = set()
+		# The observers that want binary frames instead of JSON, and those
+		# of them that want the frames compressed.
+		self.binary_observers = set()
+		self.deflate_observers = set()
+		# The last message sent to the observers. Delta messages contain
+		# the fields that differ from it.
+		self.last_sent = None
+		# See DEFAULT_BROADCAST_WINDOW. Longer windows send fewer messages
+		# to the observers of busy games, at the cost of latency.
+		self.broadcast_window = DEFAULT_BROADCAST_WINDOW
+		# Event loop timer for the updates waiting to be sent.
+		self._queued_update = None
+		# Where the updates are published for the observers in other
+		# processes, see pubsub.py.
+		self.bus = None
+
+		# Incremented when the pieces change.
+		self.pieces_version = 0
+		# The game message without time_stamp, valid while _message_key()
+		# returns _cached_key, and its JSON and binary encodings, which are
+		# created when first needed.
+		self._cached_key = None
+		self._cached_message = None
+		self._cached_json = None
+		self._cached_binary = None
 
 		# When this game was last updated.
 		self.creation_time = datetime.datetime.now()
@@ -44,46 +139,36 @@ class Game():
 		self.userX_ready = False
 		self.userO_ready = False
 
-		self.p0 = str(WHITE) + "," + str(ROOK) + ";" + "A1"
-		self.p1 = str(WHITE) + "," + str(KNIGHT) + ";" + "B1"
-		self.p2 = str(WHITE) + "," + str(BISHOP) + ";" + "C1"
-		self.p3 = str(WHITE) + "," + str(QUEEN) + ";" + "D1"
-		self.p4 = str(WHITE) + "," + str(KING) + ";" + "E1"
-		self.p5 = str(WHITE) + "," + str(BISHOP) + ";" + "F1"
-		self.p6 = str(WHITE) + "," + str(KNIGHT) + ";" + "G1"
-		self.p7 = str(WHITE) + "," + str(ROOK) + ";" + "H1"
-		self.p8 = str(WHITE) + "," + str(PAWN) + ";" + "A2"
-		self.p9 = str(WHITE) + "," + str(PAWN) + ";" + "B2"
-		self.p10 = str(WHITE) + "," + str(PAWN) + ";" + "C2"
-		self.p11 = str(WHITE) + "," + str(PAWN) + ";" + "D2"
-		self.p12 = str(WHITE) + "," + str(PAWN) + ";" + "E2"
-		self.p13 = str(WHITE) + "," + str(PAWN) + ";" + "F2"
-		self.p14 = str(WHITE) + "," + str(PAWN) + ";" + "G2"
-		self.p15 = str(WHITE) + "," + str(PAWN) + ";" + "H2"
-		self.p16 = str(BLACK) + "," + str(ROOK) + ";" + "A8"
-		self.p17 = str(BLACK) + "," + str(KNIGHT) + ";" + "B8"
-		self.p18 = str(BLACK) + "," + str(BISHOP) + ";" + "C8"
-		self.p19 = str(BLACK) + "," + str(QUEEN) + ";" + "D8"
-		self.p20 = str(BLACK) + "," + str(KING) + ";" + "E8"
-		self.p21 = str(BLACK) + "," + str(BISHOP) + ";" + "F8"
-		self.p22 = str(BLACK) + "," + str(KNIGHT) + ";" + "G8"
-		self.p23 = str(BLACK) + "," + str(ROOK) + ";" + "H8"
-		self.p24 = str(BLACK) + "," + str(PAWN) + ";" + "A7"
-		self.p25 = str(BLACK) + "," + str(PAWN) + ";" + "B7"
-		self.p26 = str(BLACK) + "," + str(PAWN) + ";" + "C7"
-		self.p27 = str(BLACK) + "," + str(PAWN) + ";" + "D7"
-		self.p28 = str(BLACK) + "," + str(PAWN) + ";" + "E7"
-		self.p29 = str(BLACK) + "," + str(PAWN) + ";" + "F7"
-		self.p30 = str(BLACK) + "," + str(PAWN) + ";" + "G7"
-		self.p31 = str(BLACK) + "," + str(PAWN) + ";" + "H7"
-
-		self.all_piece_ids = [
-		    attr for attr in dir(self)
-		    if not callable(attr) and re.match("p\\d\\d?", attr)
+		# The pieces indexed by their id. Captured pieces are None.
+		self.pieces = [
+		    Piece(color, type, SQUARE_INDEX[pos])
+		    for color, type, pos in INITIAL_PIECES
 		]
+		# Min-heap of (end_time, piece_id) for the pieces that are moving or
+		# sleeping. Entries for pieces that have been captured or changed
+		# since are skipped when popped.
+		self.timers = []
+		self._index_pieces()
+
 		self.update()
 
 	def get_game_message(self):
+		self._game_message()
+		return with_time_stamp(self._json_message(), self.clock.time())
+
+	def _message_key(self):
+		"""Everything the game message depends on, except the time."""
+		return (self.pieces_version, self.seq, self.state, self.winner,
+		        self.userX.id, None if not self.userO else self.userO.id,
+		        self.userX_ready, self.userO_ready)
+
+	def _game_message(self):
+		"""The game message without time_stamp. It is only rebuilt and
+		serialized when the game has changed."""
+		key = self._message_key()
+		if key == self._cached_key:
+			return self._cached_message
+
 		game_update = {
 		    'key': self.key,
 		    'userX': self.userX.id,
@@ -93,17 +178,110 @@ class Game():
 		    'userOname': '' if not self.userO else self.userO.name,
 		    'userOReady': self.userO_ready,
 		    'seq': self.seq,
-		    'state': self.state,
-		    'time_stamp': time.time()
+		    'state': self.state
 		}
 
 		if self.winner is not None:
 			game_update["winner"] = self.winner
 
-		for piece in self.all_piece_ids:
-			game_update[piece] = getattr(self, piece)
-
-		return json.dumps(game_update)
+		for piece_key, piece in zip(PIECE_IDS, self.pieces):
+			game_update[piece_key] = "" if piece is None else piece.state()
+
+		self._cached_key = key
+		self._cached_message = game_update
+		self._cached_json = None
+		self._cached_binary = None
+		return game_update
+
+	def _json_message(self):
+		"""The serialized game message, split where with_time_stamp adds
+		time_stamp."""
+		if self._cached_json is None:
+			self._cached_json = split_json_message(self._cached_message)
+		return self._cached_json
+
+	def get_binary_message(self):
+		"""The game message as a binary state frame."""
+		self._game_message()
+		return protocol.pack_frame(protocol.FRAME_STATE, self.clock.time(),
+		                           self._binary_state())
+
+	def _binary_state(self):
+		if self._cached_binary is None:
+			self._cached_binary = protocol.pack_state(self._cached_message,
+			                                          self.pieces)
+		return self._cached_binary
+
+	def add_observer(self,
+	                 ws,
+	                 user_id=None,
+	                 delta=False,
+	                 binary=False,
+	                 deflate=False):
+		"""Sends the game updates to ws. With delta, ws gets a full message
+		first and then only the fields that change. With binary, the
+		updates are sent as binary frames (see protocol.py) instead of
+		JSON, and with deflate as well, the frames are compressed. deflate
+		is ignored for JSON observers, which can only be compressed per
+		connection, with permessage-deflate.
+
+		If user_id already observes the game, the old connection is
+		disconnected."""
+		if user_id is not None:
+			old = self._observer_by_user.get(user_id)
+			if old is not None and old is not ws:
+				self.remove_observer(old)
+				old.disconnect()
+			self._observer_by_user[user_id] = ws
+		self.observers[ws] = user_id
+		if binary:
+			self.binary_observers.add(ws)
+			if deflate:
+				self.deflate_observers.add(ws)
+		if delta:
+			self.delta_observers.add(ws)
+			self.needs_snapshot.add(ws)
+
+	def remove_observer(self, ws):
+		"""Stops sending updates to ws. Does nothing if ws does not observe
+		the game."""
+		user_id = self.observers.pop(ws, None)
+		if self._observer_by_user.get(user_id) is ws:
+			del self._observer_by_user[user_id]
+		self.delta_observers.discard(ws)
+		self.needs_snapshot.discard(ws)
+		self.binary_observers.discard(ws)
+		self.deflate_observers.discard(ws)
+
+	def take_observers(self, game):
+		"""Moves all observers of game, which this game replaces, to this
+		game."""
+		self.observers = game.observers
+		self._observer_by_user = game._observer_by_user
+		self.delta_observers = game.delta_observers
+		self.binary_observers = game.binary_observers
+		self.deflate_observers = game.deflate_observers
+		# Updates queued by the old game are not sent.
+		game.observers = {}
+		game._observer_by_user = {}
+		game.delta_observers = set()
+		game.needs_snapshot = set()
+		game.binary_observers = set()
+		game.deflate_observers = set()
+		# Nor are they published, as the other processes would take the old
+		# state for the state of this game, which has the same key.
+		if game._queued_update is not None:
+			game._queued_update.cancel()
+			game._queued_update = None
+		game.bus = None
+
+	@property
+	def observer_count(self):
+		return len(self.observers)
+
+	def request_snapshot(self, ws):
+		"""The next update sent to ws will be a full message."""
+		self.needs_snapshot.add(ws)
 
 	def move(self, user, from_pos, to_pos):
 		logging.info("Request to move from " + from_pos + " to " + to_pos)
@@ -125,10 +303,7 @@ class Game():
 			log_error(self, "User not part of the game tried to move piece.")
 			raise HttpCodeException(403)
 
-		pieces = []
-		for price_id in self.all_piece_ids:
-			pieces.append(getattr(self, price_id))
-		b = board.Board(pieces)
+		b = self.board
 
 		if not b.is_valid_position(from_pos):
 			log_error(self, str(from_pos) + " is not a valid position.")
@@ -155,22 +330,15 @@ class Game():
 			# users click in the game.
 			return False
 
-		has_moved = False
-		for piece_id in self.all_piece_ids:
-			state = getattr(self, piece_id)
-			if len(state) == 0:
-				continue
-
-			piece = Piece(state)
-			if not piece.moving and piece.pos == from_pos:
-				piece.move(to_pos, time.time())
-				setattr(self, piece_id, piece.state())
-				has_moved = True
-				logging.info("Moved " + str(piece) + " from " + from_pos +
-				             " to " + piece.pos)
-				break
-
-		assert has_moved
+		piece_id = self.standing[SQUARE_INDEX[from_pos]]
+		piece = self.pieces[piece_id]
+		self._lift(piece_id, piece)
+		piece.move(to_pos, self.clock.time())
+		self._place(piece_id, piece)
+		heapq.heappush(self.timers, (piece.end_time, piece_id))
+		self.pieces_version += 1
+		logging.info("Moved " + str(piece) + " from " + from_pos + " to " +
+		             piece.pos)
 
 		self.put()
 		return True
@@ -187,27 +355,91 @@ class Game():
 		for i in range(8):
 			j = random.randint(i, 7)
 			if i != j:
-				p1 = Piece(getattr(self, "p" + str(i)))
-				p2 = Piece(getattr(self, "p" + str(j)))
-				p1.pos, p2.pos = p2.pos, p1.pos
-				setattr(self, "p" + str(i), p1.state())
-				setattr(self, "p" + str(j), p2.state())
-
-				p1 = Piece(getattr(self, "p" + str(16 + i)))
-				p2 = Piece(getattr(self, "p" + str(16 + j)))
-				p1.pos, p2.pos = p2.pos, p1.pos
-				setattr(self, "p" + str(16 + i), p1.state())
-				setattr(self, "p" + str(16 + j), p2.state())
+				p1, p2 = self.pieces[i], self.pieces[j]
+				p1.square, p2.square = p2.square, p1.square
+
+				p1, p2 = self.pieces[16 + i], self.pieces[16 + j]
+				p1.square, p2.square = p2.square, p1.square
+		self._index_pieces()
+		self.pieces_version += 1
 
 		self.put()
 
+	async def queue_update(self):
+		"""Sends an update after broadcast_window. All updates queued until
+		then are sent as one update with the latest state."""
+		if self.broadcast_window is None:
+			await self.send_update()
+		elif self._queued_update is None:
+			self._queued_update = asyncio.get_event_loop().call_later(
+			    self.broadcast_window, self._send_queued_update)
+
+	def _send_queued_update(self):
+		self._queued_update = None
+		asyncio.ensure_future(self.send_update())
+
 	async def send_update(self):
-		message = self.get_game_message()
-		tasks = []
+		if self._queued_update is not None:
+			# This update includes the queued one.
+			self._queued_update.cancel()
+			self._queued_update = None
+
+		message = self._game_message()
+		time_stamp = self.clock.time()
+		if self.bus is not None:
+			self.bus.publish(
+			    self.key,
+			    with_time_stamp(self._json_message(),
+			                    time_stamp).encode("utf-8"))
+		self._send_to_observers(message, time_stamp)
+
+	def _send_to_observers(self, message, time_stamp):
+		# Each kind of update is encoded and compressed once, when first
+		# needed, and the same object is sent to all observers of that kind.
+		updates = {}
+
+		# The observers are connection.Connection objects, which queue the
+		# update without waiting for the client.
 		for ws in self.observers:
 			if not ws.closed:
-				tasks.append(ws.send_str(message))
-		await asyncio.gather(*tasks)
+				binary = ws in self.binary_observers
+				delta = (self.last_sent is not None
+				         and ws in self.delta_observers
+				         and ws not in self.needs_snapshot)
+				kind = (binary, delta, ws in self.deflate_observers)
+				if kind not in updates:
+					updates[kind] = self._encode_update(
+					    message, time_stamp, *kind)
+				ws.send(*updates[kind])
+		self.last_sent = message
+		self.needs_snapshot.clear()
+
+	def _encode_update(self, message, time_stamp, binary, delta, deflate):
+		"""Returns the update and whether it is a full update."""
+		previous = self.last_sent
+		if not binary:
+			if delta:
+				return speedups.json_dumps(
+				    delta_message(previous, message, time_stamp)), False
+			return with_time_stamp(self._json_message(), time_stamp), True
+
+		if delta and all(previous[field] == message[field]
+		                 for field in protocol.STRING_FIELDS):
+			changed = [(piece_id, self.pieces[piece_id])
+			           for piece_id, key in enumerate(PIECE_IDS)
+			           if previous[key] != message[key]]
+			frame = protocol.pack_frame(
+			    protocol.FRAME_DELTA, time_stamp,
+			    protocol.pack_delta(message, previous["seq"], changed))
+			full = False
+		else:
+			# The strings are only sent in full frames.
+			frame = protocol.pack_frame(protocol.FRAME_STATE, time_stamp,
+			                            self._binary_state())
+			full = True
+		if deflate:
+			frame = protocol.deflate_frame(frame)
+		return frame, full
 
 	async def set_ready(self, user_id, ready):
 		logging.info("set_ready(): user_id      =" + user_id)
@@ -232,112 +464,238 @@ class Game():
 	def update(self):
 		self.captured_positions_during_init = set()
 
-		# Update pieces two times to be able to move from moving → sleeping
-		# and then sleeping → normal.
-		current_time = time.time()
+		current_time = self.clock.time()
 		if self.debug_no_time:
 			# Advance time a lot to make all updates happen.
 			current_time += 365 * 24 * 60 * 60
-		self._finish_all_moves(current_time)
-		self._update_pieces(current_time)
-		self._update_pieces(current_time)
-
-		# Check to see if the kings are still around.
-		self.winner = None
+		due_piece_ids = self._pop_due_timers(current_time)
+		if due_piece_ids:
+			self._finish_all_moves(current_time, due_piece_ids)
+			self._update_pieces(current_time, due_piece_ids)
+			self.pieces_version += 1
+
+		# Check to see if the kings are still around. The winner is kept
+		# when the game is updated again after it is over.
 		if self.state != STATE_GAMEOVER:
-			whiteKing = self.p4
-			blackKing = self.p20
+			self.winner = None
+			whiteKing = self.pieces[WHITE_KING]
+			blackKing = self.pieces[BLACK_KING]
 
-			if whiteKing == "":
+			if whiteKing is None:
 				self.state = STATE_GAMEOVER
 				self.winner = BLACK
-			elif blackKing == "":
+			elif blackKing is None:
 				self.state = STATE_GAMEOVER
 				self.winner = WHITE
 
+	def next_timer(self):
+		"""The time when the next piece arrives or wakes up, or None if no
+		pieces are moving or sleeping."""
+		while self.timers:
+			end_time, piece_id = self.timers[0]
+			piece = self.pieces[piece_id]
+			if piece is not None and piece.end_time == end_time:
+				return end_time
+			heapq.heappop(self.timers)
+		return None
+
+	def _index_pieces(self):
+		"""Indexes from square to the id of the piece standing (static or
+		sleeping) there and to the ids of the pieces moving there, and the
+		board used to validate moves. Both are kept up to date by _lift and
+		_place when pieces change."""
+		self.standing = [None] * 64
+		self.arriving = [[] for sq in range(64)]
+		self.board = board.BitBoard([])
+		for piece_id, piece in enumerate(self.pieces):
+			if piece is not None:
+				self._place(piece_id, piece)
+
+	def _place(self, piece_id, piece):
+		if piece.moving:
+			self.arriving[piece.square].append(piece_id)
+		else:
+			assert self.standing[piece.square] is None
+			self.standing[piece.square] = piece_id
+		self.board.add(piece)
+
+	def _lift(self, piece_id, piece):
+		if piece.moving:
+			self.arriving[piece.square].remove(piece_id)
+		else:
+			self.standing[piece.square] = None
+		self.board.remove(piece)
+
 	def _finish_move(self, piece_id, piece, current_time):
+		sq = piece.square
+		others = [other for other in self.arriving[sq] if other != piece_id]
+		if self.standing[sq] is not None:
+			others.append(self.standing[sq])
+		if not others:
+			return
 
 		captured = False
-		for piece_id2 in self.all_piece_ids:
-			if piece_id2 != piece_id:
-				state = getattr(self, piece_id2)
-				if len(state) == 0:
-					continue
-				piece2 = Piece(state)
-
-				if piece.pos == piece2.pos:
-					if piece.color == piece2.color:
-						log_error(
-						    self,
-						    str(piece) + " and " + str(piece2) +
-						    " occupy the same square.")
-						raise HttpCodeException(500)
-
-					# Pieces occupy the same square. If the other piece is not
-					# moving, it is captured.
-
-					if not piece2.moving:
-						# The other piece is not moving. This case is easy.
-						assert not captured
+		for piece_id2 in sorted(others):
+			piece2 = self.pieces[piece_id2]
+			if piece2 is not None:
+				if piece.color == piece2.color:
+					log_error(
+					    self,
+					    str(piece) + " and " + str(piece2) +
+					    " occupy the same square.")
+					raise HttpCodeException(500)
+
+				# Pieces occupy the same square. If the other piece is not
+				# moving, it is captured.
+
+				if not piece2.moving:
+					# The other piece is not moving. This case is easy.
+					assert not captured
+					self._capture(piece_id2, piece2)
+					captured = True
+
+				# Otherwise, we look to see if the other piece already has arrived.
+				elif piece2.end_time <= current_time:
+					assert not captured
+					captured = True
+					# The piece arriving first is captured.
+					if piece.end_time < piece2.end_time:
+						self._capture(piece_id, piece)
+					else:
 						self._capture(piece_id2, piece2)
-						captured = True
-
-					# Otherwise, we look to see if the other piece already has arrived.
-					elif piece2.end_time <= current_time:
-						assert not captured
-						captured = True
-						# The piece arriving first is captured.
-						if piece.end_time < piece2.end_time:
-							self._capture(piece_id, piece)
-						else:
-							self._capture(piece_id2, piece2)
 
 	def _capture(self, piece_id, piece):
 		logging.info(str(piece) + " at " + piece.pos + " is captured.")
 		self.captured_positions_during_init.add(piece.pos)
-		setattr(self, piece_id, "")
-
-	def _finish_all_moves(self, current_time):
+		self._lift(piece_id, piece)
+		self.pieces[piece_id] = None
+
+	def _pop_due_timers(self, current_time):
+		"""Removes the timers that have expired and returns the ids of their
+		pieces, in increasing order."""
+		piece_ids = set()
+		while self.timers and self.timers[0][0] <= current_time:
+			end_time, piece_id = heapq.heappop(self.timers)
+			piece = self.pieces[piece_id]
+			if piece is not None and piece.end_time == end_time:
+				piece_ids.add(piece_id)
+		return sorted(piece_ids)
+
+	def _finish_all_moves(self, current_time, piece_ids):
 		"""Performs all captures, but does not do any transitions to sleeping."""
-		for piece_id in self.all_piece_ids:
-			state = getattr(self, piece_id)
-			if len(state) == 0:
+		for piece_id in piece_ids:
+			piece = self.pieces[piece_id]
+			if piece is None:
 				continue
-			piece = Piece(state)
 			if piece.moving:
 				if piece.end_time <= current_time:
 					self._finish_move(piece_id, piece, current_time)
 
-	def _update_pieces(self, current_time):
-		"""Performs piece state transitions."""
-		for piece_id in self.all_piece_ids:
-			state = getattr(self, piece_id)
-			if len(state) == 0:
+	def _update_pieces(self, current_time, piece_ids):
+		"""Performs piece state transitions. A piece may go from moving to
+		sleeping and then to static in the same call."""
+		for piece_id in piece_ids:
+			piece = self.pieces[piece_id]
+			if piece is None:
 				continue
-			piece = Piece(state)
 
 			if piece.moving:
 				if piece.end_time <= current_time:
+					self._lift(piece_id, piece)
 					piece.sleep()
-					setattr(self, piece_id, piece.state())
-			elif piece.sleeping:
+					self._place(piece_id, piece)
+					if piece.end_time > current_time:
+						heapq.heappush(self.timers, (piece.end_time, piece_id))
+			if piece.sleeping:
 				if piece.end_time <= current_time:
 					piece.static()
-					setattr(self, piece_id, piece.state())
+
+
+def split_json_message(message):
+	"""Serializes a game message without time_stamp as (head, tail): the
+	JSON object up to and including state, and the rest of it."""
+	fields = list(message.items())
+	split = [key for key, _ in fields].index('state') + 1
+	head = speedups.json_dumps(dict(fields[:split]))[:-1]
+	tail = speedups.json_dumps(dict(fields[split:]))[1:]
+	return head, tail
+
+
+def with_time_stamp(json_message, time_stamp):
+	"""Joins a message from split_json_message with time_stamp after
+	state, where the game message had it before it was cached."""
+	head, tail = json_message
+	text = head + ', "time_stamp": ' + speedups.json_dumps(time_stamp)
+	if tail == '}':
+		return text + tail
+	return text + ', ' + tail
+
+
+def delta_message(previous, message, time_stamp):
+	"""The fields of message that differ from previous. delta_from is the
+	seq of previous, which the client must have to apply the delta."""
+	delta = {
+	    'key': message['key'],
+	    'seq': message['seq'],
+	    'delta_from': previous['seq'],
+	    'time_stamp': time_stamp
+	}
+	for key, value in message.items():
+		if previous.get(key) != value:
+			delta[key] = value
+	return delta
+
+
+class GameMirror(Game):
+	"""A game owned by another process. It receives the game messages
+	from a bus (see pubsub.py) and sends them to its own observers, in
+	the same formats as the game."""
+
+	def __init__(self, key, clock=None):
+		super().__init__(key, clock)
+		self._time_stamp = None
+
+	def receive(self, data):
+		message = speedups.json_loads(data.decode("utf-8"))
+		self._time_stamp = message.pop("time_stamp")
+		self.pieces = [
+		    Piece.from_state(message[piece_key]) if message[piece_key] else None
+		    for piece_key in PIECE_IDS
+		]
+		self._cached_message = message
+		self._cached_json = None
+		self._cached_binary = None
+		self._send_to_observers(message, self._time_stamp)
+
+	def _game_message(self):
+		return self._cached_message
+
+	async def send_update(self):
+		"""Sends the last message again, e.g. after request_snapshot."""
+		if self._cached_message is not None:
+			self._send_to_observers(self._cached_message, self._time_stamp)
+
+
+def _game_link(key, name):
+	return """<a href="/?g=%s">%s</a><br />\n""" % (key, name)
 
 
 class RecentGamesList:
-	def __init__(self, joinable_games, observable_games, returnable_games):
+	def __init__(self,
+	             joinable_games,
+	             observable_games,
+	             returnable_games,
+	             links=None):
 		self.joinable_games = joinable_games
 		self.observable_games = observable_games
 		self.returnable_games = returnable_games
+		# The rendered link of each game, by key.
+		self.links = links or {}
 
 	def html(self, games, exclude=None):
-		text = ""
-		for key, name in games:
-			if key != exclude:
-				text += """<a href="/?g=%s">%s</a><br />\n""" % (key, name)
-		return text
+		return "".join(
+		    self.links.get(key) or _game_link(key, name) for key, name in games
+		    if key != exclude)
 
 	def joinable_html(self, exclude=None):
 		return self.html(self.joinable_games, exclude)
@@ -349,21 +707,132 @@ class RecentGamesList:
 		return self.html(self.returnable_games, exclude)
 
 
+# A player as stored in GameDirectory.
+Player = collections.namedtuple("Player", "id name")
+# A game as stored in GameDirectory, with the fields used by get_recent.
+GameSummary = collections.namedtuple("GameSummary",
+                                     "key creation_time userX userO")
+
+
+class GameDirectory:
+	"""The games of all worker processes, for the lobby. Each worker
+	writes its own games to a shared SQLite database."""
+
+	def __init__(self, path):
+		self.conn = sqlite3.connect(path)
+		self.conn.execute("""CREATE TABLE IF NOT EXISTS
+		                  game(key STRING PRIMARY KEY NOT NULL,
+		                       creation_time REAL NOT NULL,
+		                       userX_id STRING NOT NULL,
+		                       userX_name STRING NOT NULL,
+		                       userO_id STRING,
+		                       userO_name STRING);""")
+		self.conn.commit()
+		# Number of commits from this connection.
+		self._commits = 0
+
+	def put(self, game):
+		userO = game.userO
+		self.conn.execute(
+		    "INSERT OR REPLACE INTO game VALUES (?, ?, ?, ?, ?, ?);",
+		    (game.key, game.creation_time.timestamp(), game.userX.id,
+		     game.userX.name, userO.id if userO else None,
+		     userO.name if userO else None))
+		self._commit()
+
+	def delete(self, keys):
+		self.conn.executemany("DELETE FROM game WHERE key = ?;",
+		                      [(key, ) for key in keys])
+		self._commit()
+
+	def contains(self, key):
+		return self.conn.execute("SELECT 1 FROM game WHERE key = ? LIMIT 1;",
+		                         (key, )).fetchone() is not None
+
+	def clear(self):
+		self.conn.execute("DELETE FROM game;")
+		self._commit()
+
+	def _commit(self):
+		self.conn.commit()
+		self._commits += 1
+
+	def version(self):
+		"""Changes when the games change."""
+		# data_version only changes with the commits of other connections.
+		data_version, = self.conn.execute("PRAGMA data_version;").fetchone()
+		return data_version, self._commits
+
+	def recent(self, limit):
+		"""Returns the GameSummary of the newest games."""
+		cur = self.conn.execute(
+		    "SELECT * FROM game ORDER BY creation_time DESC LIMIT ?;",
+		    (limit, ))
+		return [
+		    GameSummary(key, datetime.datetime.fromtimestamp(creation_time),
+		                Player(x_id, x_name),
+		                Player(o_id, o_name) if o_id is not None else None)
+		    for key, creation_time, x_id, x_name, o_id, o_name in
+		    cur.fetchall()
+		]
+
+
 class GameManager:
-	def __init__(self):
+	"""Creates and keeps the games of this process.
+
+	When the server runs in several worker processes (see router.py), each
+	worker only creates the keys for which owns_key returns True, and the
+	lobby lists the games of all workers from directory.
+	"""
+
+	def __init__(self,
+	             clock=None,
+	             broadcast_window=DEFAULT_BROADCAST_WINDOW,
+	             owns_key=None,
+	             directory=None,
+	             bus=None):
 		self._games = {}
+		self.clock = clock or RealClock()
+		self.broadcast_window = broadcast_window
+		self.owns_key = owns_key
+		self.directory = directory
+		# With a bus, the games publish their updates, and the observers of
+		# games in other processes are served by mirrors.
+		self.bus = bus
+		self._mirrors = {}
+		# (game, name, link) of the newest games, shared by the lobbies of
+		# all users until the games change.
+		self._recent = None
+		self._directory_version = None
+		self._next_cleanup = datetime.datetime.min
 
 	def new(self, user, key=None):
-		# Use this in Python 3.6+
-		# key = secrets.token_hex(128)
 		if not key:
-			key = os.urandom(8).hex()
-		game = Game(key)
+			key = self._new_key()
+		game = Game(key, self.clock)
+		game.broadcast_window = self.broadcast_window
+		game.bus = self.bus
 		game.userX = user
 
 		self._games[key] = game
+		self.publish(game)
 		return game, key
 
+	def _new_key(self):
+		while True:
+			# Use this in Python 3.6+
+			# key = secrets.token_hex(128)
+			key = os.urandom(8).hex()
+			if not self.owns_key or self.owns_key(key):
+				return key
+
+	def publish(self, game):
+		"""Shows the current players of game in the lobby of all
+		workers."""
+		self._recent = None
+		if self.directory:
+			self.directory.put(game)
+
 	def get(self, key):
 		game = self._games.get(key, None)
 		if not game:
@@ -371,32 +840,51 @@ class GameManager:
 		game.update()
 		return game
 
-	def get_recent(self, user, exclude_key=None):
-		too_old_games = []
-		for key, game in self._games.items():
-			if (game.creation_time <=
-			    datetime.datetime.now() - datetime.timedelta(minutes=60)):
-				too_old_games.append(key)
-		for key in too_old_games:
-			del self._games[key]
+	def mirror(self, key):
+		"""Returns a mirror of a game in another process, or None if there
+		is no bus or no such game."""
+		if not self.bus or key in self._games:
+			return None
+		mirror = self._mirrors.get(key)
+		if mirror is None:
+			if self.directory and not self.directory.contains(key):
+				return None
+			mirror = GameMirror(key, self.clock)
+			self._mirrors[key] = mirror
+			self.bus.subscribe(key, mirror.receive)
+		return mirror
+
+	def release_mirror(self, key):
+		"""Deletes the mirror of key if it has no observers left."""
+		mirror = self._mirrors.get(key)
+		if mirror is not None and not mirror.observer_count:
+			self.bus.unsubscribe(key, mirror.receive)
+			del self._mirrors[key]
+
+	def observer_counts(self):
+		"""Returns the number of observers of each game that has any."""
+		games = list(self._games.items()) + list(self._mirrors.items())
+		return {
+		    key: game.observer_count
+		    for key, game in games if game.observer_count
+		}
 
-		all_games = list(self._games.values())
-		all_games.sort(key=lambda g: g.creation_time, reverse=True)
+	def get_recent(self, user, exclude_key=None):
+		now = datetime.datetime.now()
+		if now >= self._next_cleanup:
+			self._next_cleanup = now + CLEANUP_INTERVAL
+			self._delete_old_games(now)
 
 		joinable_games = []
 		observable_games = []
 		returnable_games = []
+		links = {}
 
-		for game in all_games[:20]:
-			if (game.creation_time <=
-			    datetime.datetime.now() - datetime.timedelta(minutes=2)):
+		for game, name, link in self._recent_games():
+			if game.creation_time <= now - RECENT_AGE:
 				continue
 			key = game.key
-
-			if game.userO:
-				name = (game.userX.name + " vs. " + game.userO.name)
-			else:
-				name = game.userX.name
+			links[key] = link
 
 			if game.userX.id == user.id or (game.userO is not None
 			                                and game.userO.id == user.id):
@@ -412,7 +900,45 @@ class GameManager:
 				# This is a game with two other players.
 				observable_games.append((key, name))
 
-			logging.info("Found game " + name + " (" + key + ") created at " +
-			             str(game.creation_time) + ".")
 		return RecentGamesList(joinable_games, observable_games,
-		                       returnable_games)
+		                       returnable_games, links)
+
+	def _delete_old_games(self, now):
+		too_old_games = [
+		    key for key, game in self._games.items()
+		    if game.creation_time <= now - MAX_AGE
+		]
+		if not too_old_games:
+			return
+		for key in too_old_games:
+			del self._games[key]
+		self._recent = None
+
+		if self.bus:
+			for key in too_old_games:
+				self.bus.forget(key)
+		if self.directory:
+			self.directory.delete(too_old_games)
+
+	def _recent_games(self):
+		if self.directory:
+			# The other workers change the directory too.
+			version = self.directory.version()
+			if version != self._directory_version:
+				self._directory_version = version
+				self._recent = None
+		if self._recent is None:
+			if self.directory:
+				games = self.directory.recent(RECENT_GAMES)
+			else:
+				games = heapq.nlargest(RECENT_GAMES,
+				                       self._games.values(),
+				                       key=lambda g: g.creation_time)
+			self._recent = []
+			for game in games:
+				if game.userO:
+					name = (game.userX.name + " vs. " + game.userO.name)
+				else:
+					name = game.userX.name
+				self._recent.append((game, name, _game_link(game.key, name)))
+		return self._recent
@@ -0,0 +1,573 @@
+import asyncio
+import datetime
+import json
+import unittest
+
+import auth
+import board
+import clock
+import constants
+import game_storage
+import protocol
+import pubsub
+import testutil
+from protocol import SQUARE_INDEX
+from testutil import FakeConnection
+
+
+class GameTestBase(unittest.TestCase):
+	def setUp(self):
+		self.white, self.black = testutil.players()
+		self.clock = clock.VirtualClock(testutil.START_TIME)
+		self.game = game_storage.Game("key", self.clock)
+		testutil.start_game(self.game, self.white, self.black)
+
+	def assertBoardUpToDate(self):
+		expected = board.BitBoard(self.game.pieces)
+		self.assertEqual(self.game.board.pieces, expected.pieces)
+		self.assertEqual(self.game.board.occupied, expected.occupied)
+		self.assertEqual(self.game.board.moving, expected.moving)
+
+	def send_update(self):
+		loop = asyncio.new_event_loop()
+		loop.run_until_complete(self.game.send_update())
+		loop.close()
+
+	def piece_at(self, pos):
+		"""The piece standing at pos or, if none, moving there."""
+		for piece in self.game.pieces:
+			if piece is not None and piece.pos == pos and not piece.moving:
+				return piece
+		for piece in self.game.pieces:
+			if piece is not None and piece.pos == pos:
+				return piece
+		return None
+
+
+class TestTimers(GameTestBase):
+	def test_no_timers_at_start(self):
+		self.assertEqual(self.game.timers, [])
+
+	def test_move_adds_timer(self):
+		self.assertTrue(self.game.move(self.white, "A2", "A4"))
+		self.assertEqual(len(self.game.timers), 1)
+		end_time, piece_id = self.game.timers[0]
+		self.assertEqual(self.game.pieces[piece_id].end_time, end_time)
+
+		# Not due yet.
+		self.game.update()
+		self.assertTrue(self.piece_at("A4").moving)
+		self.assertEqual(len(self.game.timers), 1)
+
+	def test_update_handles_due_timers(self):
+		self.game.move(self.white, "A2", "A4")
+		self.game.debug_no_time = True
+		self.game.update()
+		piece = self.piece_at("A4")
+		self.assertFalse(piece.moving)
+		self.assertFalse(piece.sleeping)
+		self.assertEqual(self.game.timers, [])
+
+	def test_winner_is_kept(self):
+		self.game.pieces[game_storage.BLACK_KING] = None
+		self.game.update()
+		self.assertEqual(constants.STATE_GAMEOVER, self.game.state)
+		self.assertEqual(constants.WHITE, self.game.winner)
+		self.game.update()
+		self.assertEqual(constants.WHITE, self.game.winner)
+
+
+class TestVirtualClock(GameTestBase):
+	def test_move_sleep_static(self):
+		self.game.move(self.white, "A2", "A4")
+		self.assertEqual(self.piece_at("A4").end_time, 1002.0)
+
+		self.clock.advance(1.5)
+		self.game.update()
+		self.assertTrue(self.piece_at("A4").moving)
+
+		self.clock.advance(0.5)
+		self.game.update()
+		self.assertTrue(self.piece_at("A4").sleeping)
+
+		self.clock.advance(constants.SLEEPING_TIME)
+		self.game.update()
+		self.assertFalse(self.piece_at("A4").sleeping)
+		self.assertTrue(self.game.move(self.white, "A4", "A5"))
+
+	def test_later_arrival_captures(self):
+		self.game.debug_no_time = True
+		self.game.move(self.white, "E2", "E3")
+		self.game.move(self.white, "D1", "G4")
+		self.game.move(self.black, "D7", "D6")
+		self.game.update()
+		self.game.debug_no_time = False
+
+		# The bishop arrives at D7 after 1.4 seconds, the queen after 4.2.
+		self.game.move(self.black, "C8", "D7")
+		self.game.move(self.white, "G4", "D7")
+		self.clock.advance(1.5)
+		self.game.update()
+		self.assertEqual(self.piece_at("D7").type, constants.BISHOP)
+		self.clock.advance(3.0)
+		self.game.update()
+		self.assertEqual(self.piece_at("D7").type, constants.QUEEN)
+		self.assertEqual(self.piece_at("D7").color, constants.WHITE)
+
+	def test_time_stamp(self):
+		self.clock.advance(0.5)
+		message = json.loads(self.game.get_game_message())
+		self.assertEqual(message["time_stamp"], 1000.5)
+
+
+class TestSquareIndex(GameTestBase):
+	def test_initial(self):
+		self.assertEqual(self.game.standing[SQUARE_INDEX["E1"]],
+		                 game_storage.WHITE_KING)
+		self.assertIsNone(self.game.standing[SQUARE_INDEX["E4"]])
+
+	def test_move_and_capture(self):
+		self.game.debug_no_time = True
+		self.game.move(self.white, "E2", "E4")
+		self.game.move(self.black, "D7", "D5")
+		self.game.update()
+		self.game.debug_no_time = False
+
+		pawn_id = self.game.standing[SQUARE_INDEX["E4"]]
+		self.game.move(self.white, "E4", "D5")
+		self.assertIsNone(self.game.standing[SQUARE_INDEX["E4"]])
+		self.assertEqual(self.game.arriving[SQUARE_INDEX["D5"]], [pawn_id])
+		self.assertBoardUpToDate()
+
+		self.game.debug_no_time = True
+		self.game.update()
+		self.assertEqual(self.game.arriving[SQUARE_INDEX["D5"]], [])
+		self.assertEqual(self.game.standing[SQUARE_INDEX["D5"]], pawn_id)
+		self.assertEqual(self.piece_at("D5").color, constants.WHITE)
+		self.assertEqual(sum(piece is None for piece in self.game.pieces), 1)
+		self.assertBoardUpToDate()
+
+	def test_randomize(self):
+		self.game.state = constants.STATE_START
+		self.game.randomize()
+		self.assertBoardUpToDate()
+		for piece_id, piece in enumerate(self.game.pieces):
+			self.assertEqual(self.game.standing[piece.square], piece_id)
+
+
+class TestMessageCache(GameTestBase):
+	def assertMessageUpToDate(self):
+		message = json.loads(self.game.get_game_message())
+		self.game._cached_key = None
+		self.assertEqual(message, json.loads(self.game.get_game_message()))
+
+	def test_cached_until_changed(self):
+		message = self.game._game_message()
+		self.clock.advance(0.5)
+		self.game.update()
+		self.assertIs(self.game._game_message(), message)
+
+		self.game.move(self.white, "E2", "E4")
+		self.assertIsNot(self.game._game_message(), message)
+		self.assertMessageUpToDate()
+
+	def test_time_stamp_not_cached(self):
+		first = json.loads(self.game.get_game_message())
+		self.clock.advance(0.5)
+		second = json.loads(self.game.get_game_message())
+		self.assertEqual(second["time_stamp"], first["time_stamp"] + 0.5)
+		del first["time_stamp"]
+		del second["time_stamp"]
+		self.assertEqual(first, second)
+
+	def test_same_as_json_dumps(self):
+		# time_stamp follows state, as before the message was cached.
+		message = {}
+		for key, value in self.game._game_message().items():
+			message[key] = value
+			if key == "state":
+				message["time_stamp"] = self.clock.time()
+		self.assertEqual(self.game.get_game_message(), json.dumps(message))
+
+		parts = game_storage.split_json_message({"key": "a", "state": 1})
+		self.assertEqual('{"key": "a", "state": 1, "time_stamp": 2.5}',
+		                 game_storage.with_time_stamp(parts, 2.5))
+
+	def test_piece_transitions(self):
+		self.game.get_game_message()
+		self.game.move(self.white, "E2", "E4")
+		self.game.get_game_message()
+		# The pawn starts sleeping without a new seq.
+		self.clock.advance(2.5)
+		self.game.update()
+		self.assertMessageUpToDate()
+		self.clock.advance(3.0)
+		self.game.update()
+		self.assertMessageUpToDate()
+
+	def test_users_and_ready(self):
+		self.game.state = constants.STATE_START
+		self.game.userO = None
+		self.game.get_game_message()
+		self.game.userO = self.black
+		self.assertMessageUpToDate()
+		self.game.userX_ready = True
+		self.assertMessageUpToDate()
+
+	def test_randomize(self):
+		self.game.state = constants.STATE_START
+		self.game.get_game_message()
+		self.game.randomize()
+		self.assertMessageUpToDate()
+
+
+class TestGameDirectory(unittest.TestCase):
+	def setUp(self):
+		self.directory = game_storage.GameDirectory(":memory:")
+		self.white, self.black = testutil.players()
+		self.other = auth.User("other", 1000, 0, 0)
+
+	def test_owns_key(self):
+		game_manager = game_storage.GameManager(
+		    owns_key=lambda key: key.startswith("a"))
+		for _ in range(10):
+			_, key = game_manager.new(self.white)
+			self.assertTrue(key.startswith("a"))
+
+	def test_shared_lobby(self):
+		managers = [
+		    game_storage.GameManager(directory=self.directory)
+		    for _ in range(2)
+		]
+		game, key = managers[0].new(self.white)
+		recent = managers[1].get_recent(self.black)
+		self.assertEqual([(key, "white")], recent.joinable_games)
+
+		game.userO = self.black
+		managers[0].publish(game)
+		recent = managers[1].get_recent(self.other)
+		self.assertEqual([(key, "white vs. black")], recent.observable_games)
+		recent = managers[1].get_recent(self.black)
+		self.assertEqual([(key, "white vs. black")], recent.returnable_games)
+
+
+class TestRecentGames(unittest.TestCase):
+	def setUp(self):
+		self.game_manager = game_storage.GameManager()
+		self.white, self.black = testutil.players()
+
+	def test_cache(self):
+		game, key = self.game_manager.new(self.white)
+		recent = self.game_manager.get_recent(self.black)
+		self.assertEqual([(key, "white")], recent.joinable_games)
+		self.assertEqual('<a href="/?g=%s">white</a><br />\n' % key,
+		                 recent.joinable_html())
+		self.assertEqual("", recent.joinable_html(key))
+		cached = self.game_manager._recent
+		self.game_manager.get_recent(self.white)
+		self.assertIs(cached, self.game_manager._recent)
+
+		game.userO = self.black
+		self.game_manager.publish(game)
+		recent = self.game_manager.get_recent(self.black)
+		self.assertEqual([(key, "white vs. black")], recent.returnable_games)
+
+		_, key2 = self.game_manager.new(self.black)
+		recent = self.game_manager.get_recent(self.white)
+		self.assertEqual([(key2, "black")], recent.joinable_games)
+
+	def test_old_games(self):
+		game, key = self.game_manager.new(self.white)
+		self.game_manager.get_recent(self.black)
+		game.creation_time -= game_storage.RECENT_AGE
+		recent = self.game_manager.get_recent(self.black)
+		self.assertEqual([], recent.joinable_games)
+		self.assertIs(game, self.game_manager.get(key))
+
+		game.creation_time -= game_storage.MAX_AGE
+		self.game_manager._next_cleanup = datetime.datetime.min
+		self.game_manager.get_recent(self.black)
+		self.assertIsNone(self.game_manager.get(key))
+
+
+class TestObservers(GameTestBase):
+	def test_remove_observer(self):
+		ws = FakeConnection()
+		self.game.add_observer(ws, delta=True, binary=True)
+		self.assertEqual(1, self.game.observer_count)
+		self.game.remove_observer(ws)
+		self.assertEqual(0, self.game.observer_count)
+		self.assertEqual(set(), self.game.delta_observers)
+		self.assertEqual(set(), self.game.needs_snapshot)
+		self.assertEqual(set(), self.game.binary_observers)
+		self.send_update()
+		self.assertEqual([], ws.messages)
+		# Removing again does nothing.
+		self.game.remove_observer(ws)
+
+	def test_same_user_replaces_connection(self):
+		old_ws = FakeConnection()
+		new_ws = FakeConnection()
+		spectator = FakeConnection()
+		self.game.add_observer(old_ws, user_id=self.white.id)
+		self.game.add_observer(spectator)
+		self.game.add_observer(new_ws, user_id=self.white.id)
+		self.assertTrue(old_ws.closed)
+		self.assertEqual(2, self.game.observer_count)
+		self.send_update()
+		self.assertEqual([], old_ws.messages)
+		self.assertEqual(1, len(new_ws.messages))
+		self.assertEqual(1, len(spectator.messages))
+
+		# The old connection closing later does not remove the new one.
+		self.game.remove_observer(old_ws)
+		self.assertEqual(2, self.game.observer_count)
+
+	def test_take_observers(self):
+		ws = FakeConnection()
+		self.game.add_observer(ws, user_id=self.white.id, binary=True)
+		new_game = game_storage.Game("new", self.game.clock)
+		new_game.take_observers(self.game)
+		self.assertEqual(0, self.game.observer_count)
+		self.assertEqual(1, new_game.observer_count)
+		self.assertIn(ws, new_game.binary_observers)
+		new_game.remove_observer(ws)
+		self.assertEqual(0, new_game.observer_count)
+
+
+class TestGameMirror(GameTestBase):
+	def setUp(self):
+		super().setUp()
+		self.bus = pubsub.LocalBus()
+		self.game.bus = self.bus
+		self.game_manager = game_storage.GameManager(self.clock, bus=self.bus)
+
+	def test_mirror_sends_same_updates(self):
+		mirror = self.game_manager.mirror(self.game.key)
+		local = [FakeConnection() for _ in range(3)]
+		remote = [FakeConnection() for _ in range(3)]
+		for observers, game in [(local, self.game), (remote, mirror)]:
+			game.add_observer(observers[0])
+			game.add_observer(observers[1], delta=True)
+			game.add_observer(observers[2], delta=True, binary=True)
+
+		self.send_update()
+		self.game.move(self.white, "E2", "E4")
+		self.send_update()
+		self.clock.advance(10)
+		self.game.update()
+		self.send_update()
+		for local_ws, remote_ws in zip(local, remote):
+			self.assertEqual(local_ws.messages, remote_ws.messages)
+		self.assertIn("delta_from", remote[2].messages[-1])
+
+	def test_new_mirror_gets_last_state(self):
+		self.game.move(self.white, "E2", "E4")
+		self.send_update()
+		mirror = self.game_manager.mirror(self.game.key)
+		ws = FakeConnection()
+		mirror.add_observer(ws)
+		loop = asyncio.new_event_loop()
+		loop.run_until_complete(mirror.send_update())
+		loop.close()
+		self.assertEqual(ws.messages[0]["p12"], self.game.pieces[12].state())
+
+	def test_release_mirror(self):
+		mirror = self.game_manager.mirror(self.game.key)
+		self.assertIs(mirror, self.game_manager.mirror(self.game.key))
+		ws = FakeConnection()
+		mirror.add_observer(ws)
+		self.game_manager.release_mirror(self.game.key)
+		self.assertIs(mirror, self.game_manager.mirror(self.game.key))
+		mirror.remove_observer(ws)
+		self.game_manager.release_mirror(self.game.key)
+		self.assertEqual({}, self.bus.subscribers)
+
+	def test_no_bus(self):
+		self.assertIsNone(game_storage.GameManager().mirror(self.game.key))
+
+
+class TestDeltaMessages(GameTestBase):
+	def test_full_then_delta(self):
+		ws = FakeConnection()
+		self.game.add_observer(ws, delta=True)
+		self.send_update()
+		self.assertIn("p0", ws.messages[0])
+		self.assertNotIn("delta_from", ws.messages[0])
+
+		self.game.move(self.white, "E2", "E4")
+		self.send_update()
+		delta = ws.messages[1]
+		self.assertEqual(delta["delta_from"], ws.messages[0]["seq"])
+		self.assertEqual(delta["seq"], self.game.seq)
+		self.assertEqual(list(delta),
+		                 ["key", "seq", "delta_from", "time_stamp", "p12"])
+
+	def test_full_observer(self):
+		ws = FakeConnection()
+		self.game.add_observer(ws)
+		self.send_update()
+		self.game.move(self.white, "E2", "E4")
+		self.send_update()
+		self.assertEqual(ws.messages[1],
+		                 json.loads(self.game.get_game_message()))
+
+	def test_snapshot(self):
+		ws = FakeConnection()
+		self.game.add_observer(ws, delta=True)
+		self.send_update()
+		self.game.request_snapshot(ws)
+		self.send_update()
+		self.assertIn("p0", ws.messages[1])
+		self.send_update()
+		self.assertNotIn("p0", ws.messages[2])
+
+	def test_applying_deltas(self):
+		full_ws = FakeConnection()
+		delta_ws = FakeConnection()
+		self.game.add_observer(full_ws)
+		self.game.add_observer(delta_ws, delta=True)
+		self.send_update()
+		state = dict(delta_ws.messages[0])
+		for frm, to in [("E2", "E4"), ("D7", "D5"), ("E4", "D5")]:
+			user = self.white if frm[1] in "24" else self.black
+			self.game.move(user, frm, to)
+			self.send_update()
+			self.clock.advance(10)
+			self.game.update()
+			self.send_update()
+		for message in delta_ws.messages[1:]:
+			state.update(message)
+		del state["delta_from"]
+		self.assertEqual(state, full_ws.messages[-1])
+
+
+class TestBroadcastWindow(GameTestBase):
+	def setUp(self):
+		super().setUp()
+		self.ws = FakeConnection()
+		self.game.add_observer(self.ws)
+
+	def run_moves(self, moves, wait):
+		async def run():
+			for user, frm, to in moves:
+				self.game.move(user, frm, to)
+				await self.game.queue_update()
+			await asyncio.sleep(wait)
+
+		loop = asyncio.new_event_loop()
+		loop.run_until_complete(run())
+		loop.close()
+
+	def test_merged_in_same_iteration(self):
+		self.run_moves([(self.white, "E2", "E4"), (self.black, "E7", "E5")],
+		               0.01)
+		self.assertEqual(len(self.ws.messages), 1)
+		self.assertEqual(self.ws.messages[0]["seq"], self.game.seq)
+
+	def test_no_window(self):
+		self.game.broadcast_window = None
+		self.run_moves([(self.white, "E2", "E4"), (self.black, "E7", "E5")], 0)
+		self.assertEqual(len(self.ws.messages), 2)
+
+	def test_not_sent_before_window(self):
+		self.game.broadcast_window = 10.0
+		self.run_moves([(self.white, "E2", "E4")], 0.01)
+		self.assertEqual(self.ws.messages, [])
+
+	def test_send_update_includes_queued(self):
+		async def run():
+			self.game.move(self.white, "E2", "E4")
+			await self.game.queue_update()
+			await self.game.send_update()
+			await asyncio.sleep(0.01)
+
+		loop = asyncio.new_event_loop()
+		loop.run_until_complete(run())
+		loop.close()
+		self.assertEqual(len(self.ws.messages), 1)
+
+	def test_replaced_game_sends_nothing(self):
+		bus = pubsub.LocalBus()
+		published = []
+		bus.subscribe(self.game.key, published.append)
+		self.game.bus = bus
+		self.game.state = constants.STATE_GAMEOVER
+		new_game = game_storage.Game(self.game.key, self.clock)
+
+		async def run():
+			await self.game.queue_update()
+			new_game.take_observers(self.game)
+			await asyncio.sleep(0.01)
+
+		loop = asyncio.new_event_loop()
+		loop.run_until_complete(run())
+		loop.close()
+		self.assertEqual(self.ws.messages, [])
+		self.assertEqual(published, [])
+
+
+class TestBinaryMessages(GameTestBase):
+	def test_binary_state(self):
+		ws = FakeConnection()
+		self.game.add_observer(ws, binary=True)
+		self.send_update()
+		self.assertEqual(ws.messages[0],
+		                 json.loads(self.game.get_game_message()))
+		self.assertEqual(protocol.unpack_frame(self.game.get_binary_message()),
+		                 ws.messages[0])
+
+	def test_binary_deltas(self):
+		full_ws = FakeConnection()
+		binary_ws = FakeConnection()
+		self.game.add_observer(full_ws)
+		self.game.add_observer(binary_ws, delta=True, binary=True)
+		self.send_update()
+		state = dict(binary_ws.messages[0])
+		for user, frm, to in [(self.white, "E2", "E4"),
+		                      (self.black, "E7", "E5"),
+		                      (self.white, "D1", "H5")]:
+			self.game.move(user, frm, to)
+			self.send_update()
+			self.clock.advance(10)
+			self.game.update()
+			self.send_update()
+		self.game.userO_ready = True
+		self.send_update()
+		self.assertIn("delta_from", binary_ws.messages[-1])
+		for message in binary_ws.messages[1:]:
+			self.assertNotIn("p0", message)
+			state.update(message)
+		del state["delta_from"]
+		self.assertEqual(state, full_ws.messages[-1])
+
+	def test_deflate_once(self):
+		binary_ws = FakeConnection()
+		deflate_ws = [FakeConnection(), FakeConnection()]
+		self.game.add_observer(binary_ws, binary=True)
+		for ws in deflate_ws:
+			self.game.add_observer(ws, binary=True, deflate=True)
+		self.send_update()
+		frame = deflate_ws[0].frames[0]
+		self.assertEqual(protocol.FRAME_DEFLATE, frame[0])
+		self.assertIs(frame, deflate_ws[1].frames[0])
+		self.assertEqual(binary_ws.messages, deflate_ws[0].messages)
+
+	def test_deflate_only_binary(self):
+		ws = FakeConnection()
+		self.game.add_observer(ws, deflate=True)
+		self.send_update()
+		self.assertIsInstance(ws.frames[0], str)
+
+	def test_user_change_sends_state(self):
+		ws = FakeConnection()
+		self.game.add_observer(ws, delta=True, binary=True)
+		self.send_update()
+		self.game.userO = auth.User("other", 1000, 0, 0)
+		self.send_update()
+		self.assertEqual(ws.messages[1]["userOname"], "other")
+		self.assertNotIn("delta_from", ws.messages[1])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -24,7 +24,7 @@ if __name__ == "__main__":
 	    check=True)
 	check_for_modifications("Python formatter made modifications.")
 
-	JS_FILES = ["game/game.js"]
+	JS_FILES = ["game/game.js", "game/protocol.js"]
 	subprocess.run(
 	    ["prettier", "--write", "--loglevel", "log"] + JS_FILES,
 	    check=True,
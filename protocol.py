@@ -1,32 +1,18 @@
 import math
-import re
+import struct
+import zlib
 
 from constants import *
 
-MOVING_PATTERN = re.compile(r"M,(\d+\.?\d*),([A-H][1-8])")
+# The states a piece can be in.
+STATIC = 0
+MOVING = 1
+SLEEPING = 2
 
-
-def parseMovingPatternMatch(match):
-	assert match is not None
-	end_time, pos = float(match.group(1)), match.group(2)
-	return end_time, pos
-
-
-def createMovingPattern(end_time, pos):
-	return "M," + str(end_time) + "," + pos
-
-
-SLEEPING_PATTERN = re.compile(r"S,(\d+\.?\d*),([A-H][1-8])")
-
-
-def parseSleepingPatternMatch(match):
-	assert match is not None
-	end_time, pos = float(match.group(1)), match.group(2)
-	return end_time, pos
-
-
-def createSleepingPattern(end_time, pos):
-	return "S," + str(end_time) + "," + pos
+# Prefixes of the moving and sleeping states in the string format, e.g.
+# "M,1518694394.674937,B4".
+STATUS_PREFIX = {MOVING: "M", SLEEPING: "S"}
+PREFIX_STATUS = {prefix: status for status, prefix in STATUS_PREFIX.items()}
 
 
 def coord(s):
@@ -45,57 +31,91 @@ def pos(a, i):
 	return chr(a + ord('A')) + str(i + 1)
 
 
+# Squares are indexed as a * 8 + i, where a is the column (A-H) and i is
+# the row (1-8). This makes iterating over the squares in order the same
+# as iterating over the columns and then the rows.
+SQUARE_NAMES = [pos(sq // 8, sq % 8) for sq in range(64)]
+SQUARE_INDEX = {name: sq for sq, name in enumerate(SQUARE_NAMES)}
+
+
 def distance(from_pos, to_pos):
 	fa, fi = coord(from_pos)
 	ta, ti = coord(to_pos)
 	return math.sqrt((fa - ta)**2 + (fi - ti)**2)
 
 
+def square_distance(from_sq, to_sq):
+	da = (from_sq >> 3) - (to_sq >> 3)
+	di = (from_sq & 7) - (to_sq & 7)
+	return math.sqrt(da**2 + di**2)
+
+
 class Piece:
-	def __init__(self, state):
+	"""A piece with its position and state.
+
+	The position is stored as a square index (see SQUARE_NAMES). Pieces are
+	sent to the clients in a string format, e.g. "1,6;B4" for a static
+	white pawn, which is produced by state() and parsed by from_state().
+	"""
+	__slots__ = ("color", "type", "square", "status", "end_time")
+
+	def __init__(self, color, type, square, status=STATIC, end_time=None):
+		self.color = color
+		self.type = type
+		self.square = square
+		self.status = status
+		self.end_time = end_time
+
+	@classmethod
+	def from_state(cls, state):
 		color_type, action = state.split(";")
-		self.color, self.type = color_type.split(",")
-		self.color = int(self.color)
-		self.type = int(self.type)
-
-		moving_match = MOVING_PATTERN.match(action)
-		if moving_match is None:
-			self.moving = False
-			sleeping_match = SLEEPING_PATTERN.match(action)
-			if sleeping_match is None:
-				self.pos = action
-				self.sleeping = False
-			else:
-				self.end_time, self.pos = parseSleepingPatternMatch(
-				    sleeping_match)
-				self.sleeping = True
+		color, type = color_type.split(",")
+		fields = action.split(",")
+		if len(fields) == 1:
+			status = STATIC
+			end_time = None
+		elif len(fields) == 3 and fields[0] in PREFIX_STATUS:
+			status = PREFIX_STATUS[fields[0]]
+			end_time = float(fields[1])
 		else:
-			self.end_time, self.pos = parseMovingPatternMatch(moving_match)
-			self.moving = True
-			self.sleeping = False
+			raise ValueError("Invalid piece state: " + state)
+		square = SQUARE_INDEX.get(fields[-1])
+		if square is None:
+			raise ValueError("Invalid piece position: " + state)
+		return cls(int(color), int(type), square, status, end_time)
+
+	@property
+	def pos(self):
+		return SQUARE_NAMES[self.square]
+
+	@pos.setter
+	def pos(self, pos):
+		self.square = SQUARE_INDEX[pos]
+
+	@property
+	def moving(self):
+		return self.status == MOVING
 
-		assert (not self.sleeping or not self.moving)
+	@property
+	def sleeping(self):
+		return self.status == SLEEPING
 
 	def state(self):
-		repr = str(self.color) + "," + str(self.type)
-		repr += ";"
-		if self.moving:
-			repr += createMovingPattern(self.end_time, self.pos)
-		elif self.sleeping:
-			repr += createSleepingPattern(self.end_time, self.pos)
-		else:
-			repr += self.pos
-		return repr
+		repr = str(self.color) + "," + str(self.type) + ";"
+		if self.status != STATIC:
+			repr += STATUS_PREFIX[self.status] + "," + str(self.end_time) + ","
+		return repr + SQUARE_NAMES[self.square]
 
 	def move(self, to_pos, current_time):
-		seconds_to_move = distance(self.pos, to_pos) / SQUARES_PER_SECOND
+		to_square = SQUARE_INDEX[to_pos]
+		seconds_to_move = square_distance(self.square,
+		                                  to_square) / SQUARES_PER_SECOND
 		self.end_time = current_time + seconds_to_move
-		self.pos = to_pos
-		self.moving = True
-		self.sleeping = False
+		self.square = to_square
+		self.status = MOVING
 
-		a, i = coord(to_pos)
 		# Promotion check.
+		i = to_square & 7
 		if self.type == PAWN and ((self.color == WHITE and i == 7) or
 		                          (self.color == BLACK and i == 0)):
 			self.type = QUEEN
@@ -103,13 +123,11 @@ class Piece:
 	def sleep(self):
 		assert (self.moving)
 		self.end_time += SLEEPING_TIME
-		self.moving = False
-		self.sleeping = True
+		self.status = SLEEPING
 
 	def static(self):
 		self.end_time = None
-		self.moving = False
-		self.sleeping = False
+		self.status = STATIC
 
 	def __str__(self):
 		s = ""
@@ -142,3 +160,179 @@ class Piece:
 
 	def __repr__(self):
 		return "<" + str(self) + ">"
+
+
+# Binary websocket frames, for clients that connect with binary=1. Every
+# frame starts with its type. Integers are big-endian and times are in
+# microseconds.
+#
+# State and delta frames from the server continue with the time stamp and
+# a header with the game fields. A state frame then has all 32 pieces
+# followed by the key and users as strings prefixed by their length. A
+# delta frame has delta_from and only the pieces that changed, prefixed by
+# their id. Command frames from the client use square indices.
+#
+# game/protocol.js decodes the state and delta frames in the browser, which
+# uses them when the page is opened with binary=1. It sends its commands as
+# text, and does not ask for deflate=1.
+#
+# Clients that also connect with deflate=1 get each state or delta frame
+# compressed with zlib, after a FRAME_DEFLATE byte. The server compresses a
+# frame once for all such clients, unlike permessage-deflate, which
+# compresses it again for every connection.
+#
+# A command that exceeds the rate limit is dropped, and the server replies
+# with the one byte frame FRAME_THROTTLED.
+FRAME_STATE = 1
+FRAME_DELTA = 2
+FRAME_MOVE = 3
+FRAME_PING = 4
+FRAME_SNAPSHOT = 5
+FRAME_DEFLATE = 6
+FRAME_THROTTLED = 7
+
+# Status of a piece that has been captured.
+CAPTURED = 0xFF
+
+STRING_FIELDS = ["key", "userX", "userXname", "userO", "userOname"]
+
+_FRAME_HEADER = struct.Struct("!Bq")
+# seq, state, winner, userXReady, userOReady.
+_GAME_HEADER = struct.Struct("!IBBBB")
+# delta_from, number of pieces.
+_DELTA_HEADER = struct.Struct("!IB")
+# status, color and type, square, end_time.
+_ALL_PIECES = struct.Struct("!" + "BBBq" * 32)
+_DELTA_PIECE = struct.Struct("!BBBBq")
+_MOVE = struct.Struct("!BBB")
+
+
+def to_micros(t):
+	return int(round(t * 1000000))
+
+
+def pack_frame(frame_type, time_stamp, body):
+	return _FRAME_HEADER.pack(frame_type, to_micros(time_stamp)) + body
+
+
+def _pack_game_header(message):
+	return _GAME_HEADER.pack(message["seq"], message["state"],
+	                         message.get("winner", 0), message["userXReady"],
+	                         message["userOReady"])
+
+
+def _piece_fields(piece):
+	if piece is None:
+		return CAPTURED, 0, 0, 0
+	end_time = 0 if piece.end_time is None else to_micros(piece.end_time)
+	return (piece.status, piece.color << 4 | piece.type, piece.square,
+	        end_time)
+
+
+def pack_state(message, pieces):
+	"""The body of a state frame for a game message (see
+	Game.get_game_message) and the pieces in it."""
+	fields = []
+	for piece in pieces:
+		fields.extend(_piece_fields(piece))
+	parts = [_pack_game_header(message), _ALL_PIECES.pack(*fields)]
+	for field in STRING_FIELDS:
+		value = message[field].encode("utf-8")
+		parts.append(bytes([len(value)]) + value)
+	return b"".join(parts)
+
+
+def pack_delta(message, delta_from, changed):
+	"""The body of a delta frame. changed is a list of (piece_id, piece)."""
+	parts = [
+	    _pack_game_header(message),
+	    _DELTA_HEADER.pack(delta_from, len(changed))
+	]
+	for piece_id, piece in changed:
+		parts.append(_DELTA_PIECE.pack(piece_id, *_piece_fields(piece)))
+	return b"".join(parts)
+
+
+def _unpack_piece(status, color_type, square, end_time):
+	if status == CAPTURED:
+		return ""
+	return Piece(color_type >> 4, color_type & 15, square, status,
+	             None if status == STATIC else end_time / 1000000).state()
+
+
+def deflate_frame(frame):
+	return bytes([FRAME_DEFLATE]) + zlib.compress(frame)
+
+
+def unpack_frame(data):
+	"""Decodes a state or delta frame to the same dict as the JSON
+	messages."""
+	if data and data[0] == FRAME_DEFLATE:
+		try:
+			data = zlib.decompress(data[1:])
+		except zlib.error as ex:
+			raise ValueError(str(ex))
+	frame_type, time_stamp = _FRAME_HEADER.unpack_from(data)
+	offset = _FRAME_HEADER.size
+	seq, state, winner, x_ready, o_ready = _GAME_HEADER.unpack_from(
+	    data, offset)
+	offset += _GAME_HEADER.size
+	message = {
+	    "seq": seq,
+	    "state": state,
+	    "userXReady": bool(x_ready),
+	    "userOReady": bool(o_ready),
+	    "time_stamp": time_stamp / 1000000,
+	}
+	if winner:
+		message["winner"] = winner
+
+	if frame_type == FRAME_STATE:
+		fields = _ALL_PIECES.unpack_from(data, offset)
+		for piece_id in range(32):
+			message["p" + str(piece_id)] = _unpack_piece(
+			    *fields[4 * piece_id:4 * piece_id + 4])
+		offset += _ALL_PIECES.size
+		for field in STRING_FIELDS:
+			end = offset + 1 + data[offset]
+			message[field] = data[offset + 1:end].decode("utf-8")
+			offset = end
+	elif frame_type == FRAME_DELTA:
+		message["delta_from"], count = _DELTA_HEADER.unpack_from(data, offset)
+		offset += _DELTA_HEADER.size
+		for _ in range(count):
+			piece_id, *fields = _DELTA_PIECE.unpack_from(data, offset)
+			message["p" + str(piece_id)] = _unpack_piece(*fields)
+			offset += _DELTA_PIECE.size
+	else:
+		raise ValueError("Invalid frame type: " + str(frame_type))
+	return message
+
+
+def pack_move(from_pos, to_pos):
+	return _MOVE.pack(FRAME_MOVE, SQUARE_INDEX[from_pos], SQUARE_INDEX[to_pos])
+
+
+def pack_command(frame_type):
+	"""A ping or snapshot command."""
+	return bytes([frame_type])
+
+
+def unpack_command(data):
+	"""Decodes a command frame to its path and query, in the same format
+	as the text commands parsed with urllib.parse."""
+	if not data:
+		raise ValueError("Empty command.")
+	if data[0] == FRAME_MOVE and len(data) == _MOVE.size:
+		_, from_sq, to_sq = _MOVE.unpack(data)
+		if from_sq >= 64 or to_sq >= 64:
+			raise ValueError("Invalid square.")
+		return "/move", {
+		    "from": [SQUARE_NAMES[from_sq]],
+		    "to": [SQUARE_NAMES[to_sq]]
+		}
+	elif data[0] == FRAME_PING and len(data) == 1:
+		return "/ping", {}
+	elif data[0] == FRAME_SNAPSHOT and len(data) == 1:
+		return "/snapshot", {}
+	raise ValueError("Invalid command.")
@@ -0,0 +1,190 @@
+import base64
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+import constants
+import protocol
+
+
+class TestPiece(unittest.TestCase):
+	def test_static(self):
+		p = protocol.Piece.from_state("2,5;B5")
+		self.assertEqual(p.color, constants.BLACK)
+		self.assertEqual(p.type, constants.KING)
+		self.assertEqual(p.pos, "B5")
+		self.assertEqual(p.square, 12)
+		self.assertEqual(p.status, protocol.STATIC)
+		self.assertIsNone(p.end_time)
+		self.assertEqual(p.state(), "2,5;B5")
+
+	def test_moving(self):
+		p = protocol.Piece.from_state("1,6;M,1518694394.674937,B4")
+		self.assertTrue(p.moving)
+		self.assertFalse(p.sleeping)
+		self.assertEqual(p.pos, "B4")
+		self.assertEqual(p.end_time, 1518694394.674937)
+		self.assertEqual(p.state(), "1,6;M,1518694394.674937,B4")
+
+	def test_sleeping(self):
+		p = protocol.Piece.from_state("1,6;S,1518694394.5,H8")
+		self.assertFalse(p.moving)
+		self.assertTrue(p.sleeping)
+		self.assertEqual(p.pos, "H8")
+		self.assertEqual(p.square, 63)
+		self.assertEqual(p.state(), "1,6;S,1518694394.5,H8")
+
+	def test_invalid(self):
+		with self.assertRaises(ValueError):
+			protocol.Piece.from_state("1,6;X,1.5,B4")
+		with self.assertRaises(ValueError):
+			protocol.Piece.from_state("1,6;B9")
+
+	def test_move_sleep_static(self):
+		p = protocol.Piece(constants.WHITE, constants.ROOK, 0)
+		p.move("A4", 100.0)
+		self.assertEqual(p.state(), "1,1;M,103.0,A4")
+		p.sleep()
+		self.assertEqual(
+		    p.state(), "1,1;S," + str(103.0 + constants.SLEEPING_TIME) + ",A4")
+		p.static()
+		self.assertEqual(p.state(), "1,1;A4")
+
+	def test_promotion(self):
+		p = protocol.Piece.from_state("2,6;A2")
+		p.move("A1", 0.0)
+		self.assertEqual(p.type, constants.QUEEN)
+
+
+def game_message(pieces):
+	message = {
+	    "key": "abc",
+	    "userX": "white@anon.com",
+	    "userXname": "white",
+	    "userXReady": True,
+	    "userO": "",
+	    "userOname": "",
+	    "userOReady": False,
+	    "seq": 7,
+	    "state": constants.STATE_PLAY,
+	    "time_stamp": 1518694394.5,
+	}
+	for piece_id, piece in enumerate(pieces):
+		message["p" + str(piece_id)] = "" if piece is None else piece.state()
+	return message
+
+
+class TestBinaryFrames(unittest.TestCase):
+	def setUp(self):
+		self.pieces = [
+		    protocol.Piece.from_state("1,6;M,1518694396.25,B4"),
+		    protocol.Piece.from_state("2,5;S,1518694399.5,H8"),
+		    None,
+		] + [protocol.Piece.from_state("1,1;A1")] * 29
+		self.message = game_message(self.pieces)
+
+	def test_state(self):
+		frame = protocol.pack_frame(
+		    protocol.FRAME_STATE, self.message["time_stamp"],
+		    protocol.pack_state(self.message, self.pieces))
+		self.assertEqual(protocol.unpack_frame(frame), self.message)
+		self.assertLess(len(frame), len(json.dumps(self.message)))
+
+	def test_deflate(self):
+		frame = protocol.pack_frame(
+		    protocol.FRAME_STATE, self.message["time_stamp"],
+		    protocol.pack_state(self.message, self.pieces))
+		deflated = protocol.deflate_frame(frame)
+		self.assertEqual(protocol.unpack_frame(deflated), self.message)
+		self.assertLess(len(deflated), len(frame))
+		with self.assertRaises(ValueError):
+			protocol.unpack_frame(deflated[:10])
+
+	def test_winner(self):
+		self.message["winner"] = constants.BLACK
+		frame = protocol.pack_frame(
+		    protocol.FRAME_STATE, self.message["time_stamp"],
+		    protocol.pack_state(self.message, self.pieces))
+		self.assertEqual(
+		    protocol.unpack_frame(frame)["winner"], constants.BLACK)
+
+	def test_delta(self):
+		frame = protocol.pack_frame(
+		    protocol.FRAME_DELTA, self.message["time_stamp"],
+		    protocol.pack_delta(self.message, 6, [(0, self.pieces[0]),
+		                                          (2, None)]))
+		delta = protocol.unpack_frame(frame)
+		self.assertEqual(delta["delta_from"], 6)
+		self.assertEqual(delta["seq"], 7)
+		self.assertEqual(delta["p0"], self.message["p0"])
+		self.assertEqual(delta["p2"], "")
+		self.assertNotIn("p1", delta)
+		self.assertNotIn("key", delta)
+
+	def test_commands(self):
+		self.assertEqual(
+		    protocol.unpack_command(protocol.pack_move("E2", "E4")),
+		    ("/move", {
+		        "from": ["E2"],
+		        "to": ["E4"]
+		    }))
+		self.assertEqual(
+		    protocol.unpack_command(protocol.pack_command(
+		        protocol.FRAME_PING)), ("/ping", {}))
+		self.assertEqual(
+		    protocol.unpack_command(
+		        protocol.pack_command(protocol.FRAME_SNAPSHOT)),
+		    ("/snapshot", {}))
+
+	def test_invalid_commands(self):
+		for data in [b"", b"\x03\x00", b"\x03\x00\x40", b"\x04\x00", b"\x09"]:
+			with self.assertRaises(ValueError):
+				protocol.unpack_command(data)
+
+
+# Decodes the frames given in base64 as arguments with game/protocol.js.
+DECODE_JS = """
+import {decodeFrame} from "./protocol.mjs";
+const messages = process.argv.slice(1).map(frame => {
+	const data = Buffer.from(frame, "base64");
+	return decodeFrame(new Uint8Array(data).buffer, "key");
+});
+console.log(JSON.stringify(messages));
+"""
+
+
+@unittest.skipIf(shutil.which("node") is None, "Node.js is not installed.")
+class TestJavaScriptDecoder(unittest.TestCase):
+	setUp = TestBinaryFrames.setUp
+
+	def decode(self, *frames):
+		with tempfile.TemporaryDirectory() as tmp:
+			shutil.copy(
+			    os.path.join(os.path.dirname(__file__), "game", "protocol.js"),
+			    os.path.join(tmp, "protocol.mjs"))
+			output = subprocess.check_output(
+			    ["node", "--input-type=module", "-e", DECODE_JS] +
+			    [base64.b64encode(frame).decode() for frame in frames],
+			    cwd=tmp)
+		return json.loads(output)
+
+	def test_same_as_python(self):
+		self.message["winner"] = constants.BLACK
+		state = protocol.pack_frame(
+		    protocol.FRAME_STATE, self.message["time_stamp"],
+		    protocol.pack_state(self.message, self.pieces))
+		delta = protocol.pack_frame(
+		    protocol.FRAME_DELTA, self.message["time_stamp"],
+		    protocol.pack_delta(self.message, 6, [(0, self.pieces[0]),
+		                                          (2, None)]))
+		expected = [protocol.unpack_frame(frame) for frame in [state, delta]]
+		# The delta frames do not contain the key. The client knows it.
+		expected[1]["key"] = "key"
+		self.assertEqual(self.decode(state, delta), expected)
+
+
+if __name__ == '__main__':
+	unittest.main()
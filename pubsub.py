@@ -0,0 +1,174 @@
+"""Publish/subscribe of game updates between processes.
+
+The process that owns a game publishes one serialized state per change
+under the game key, and every process with observers of the game
+subscribes to the key and sends the state to its own websockets (see
+game_storage.GameMirror).
+
+A bus keeps the last state published for each key and gives it to new
+subscribers, so that they do not have to wait for the next change.
+LocalBus works within one process. UnixSocketBus connects the processes
+through a UnixSocketBroker.
+"""
+
+import asyncio
+import collections
+import logging
+import os
+import struct
+
+SUBSCRIBE = 1
+UNSUBSCRIBE = 2
+PUBLISH = 3
+FORGET = 4
+
+# Operation, key length and data length.
+_HEADER = struct.Struct("!BHI")
+
+
+def pack_message(op, key, data=b""):
+	key = key.encode("utf-8")
+	return _HEADER.pack(op, len(key), len(data)) + key + data
+
+
+async def read_message(reader):
+	"""Returns (op, key, data) or raises asyncio.IncompleteReadError when
+	the connection is closed."""
+	op, key_length, data_length = _HEADER.unpack(await reader.readexactly(
+	    _HEADER.size))
+	key = await reader.readexactly(key_length)
+	data = await reader.readexactly(data_length)
+	return op, key.decode("utf-8"), data
+
+
+class LocalBus:
+	"""A bus within one process. The callbacks are called with the data
+	when it is published."""
+
+	def __init__(self):
+		self.subscribers = collections.defaultdict(list)
+		self.last = {}
+
+	def subscribe(self, key, callback):
+		self.subscribers[key].append(callback)
+		if key in self.last:
+			callback(self.last[key])
+
+	def unsubscribe(self, key, callback):
+		callbacks = self.subscribers.get(key, [])
+		if callback in callbacks:
+			callbacks.remove(callback)
+		if not callbacks:
+			self.subscribers.pop(key, None)
+
+	def publish(self, key, data):
+		self.last[key] = data
+		for callback in list(self.subscribers.get(key, [])):
+			callback(data)
+
+	def forget(self, key):
+		"""Drops the last state of a game that has been deleted."""
+		self.last.pop(key, None)
+
+
+class UnixSocketBroker:
+	"""Forwards the published data to the processes that subscribe to the
+	key."""
+
+	def __init__(self, path):
+		self.path = path
+		self.subscribers = collections.defaultdict(set)
+		self.last = {}
+		self._server = None
+
+	async def start(self):
+		if os.path.exists(self.path):
+			os.remove(self.path)
+		self._server = await asyncio.start_unix_server(self._handle, self.path)
+
+	async def close(self):
+		self._server.close()
+		await self._server.wait_closed()
+
+	async def _handle(self, reader, writer):
+		keys = set()
+		try:
+			while True:
+				op, key, data = await read_message(reader)
+				if op == SUBSCRIBE:
+					keys.add(key)
+					self.subscribers[key].add(writer)
+					if key in self.last:
+						writer.write(pack_message(PUBLISH, key,
+						                          self.last[key]))
+				elif op == UNSUBSCRIBE:
+					keys.discard(key)
+					self._unsubscribe(key, writer)
+				elif op == PUBLISH:
+					self.last[key] = data
+					message = pack_message(PUBLISH, key, data)
+					for subscriber in self.subscribers.get(key, ()):
+						subscriber.write(message)
+				elif op == FORGET:
+					self.last.pop(key, None)
+				else:
+					logging.error("Invalid bus operation: %s.", op)
+		except (asyncio.IncompleteReadError, ConnectionError):
+			pass
+		finally:
+			for key in keys:
+				self._unsubscribe(key, writer)
+			writer.close()
+
+	def _unsubscribe(self, key, writer):
+		writers = self.subscribers.get(key)
+		if writers is not None:
+			writers.discard(writer)
+			if not writers:
+				del self.subscribers[key]
+
+
+class UnixSocketBus:
+	"""The same interface as LocalBus, for the processes connected to a
+	UnixSocketBroker. The callbacks are called from a reader task."""
+
+	def __init__(self, path):
+		self.path = path
+		self.subscribers = collections.defaultdict(list)
+		self._writer = None
+		self._reader_task = None
+
+	async def connect(self):
+		reader, self._writer = await asyncio.open_unix_connection(self.path)
+		self._reader_task = asyncio.ensure_future(self._read(reader))
+
+	async def close(self):
+		self._reader_task.cancel()
+		self._writer.close()
+
+	def subscribe(self, key, callback):
+		self.subscribers[key].append(callback)
+		if len(self.subscribers[key]) == 1:
+			self._writer.write(pack_message(SUBSCRIBE, key))
+
+	def unsubscribe(self, key, callback):
+		callbacks = self.subscribers.get(key, [])
+		if callback in callbacks:
+			callbacks.remove(callback)
+		if not callbacks and self.subscribers.pop(key, None) is not None:
+			self._writer.write(pack_message(UNSUBSCRIBE, key))
+
+	def publish(self, key, data):
+		self._writer.write(pack_message(PUBLISH, key, data))
+
+	def forget(self, key):
+		self._writer.write(pack_message(FORGET, key))
+
+	async def _read(self, reader):
+		try:
+			while True:
+				op, key, data = await read_message(reader)
+				for callback in list(self.subscribers.get(key, [])):
+					callback(data)
+		except (asyncio.IncompleteReadError, ConnectionError):
+			logging.error("Connection to the bus closed.")
@@ -0,0 +1,97 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+import pubsub
+
+
+class TestLocalBus(unittest.TestCase):
+	def setUp(self):
+		self.bus = pubsub.LocalBus()
+		self.received = []
+
+	def callback(self, data):
+		self.received.append(data)
+
+	def test_publish(self):
+		self.bus.subscribe("game", self.callback)
+		self.bus.publish("game", b"1")
+		self.bus.publish("other", b"2")
+		self.assertEqual(self.received, [b"1"])
+
+		self.bus.unsubscribe("game", self.callback)
+		self.bus.publish("game", b"3")
+		self.assertEqual(self.received, [b"1"])
+		self.assertEqual(self.bus.subscribers, {})
+
+	def test_last_state(self):
+		self.bus.publish("game", b"1")
+		self.bus.publish("game", b"2")
+		self.bus.subscribe("game", self.callback)
+		self.assertEqual(self.received, [b"2"])
+
+		self.bus.forget("game")
+		self.bus.subscribe("game", self.callback)
+		self.assertEqual(self.received, [b"2"])
+
+
+class TestUnixSocketBus(unittest.TestCase):
+	def setUp(self):
+		self.loop = asyncio.new_event_loop()
+		asyncio.set_event_loop(self.loop)
+		self.tmp = tempfile.TemporaryDirectory()
+		path = os.path.join(self.tmp.name, "bus.sock")
+		self.broker = pubsub.UnixSocketBroker(path)
+		self.loop.run_until_complete(self.broker.start())
+		self.buses = [pubsub.UnixSocketBus(path) for _ in range(3)]
+		for bus in self.buses:
+			self.loop.run_until_complete(bus.connect())
+		self.received = [[] for _ in self.buses]
+
+	def tearDown(self):
+		for bus in self.buses:
+			self.loop.run_until_complete(bus.close())
+		self.loop.run_until_complete(self.broker.close())
+		self.loop.run_until_complete(asyncio.sleep(0))
+		self.loop.close()
+		asyncio.set_event_loop(None)
+		self.tmp.cleanup()
+
+	def subscribe(self, i, key):
+		self.buses[i].subscribe(key, self.received[i].append)
+
+	def run_briefly(self):
+		self.loop.run_until_complete(asyncio.sleep(0.05))
+
+	def test_publish(self):
+		self.subscribe(0, "game")
+		self.subscribe(1, "other")
+		self.run_briefly()
+		self.buses[2].publish("game", b"state")
+		self.run_briefly()
+		self.assertEqual(self.received, [[b"state"], [], []])
+
+		self.buses[0].unsubscribe("game", self.received[0].append)
+		self.run_briefly()
+		self.buses[2].publish("game", b"state 2")
+		self.run_briefly()
+		self.assertEqual(self.received, [[b"state"], [], []])
+
+	def test_last_state(self):
+		self.buses[2].publish("game", b"1")
+		self.buses[2].publish("game", b"2")
+		self.run_briefly()
+		self.subscribe(0, "game")
+		self.run_briefly()
+		self.assertEqual(self.received[0], [b"2"])
+
+		self.buses[2].forget("game")
+		self.run_briefly()
+		self.subscribe(1, "game")
+		self.run_briefly()
+		self.assertEqual(self.received[1], [])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,92 @@
+import collections
+import time
+
+# (tokens per second, burst) for each command. The limits per user apply
+# to all connections and HTTP requests of the user together.
+CONNECTION_LIMITS = {
+    "move": (10.0, 20),
+    "ping": (2.0, 5),
+}
+USER_LIMITS = {
+    "move": (20.0, 60),
+    "ping": (4.0, 10),
+}
+# The most user buckets that are kept before the full ones are dropped.
+MAX_USER_BUCKETS = 10000
+
+
+class TokenBucket:
+	"""Allows rate commands per second on average and burst commands at
+	once."""
+
+	def __init__(self, rate, burst, now):
+		self.rate = rate
+		self.burst = burst
+		self.tokens = burst
+		self.last = now
+
+	def refill(self, now):
+		self.tokens = min(self.burst,
+		                  self.tokens + (now - self.last) * self.rate)
+		self.last = now
+
+	def full(self, now):
+		self.refill(now)
+		return self.tokens >= self.burst
+
+
+class RateLimiter:
+	"""Token buckets for the commands of each connection and each user.
+	Commands for which there are no limits are always allowed."""
+
+	def __init__(self,
+	             connection_limits=CONNECTION_LIMITS,
+	             user_limits=USER_LIMITS,
+	             clock=time.monotonic):
+		self.connection_limits = connection_limits
+		self.user_limits = user_limits
+		self.clock = clock
+		self.user_buckets = {}
+		# Number of throttled commands by command.
+		self.throttled = collections.Counter()
+
+	def connection_buckets(self):
+		"""Returns the buckets for a new connection, to pass to allow."""
+		now = self.clock()
+		return {
+		    command: TokenBucket(rate, burst, now)
+		    for command, (rate, burst) in self.connection_limits.items()
+		}
+
+	def allow(self, command, user=None, connection_buckets=None):
+		"""Takes a token for command from the buckets of the user and the
+		connection, or returns False if either is empty."""
+		now = self.clock()
+		buckets = []
+		if connection_buckets and command in connection_buckets:
+			buckets.append(connection_buckets[command])
+		if user is not None and command in self.user_limits:
+			buckets.append(self._user_bucket(command, user.id, now))
+		for bucket in buckets:
+			bucket.refill(now)
+			if bucket.tokens < 1:
+				self.throttled[command] += 1
+				return False
+		for bucket in buckets:
+			bucket.tokens -= 1
+		return True
+
+	def _user_bucket(self, command, user_id, now):
+		bucket = self.user_buckets.get((command, user_id))
+		if bucket is None:
+			if len(self.user_buckets) >= MAX_USER_BUCKETS:
+				# A full bucket is the same as a new one.
+				self.user_buckets = {
+				    key: bucket
+				    for key, bucket in self.user_buckets.items()
+				    if not bucket.full(now)
+				}
+			rate, burst = self.user_limits[command]
+			bucket = TokenBucket(rate, burst, now)
+			self.user_buckets[command, user_id] = bucket
+		return bucket
@@ -0,0 +1,66 @@
+import unittest
+from unittest import mock
+
+import auth
+import clock
+import ratelimit
+
+
+class TestRateLimiter(unittest.TestCase):
+	def setUp(self):
+		self.clock = clock.VirtualClock()
+		self.limiter = ratelimit.RateLimiter({"move":
+		                                      (2.0, 3)}, {"move": (4.0, 5)},
+		                                     self.clock.time)
+		self.user = auth.User("user", 1000, 0, 0)
+
+	def test_connection_bucket(self):
+		buckets = self.limiter.connection_buckets()
+		for _ in range(3):
+			self.assertTrue(self.limiter.allow("move", None, buckets))
+		self.assertFalse(self.limiter.allow("move", None, buckets))
+		self.assertEqual(1, self.limiter.throttled["move"])
+
+		# Two tokens per second.
+		self.clock.advance(0.5)
+		self.assertTrue(self.limiter.allow("move", None, buckets))
+		self.assertFalse(self.limiter.allow("move", None, buckets))
+		# The bucket does not grow above the burst.
+		self.clock.advance(100)
+		for _ in range(3):
+			self.assertTrue(self.limiter.allow("move", None, buckets))
+		self.assertFalse(self.limiter.allow("move", None, buckets))
+
+	def test_user_bucket(self):
+		# The user bucket is shared between the connections.
+		allowed = [
+		    self.limiter.allow("move", self.user,
+		                       self.limiter.connection_buckets())
+		    for _ in range(6)
+		]
+		self.assertEqual([True] * 5 + [False], allowed)
+		other = auth.User("other", 1000, 0, 0)
+		self.assertTrue(self.limiter.allow("move", other))
+
+	def test_throttled_command_takes_no_tokens(self):
+		buckets = self.limiter.connection_buckets()
+		for _ in range(5):
+			self.limiter.allow("move", self.user)
+		self.assertFalse(self.limiter.allow("move", self.user, buckets))
+		self.assertEqual(3, buckets["move"].tokens)
+
+	def test_no_limit(self):
+		for _ in range(100):
+			self.assertTrue(self.limiter.allow("ping", self.user))
+
+	def test_full_buckets_are_dropped(self):
+		with mock.patch.object(ratelimit, "MAX_USER_BUCKETS", 2):
+			for name in ["a", "b", "c"]:
+				self.limiter.allow("move", auth.User(name, 1000, 0, 0))
+				self.clock.advance(10)
+		self.assertEqual([("move", "c@anon.com")],
+		                 list(self.limiter.user_buckets))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -1,27 +1,50 @@
 #!/usr/bin/python3
 
+import argparse
 import asyncio
-import base64
 import cProfile
-import datetime
+import functools
 import io
-import json
 import logging
 import os
 import pstats
 import signal
+import subprocess
 import sys
+import time
 import urllib.parse
 
 import aiohttp.web
 from jinja2 import Template
 
+import actor
+import assets
 import auth
+import connection
 import constants
 import game_storage
+import protocol
+import pubsub
+import ratelimit
+import router
+import scheduler
+import speedups
 import util
 
 HTTP_PORT = 8080
+# Whether the websockets of the players and of the spectators use
+# permessage-deflate, if the client supports it. It compresses every
+# frame again for each connection, which is too slow for games with many
+# spectators. Binary clients can ask for frames that are compressed once
+# for everyone instead, with deflate=1. The JSON clients, including the
+# browsers, have no such option, so spectators in the browser get their
+# updates uncompressed.
+PLAYER_COMPRESSION = True
+SPECTATOR_COMPRESSION = False
+# The lobby shared by the worker processes, when there is more than one.
+GAMES_DB = "games.db"
+# The reply to binary websocket commands that exceed the rate limit.
+THROTTLED_FRAME = bytes([protocol.FRAME_THROTTLED])
 
 index_template = Template(
     open(os.path.join(os.path.dirname(__file__), 'index.html')).read())
@@ -30,16 +53,14 @@ login_template = Template(
 error_template = Template(
     open(os.path.join(os.path.dirname(__file__), 'error.html')).read())
 
-# The HTML files are static for the duration of the server, so
-# keep the version static while the server is running for the
-# files in the game/ folder as well. The version is needed to
-# keep the files out of the browser cache.
-GAME_FILE_VERSION = base64.urlsafe_b64encode(
-    str(datetime.datetime.now()).encode("ascii")).decode('ascii')
+# The files in the game/ folder, with names that change with their
+# content so that browsers can keep them in their cache until they change.
+game_assets = assets.AssetStore(os.path.join(os.path.dirname(__file__),
+                                             "game"))
 
 
 def game_file_url(filename):
-	return "/game/{}?v={}".format(filename, GAME_FILE_VERSION)
+	return "/game/" + game_assets.hashed_name(filename)
 
 
 def user_and_game(request):
@@ -72,7 +93,7 @@ async def anonymous_login_handler(request):
 async def getplayer_page(request):
 	user = request.app["user_manager"].get_current_user(request)
 	return aiohttp.web.Response(
-	    text=json.dumps({
+	    text=speedups.json_dumps({
 	        "rating": user.rating,
 	        "wins": user.wins,
 	        "losses": user.losses
@@ -133,6 +154,7 @@ async def main_page(request):
 			# Current user joins this game as the second player.
 			game.userO = user
 			game.userO.id = user.id
+			game_manager.publish(game)
 			logging.info("User %s joins the game.", user)
 		elif (user.id != game.userO.id and user.id != game.userX.id):
 			logging.info("Observer %s joined %s.", user, game.key)
@@ -166,6 +188,7 @@ async def main_page(request):
 	    'game_css': game_file_url("game.css"),
 	    'game_js': game_file_url("game.js"),
 	    'constants_js': game_file_url("constants.js"),
+	    'touch_punch_js': game_file_url("jquery.ui.touch-punch.min.js"),
 	}
 
 	return aiohttp.web.Response(
@@ -193,32 +216,27 @@ async def move_handler(request):
 	user, game = user_and_game(request)
 	from_id = request.query.get('from')
 	to_id = request.query.get('to')
+	if not request.app["rate_limiter"].allow("move", user):
+		raise aiohttp.web.HTTPTooManyRequests(text="Too many moves.")
 	if from_id and to_id:
-		if game.move(user, from_id, to_id):
-			await game.send_update()
+		await request.app["actors"].move(game.key, user, from_id, to_id)
 	else:
 		raise aiohttp.web.HTTPBadRequest(text="Need from and to IDs.")
 	return aiohttp.web.Response(text="OK")
 
 
-async def move_websocket_handler(user, game, query):
+async def move_websocket_handler(actors, user, key, query):
 	from_id = query.get('from')
 	to_id = query.get('to')
 	if from_id and to_id:
-		res = False
 		try:
-			res = game.move(user, from_id[0], to_id[0])
+			await actors.move(key, user, from_id[0], to_id[0])
 		except util.HttpCodeException as ex:
 			# We can not return a code because we need the socket
 			# to stay open.
 			logging.warning("Move error: %s %s.", ex.status, ex.text)
 			pass
 
-		# TODO: Always send an update, since that makes testing for
-		# invalid moves via websocket easier.
-		if res:
-			await game.send_update()
-
 
 @auth.authenticated
 async def newgame_handler(request):
@@ -234,7 +252,8 @@ async def newgame_handler(request):
 		# Set properties.
 		game.userX = oldgame.userX
 		game.userO = oldgame.userO
-		game.observers = oldgame.observers
+		game_manager.publish(game)
+		game.take_observers(oldgame)
 		await game.send_update()
 	else:
 		raise aiohttp.web.HTTPForbidden(
@@ -247,20 +266,29 @@ async def newgame_handler(request):
 async def opened_handler(request):
 	user, game = user_and_game(request)
 	logging.info("Opened: %s %s.", user, game.key)
-	await game.send_update()
+	if not request.app["rate_limiter"].allow("ping", user):
+		raise aiohttp.web.HTTPTooManyRequests(text="Too many pings.")
+	await request.app["actors"].ping(game.key)
 	return aiohttp.web.Response(text="OK")
 
 
 @auth.authenticated
 async def ping_handler(request):
 	user, game = user_and_game(request)
-	user_manager = request.app["user_manager"]
-	await ping_websocket_handler(user_manager, user, game)
+	if not request.app["rate_limiter"].allow("ping", user):
+		raise aiohttp.web.HTTPTooManyRequests(text="Too many pings.")
+	await ping_websocket_handler(request.app["actors"], user, game.key)
 	return aiohttp.web.Response(text="OK")
 
 
-async def ping_websocket_handler(user_manager, user, game):
-	logging.info("Ping: %s %s", user, game.key)
+async def ping_websocket_handler(actors, user, key):
+	logging.info("Ping: %s %s", user, key)
+	await actors.ping(key)
+
+
+async def send_update(user_manager, game):
+	"""Sends the game to the observers and writes the results when the
+	game is over."""
 	await game.send_update()
 
 	if game.state == constants.STATE_GAMEOVER and not game.results_are_written:
@@ -303,38 +331,125 @@ async def websocket_handler(request):
 	# Anyone can listen to updates for a game.
 	key = request.query.get('g')
 	game_manager = request.app["game_manager"]
-	game = game_manager.get(key)
+	# Games in other worker processes are watched through a mirror.
+	game = game_manager.get(key) or game_manager.mirror(key)
 	if not game:
 		raise aiohttp.web.HTTPNotFound(text="Game not found.")
+	is_mirror = isinstance(game, game_storage.GameMirror)
 	user_manager = request.app["user_manager"]
 	user = user_manager.get_current_user(request)
 	logging.info('Websocket connection starting')
-	ws = aiohttp.web.WebSocketResponse()
+	if user is not None and any(player is not None and player == user
+	                            for player in (game.userX, game.userO)):
+		compress = request.app["player_compression"]
+	else:
+		compress = request.app["spectator_compression"]
+	ws = aiohttp.web.WebSocketResponse(compress=compress)
 	await ws.prepare(request)
 	logging.info('Websocket connection ready')
 
-	game.observers.append(ws)
+	# The updates are sent through a queue, so that a slow client does not
+	# slow down the game.
+	conn = connection.Connection(ws)
+	connections = request.app["connections"]
+	connections.add(conn)
+	# Clients that send delta=1 get only the changed fields after the
+	# first message. With binary=1, the updates and commands are binary
+	# frames (see protocol.py), compressed with deflate=1.
+	game.add_observer(conn,
+	                  user_id=user.id if user else None,
+	                  delta=request.query.get('delta') == '1',
+	                  binary=request.query.get('binary') == '1',
+	                  deflate=request.query.get('deflate') == '1')
+
+	rate_limiter = request.app["rate_limiter"]
+	buckets = rate_limiter.connection_buckets()
 
 	async for msg in ws:
 		logging.info("Received %s over websocket.", msg)
 		if msg.type == aiohttp.WSMsgType.TEXT:
-			# Update the game to resolve the moving pieces and
-			# in case it has been recreated.
-			game = game_manager.get(key)
 			url = urllib.parse.urlparse(msg.data)
+			path = url.path
 			query = urllib.parse.parse_qs(url.query)
-			if user and url.path == '/move':
-				await move_websocket_handler(user, game, query)
-			elif url.path == '/ping':
-				await ping_websocket_handler(user_manager, user, game)
+		elif msg.type == aiohttp.WSMsgType.BINARY:
+			try:
+				path, query = protocol.unpack_command(msg.data)
+			except ValueError as ex:
+				logging.error("Invalid binary Websocket command: %s %s.", user,
+				              ex)
+				continue
+		else:
+			continue
+
+		# Snapshots cost as much as pings. Throttled commands are dropped,
+		# and the client is told so in the format of the command.
+		command = "ping" if path == '/snapshot' else path.lstrip('/')
+		if not rate_limiter.allow(command, user, buckets):
+			logging.info("Throttled %s from %s.", path, user)
+			if msg.type == aiohttp.WSMsgType.BINARY:
+				conn.reply(THROTTLED_FRAME)
 			else:
-				logging.error("Invalid Websocket command: %s %s %s.", user,
-				              url, query)
-
+				conn.reply(speedups.json_dumps({"throttled": command}))
+			continue
+
+		if is_mirror:
+			# The game is played in another process. Only resend the
+			# last message.
+			if path == '/ping' or path == '/snapshot':
+				game.request_snapshot(conn)
+				await game.send_update()
+			continue
+
+		if user and path == '/move':
+			await move_websocket_handler(request.app["actors"], user, key,
+			                             query)
+		elif path == '/ping':
+			await ping_websocket_handler(request.app["actors"], user, key)
+		elif path == '/snapshot':
+			# The client missed a delta message. Update the game to
+			# resolve the moving pieces and in case it has been recreated.
+			game = game_manager.get(key)
+			if game:
+				game.request_snapshot(conn)
+				await game.send_update()
+		else:
+			logging.error("Invalid Websocket command: %s %s %s.", user, path,
+			              query)
+
+	conn.close()
+	connections.discard(conn)
+	if is_mirror:
+		game.remove_observer(conn)
+		game_manager.release_mirror(key)
+	else:
+		# The game may have been replaced by a new game since the
+		# connection was opened.
+		game = game_manager.get(key)
+		if game:
+			game.remove_observer(conn)
 	logging.info('Websocket connection closed')
 	return ws
 
 
+async def stats_handler(request):
+	connections = request.app["connections"]
+	depths = [len(conn.queue) for conn in connections]
+	observers = request.app["game_manager"].observer_counts().values()
+	rate_limiter = request.app["rate_limiter"]
+	return aiohttp.web.Response(
+	    text=speedups.json_dumps({
+	        "connections": len(connections),
+	        "queued_frames": sum(depths),
+	        "max_queue_depth": max(depths, default=0),
+	        "dropped_frames": connection.stats.dropped_frames,
+	        "slow_disconnects": connection.stats.slow_disconnects,
+	        "observed_games": len(observers),
+	        "max_observers_per_game": max(observers, default=0),
+	        "throttled_moves": rate_limiter.throttled["move"],
+	        "throttled_pings": rate_limiter.throttled["ping"],
+	    }))
+
+
 @auth.debug_authenticated
 async def setdebug_handler(request):
 	user, game = user_and_game(request)
@@ -349,13 +464,15 @@ async def setdebug_handler(request):
 	return aiohttp.web.Response(text="OK")
 
 
-def make_app(is_debug):
+def make_app(is_debug, shard=None, bus=None, stats=False):
+	"""shard is (index, count) for worker processes, see router.py. The
+	workers publish their games on bus, see pubsub.py. The internal
+	counters are served on /stats in debug mode or if stats is True."""
 	app = aiohttp.web.Application(debug=is_debug)
 	app.router.add_get('/', main_page)
 	app.router.add_get('/getplayer', getplayer_page)
 	app.router.add_get('/loginpage', login_page)
-	app.router.add_static('/game',
-	                      os.path.join(os.path.dirname(__file__), "game"))
+	app.router.add_get('/game/{filename}', game_assets.handler)
 
 	app.router.add_post('/anonymous_login', anonymous_login_handler)
 	app.router.add_post('/error', error_handler)
@@ -370,20 +487,54 @@ def make_app(is_debug):
 	app.router.add_route('GET', '/websocket', websocket_handler)
 
 	app["user_manager"] = auth.UserManager(unsafe_debug=is_debug)
-	app["game_manager"] = game_storage.GameManager()
-
+	if shard is None:
+		app["game_manager"] = game_storage.GameManager()
+	else:
+		index, count = shard
+		ring = router.HashRing(range(count))
+		app["game_manager"] = game_storage.GameManager(
+		    owns_key=lambda key: ring.node(key) == index,
+		    directory=game_storage.GameDirectory(GAMES_DB),
+		    bus=bus)
+	app["player_compression"] = PLAYER_COMPRESSION
+	app["spectator_compression"] = SPECTATOR_COMPRESSION
+	# The open websocket connections.
+	app["connections"] = set()
+	# Sends the updates when pieces arrive or wake up.
+	broadcast = functools.partial(send_update, app["user_manager"])
+	app["scheduler"] = scheduler.Scheduler(app["game_manager"], broadcast)
+	app["rate_limiter"] = ratelimit.RateLimiter()
+	# Applies the moves and pings for each game in order.
+	app["actors"] = actor.Actors(app["game_manager"], broadcast,
+	                             app["scheduler"])
+
+	if is_debug or stats:
+		app.router.add_get('/stats', stats_handler)
 	if is_debug:
 		app.router.add_post('/setdebug', setdebug_handler)
 	return app
 
 
-def setup_loop(loop, is_debug=False):  # pragma: no cover
+def setup_loop(loop,
+               is_debug=False,
+               shard=None,
+               stats=False):  # pragma: no cover
 	if is_debug:
 		loop.set_debug(is_debug)
-	app = make_app(is_debug)
+	bus = None
+	if shard is not None:
+		bus = pubsub.UnixSocketBus(router.bus_socket(HTTP_PORT))
+		loop.run_until_complete(bus.connect())
+	app = make_app(is_debug, shard, bus, stats)
 	handler = app.make_handler(access_log=logging.getLogger())
-	web_server = loop.run_until_complete(
-	    loop.create_server(handler, '0.0.0.0', HTTP_PORT))
+	if shard is None:
+		server = loop.create_server(handler, '0.0.0.0', HTTP_PORT)
+	else:
+		path = router.worker_socket(HTTP_PORT, shard[0])
+		if os.path.exists(path):
+			os.remove(path)
+		server = loop.create_unix_server(handler, path)
+	web_server = loop.run_until_complete(server)
 
 	def every_second():
 		"""Useful for catching Ctrl+C on Windows."""
@@ -401,12 +552,81 @@ def setup_loop(loop, is_debug=False):  # pragma: no cover
 	return stop
 
 
+def setup_router(loop, is_debug, workers, worker_args=()):  # pragma: no cover
+	"""Starts the worker processes and the router in front of them.
+	worker_args are passed on to the workers."""
+	game_storage.GameDirectory(GAMES_DB).clear()
+	broker = pubsub.UnixSocketBroker(router.bus_socket(HTTP_PORT))
+	loop.run_until_complete(broker.start())
+	sockets = [router.worker_socket(HTTP_PORT, i) for i in range(workers)]
+	for path in sockets:
+		if os.path.exists(path):
+			os.remove(path)
+	processes = [
+	    subprocess.Popen([
+	        sys.executable, __file__, "debug" if is_debug else "run",
+	        "--workers",
+	        str(workers), "--worker-index",
+	        str(i)
+	    ] + list(worker_args)) for i in range(workers)
+	]
+	while not all(os.path.exists(path) for path in sockets):
+		if any(process.poll() is not None for process in processes):
+			raise RuntimeError("A worker process exited.")
+		time.sleep(0.1)
+
+	app = router.make_app(sockets)
+	handler = app.make_handler(access_log=logging.getLogger())
+	loop.run_until_complete(app.startup())
+	web_server = loop.run_until_complete(
+	    loop.create_server(handler, '0.0.0.0', HTTP_PORT))
+
+	def stop():
+		web_server.close()
+		loop.run_until_complete(web_server.wait_closed())
+		loop.run_until_complete(app.shutdown())
+		loop.run_until_complete(handler.shutdown(1.0))
+		loop.run_until_complete(app.cleanup())
+		for process in processes:
+			process.terminate()
+		for process in processes:
+			process.wait()
+		loop.run_until_complete(broker.close())
+
+	return stop
+
+
 if __name__ == '__main__':  # pragma: no cover
 	use_profiling = False
 
-	if len(sys.argv) < 2 or (sys.argv[1] != "run" and sys.argv[1] != "debug"):
-		print("Specify", sys.argv[0], " run/debug to run.")
-		sys.exit(0)
+	parser = argparse.ArgumentParser()
+	parser.add_argument("mode", choices=["run", "debug"])
+	parser.add_argument(
+	    "--workers",
+	    type=int,
+	    default=1,
+	    help="Number of worker processes. The games are divided between "
+	    "them by key.")
+	parser.add_argument(
+	    "--loop",
+	    choices=["auto"] + speedups.EVENT_LOOPS,
+	    default=os.environ.get("REALTIMECHESS_LOOP", "auto"),
+	    help="Event loop implementation. Falls back to asyncio if the chosen "
+	    "one is not installed. Default: $REALTIMECHESS_LOOP or auto.")
+	parser.add_argument(
+	    "--json",
+	    choices=["auto"] + speedups.JSON_CODECS,
+	    default=os.environ.get("REALTIMECHESS_JSON", "auto"),
+	    help="JSON implementation. Falls back to json if the chosen one is "
+	    "not installed. Default: $REALTIMECHESS_JSON or auto.")
+	parser.add_argument(
+	    "--stats",
+	    action="store_true",
+	    help="Serve the connection and throttling counters on /stats. Always "
+	    "on in debug mode.")
+	# Set by the router for the worker processes it starts.
+	parser.add_argument("--worker-index", type=int, help=argparse.SUPPRESS)
+	args = parser.parse_args()
 
 	logging.basicConfig(
 	    format=
@@ -415,16 +635,27 @@ if __name__ == '__main__':  # pragma: no cover
 	    datefmt='%Y-%m-%d %H:%M:%S')
 
 	is_debug = False
-	if sys.argv[1] == "debug":
+	if args.mode == "debug":
 		is_debug = True
 		logging.getLogger().setLevel(logging.DEBUG)
+	loop_name = speedups.use_event_loop(args.loop)
+	json_name = speedups.use_json(args.json)
 	loop = asyncio.get_event_loop()
-	stop = setup_loop(loop, is_debug)
+	if args.worker_index is not None:
+		stop = setup_loop(loop, is_debug, (args.worker_index, args.workers),
+		                  args.stats)
+	elif args.workers > 1:
+		worker_args = ["--loop", args.loop, "--json", args.json]
+		if args.stats:
+			worker_args.append("--stats")
+		stop = setup_router(loop, is_debug, args.workers, worker_args)
+	else:
+		stop = setup_loop(loop, is_debug, stats=args.stats)
 	if os.name != "nt":
 		loop.add_signal_handler(signal.SIGTERM, loop.stop)
 
-	logging.info("Server started.")
-	print("Server started.")
+	logging.info("Server started with %s and %s.", loop_name, json_name)
+	print("Server started with {} and {}.".format(loop_name, json_name))
 	if use_profiling:
 		pr = cProfile.Profile()
 		pr.enable()
@@ -2,6 +2,7 @@ import asyncio
 import functools
 import inspect
 import json
+import re
 import unittest
 import urllib.parse
 
@@ -10,6 +11,7 @@ from aiohttp.test_utils import AioHTTPTestCase
 
 import board
 import constants
+import protocol
 import realtimechess
 
 
@@ -361,6 +363,183 @@ class GameTest(AioHTTPTestCase):
 		await self.user1.ws.send_str("/ping")
 		await self.user1.expect_websocket()
 
+	async def test_websocket_delta(self):
+		ws = await self.user1.client.ws_connect("/websocket?delta=1&g=" +
+		                                        self.user1.game)
+		await self.user1.move("A2", "A3")
+		full = json.loads((await ws.receive()).data)
+		self.assertNotIn("delta_from", full)
+		self.assertIn("p0", full)
+
+		await self.user1.move("B2", "B3")
+		delta = json.loads((await ws.receive()).data)
+		self.assertEqual(delta["delta_from"], full["seq"])
+		self.assertEqual(delta["seq"], full["seq"] + 1)
+		self.assertIn("p9", delta)
+		self.assertNotIn("p0", delta)
+
+		await ws.send_str("/snapshot")
+		full = json.loads((await ws.receive()).data)
+		self.assertNotIn("delta_from", full)
+		self.assertIn("p0", full)
+		await ws.close()
+
+	async def test_websocket_binary(self):
+		ws = await self.user1.client.ws_connect("/websocket?binary=1&g=" +
+		                                        self.user1.game)
+		await ws.send_bytes(protocol.pack_command(protocol.FRAME_PING))
+		message = protocol.unpack_frame((await ws.receive()).data)
+		self.assertEqual(message["p8"], "1,6;A2")
+		self.assertEqual(message["userXname"], "user1")
+
+		# Binary commands are accepted from the players.
+		await ws.send_bytes(protocol.pack_move("A2", "A3"))
+		message = protocol.unpack_frame((await ws.receive()).data)
+		self.assertTrue(message["p8"].startswith("1,6;M,"))
+		self.assertTrue(message["p8"].endswith(",A3"))
+
+		await ws.send_bytes(b"\x09")
+		await ws.close()
+
+	async def test_websocket_deflate(self):
+		ws = await self.user1.client.ws_connect(
+		    "/websocket?binary=1&deflate=1&g=" + self.user1.game)
+		await ws.send_bytes(protocol.pack_command(protocol.FRAME_PING))
+		data = (await ws.receive()).data
+		self.assertEqual(protocol.FRAME_DEFLATE, data[0])
+		self.assertEqual(protocol.unpack_frame(data)["userXname"], "user1")
+		await ws.close()
+
+	async def test_compression_policy(self):
+		# Access implementation detail to connect as a player.
+		self.user1.client.session._cookie_jar = self.user1.cookie_jar
+		ws = await self.user1.client.ws_connect("/websocket?g=" +
+		                                        self.user1.game,
+		                                        compress=15)
+		self.assertTrue(ws.compress)
+		await ws.close()
+
+		# Spectators do not get permessage-deflate.
+		self.user1.client.session._cookie_jar = aiohttp.CookieJar(unsafe=True)
+		ws = await self.user1.client.ws_connect("/websocket?g=" +
+		                                        self.user1.game,
+		                                        compress=15)
+		self.assertFalse(ws.compress)
+		await ws.close()
+
+	def assertFileUrlsHashed(self, html):
+		# The script sources and the module imports.
+		urls = re.findall(r'src="([^"]*)"|from "([^"]*)"', html)
+		urls = [src or module for src, module in urls]
+		self.assertGreater(len(urls), 0)
+		for url in urls:
+			if not url.startswith("https://"):
+				self.assertRegex(url, r"^/game/[\w.-]+\.[0-9a-f]{12}\.\w+$")
+
+	async def test_game_files(self):
+		url = realtimechess.game_file_url("game.js")
+		html = await self.user1.request("/?g=" + self.user1.game)
+		self.assertIn(url, html)
+		self.assertIn(
+		    realtimechess.game_file_url("jquery.ui.touch-punch.min.js"), html)
+		self.assertFileUrlsHashed(html)
+		self.assertFileUrlsHashed(await self.user1.request("/loginpage"))
+
+		response = await self.client.request(
+		    "GET", url, headers={"Accept-Encoding": "gzip"})
+		self.assertEqual(200, response.status)
+		self.assertEqual("gzip", response.headers["Content-Encoding"])
+		self.assertIn("immutable", response.headers["Cache-Control"])
+		self.assertIn(b"startGame", await response.read())
+
+		etag = response.headers["ETag"]
+		response = await self.client.request("GET",
+		                                     url,
+		                                     headers={
+		                                         "Accept-Encoding": "gzip",
+		                                         "If-None-Match": etag
+		                                     })
+		self.assertEqual(304, response.status)
+
+		response = await self.client.request(
+		    "GET", "/game/game.js", headers={"Accept-Encoding": "identity"})
+		self.assertEqual("no-cache", response.headers["Cache-Control"])
+		self.assertNotIn("Content-Encoding", response.headers)
+
+		response = await self.client.request("GET", "/game/missing.js")
+		self.assertEqual(404, response.status)
+
+	async def test_arrival_is_pushed(self):
+		await self.user1.move("A2", "A3")
+		moving = await self.user1.expect_websocket()
+		self.assertTrue(moving["p8"].startswith("1,6;M,"))
+		# The server sends the update when the pawn arrives, without a ping.
+		arrived = await asyncio.wait_for(self.user1.expect_websocket(), 5)
+		self.assertTrue(arrived["p8"].startswith("1,6;S,"))
+
+	async def test_same_user_replaces_connection(self):
+		# user1 opens the game in another tab.
+		ws = await self.user1.client.ws_connect("/websocket?g=" +
+		                                        self.user1.game)
+		self.assertEqual(aiohttp.WSMsgType.CLOSE,
+		                 (await self.user1.ws.receive()).type)
+		await self.user1.move("A2", "A3")
+		message = json.loads((await ws.receive()).data)
+		self.assertTrue(message["p8"].startswith("1,6;M,"))
+		await ws.close()
+
+	async def test_throttled_pings(self):
+		for _ in range(8):
+			await self.user1.ws.send_str("/ping?g=" + self.user1.game)
+		# The connection may ping five times at once.
+		messages = [await self.user1.expect_websocket() for _ in range(8)]
+		self.assertEqual(3, messages.count({"throttled": "ping"}))
+		for _ in range(100):
+			stats = json.loads(await self.user1.request("/stats"))
+			if stats["throttled_pings"] == 3:
+				break
+			await asyncio.sleep(0.01)
+		self.assertEqual(3, stats["throttled_pings"])
+
+		# The pings over HTTP count for the same user.
+		with self.assertRaises(aiohttp.ClientResponseError) as cm:
+			for _ in range(10):
+				await self.user1.call("ping")
+		self.assertEqual(429, cm.exception.status)
+
+	async def test_throttled_moves(self):
+		# No moves at all.
+		rate_limiter = self.app["rate_limiter"]
+		rate_limiter.user_limits = {"move": (0.0, 0)}
+		rate_limiter.user_buckets.clear()
+
+		await self.user1.move_websocket("A2", "A3")
+		message = await self.user1.expect_websocket()
+		self.assertEqual({"throttled": "move"}, message)
+
+		# Access implementation detail to connect as a player.
+		self.user1.client.session._cookie_jar = self.user1.cookie_jar
+		ws = await self.user1.client.ws_connect("/websocket?binary=1&g=" +
+		                                        self.user1.game)
+		await ws.send_bytes(protocol.pack_move("A2", "A3"))
+		data = (await ws.receive()).data
+		self.assertEqual(bytes([protocol.FRAME_THROTTLED]), data)
+		await ws.close()
+
+		await self.user1.disable_time()
+		state = await self.user1.get_state()
+		self.assertTrue(state.board().has_piece("A2"))
+		self.assertFalse(state.board().has_piece("A3"))
+
+	async def test_stats(self):
+		stats = json.loads(await self.user1.request("/stats"))
+		self.assertGreaterEqual(stats["connections"], 2)
+		self.assertEqual(stats["queued_frames"], 0)
+		self.assertIn("dropped_frames", stats)
+		self.assertIn("slow_disconnects", stats)
+		self.assertGreaterEqual(stats["observed_games"], 1)
+		self.assertEqual(stats["max_observers_per_game"], 2)
+
 	async def test_websocket_no_game(self):
 		with self.assertRaises(aiohttp.ClientResponseError) as cm:
 			await self.user1.client.ws_connect("/websocket")
@@ -0,0 +1,164 @@
+"""Runs the server in several worker processes, to use more than one core.
+
+Each worker is a normal realtimechess app listening on a Unix socket. The
+router listens on HTTP_PORT and forwards every request and websocket for
+the game key g to the worker that owns the key, chosen with a consistent
+hash. Requests without a game key go to any worker. The workers share the
+lobby through a game_storage.GameDirectory, and publish the game updates
+through a pubsub.UnixSocketBroker so that websockets that only watch a
+game can be served by any worker.
+"""
+
+import asyncio
+import bisect
+import hashlib
+import itertools
+import logging
+import os
+import tempfile
+
+import aiohttp
+import aiohttp.web
+import multidict
+
+# Headers that only apply to one connection and are not forwarded.
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "content-length",
+    "keep-alive",
+    "transfer-encoding",
+    "upgrade",
+}
+
+
+def _hash(text):
+	return int.from_bytes(
+	    hashlib.md5(text.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+	"""Consistent hashing of game keys to nodes. Adding a node only moves
+	the keys that the new node takes over."""
+
+	def __init__(self, nodes, replicas=100):
+		self._ring = sorted((_hash("{}-{}".format(node, i)), node)
+		                    for node in nodes for i in range(replicas))
+		self._hashes = [h for h, _ in self._ring]
+
+	def node(self, key):
+		i = bisect.bisect(self._hashes, _hash(key)) % len(self._ring)
+		return self._ring[i][1]
+
+
+def worker_socket(port, index):
+	return os.path.join(tempfile.gettempdir(),
+	                    "realtimechess-{}-{}.sock".format(port, index))
+
+
+def bus_socket(port):
+	return os.path.join(tempfile.gettempdir(),
+	                    "realtimechess-{}-bus.sock".format(port))
+
+
+def _forwarded_headers(headers):
+	# A multidict, since there can be several Set-Cookie headers.
+	return multidict.CIMultiDict(
+	    (name, value) for name, value in headers.items()
+	    if name.lower() not in HOP_BY_HOP_HEADERS and name.lower() != "host")
+
+
+def _worker(request):
+	"""Returns the index of the worker for the request."""
+	app = request.app
+	key = request.query.get("g")
+	# A websocket without a login can only watch the game, which any
+	# worker can do through the bus.
+	watcher = (request.headers.get("Upgrade", "").lower() == "websocket"
+	           and "Cookie" not in request.headers)
+	if key and not watcher:
+		return app["ring"].node(key)
+	return next(app["next_worker"])
+
+
+async def proxy_handler(request):
+	session = request.app["sessions"][_worker(request)]
+	url = "http://worker" + request.path_qs
+	if request.headers.get("Upgrade", "").lower() == "websocket":
+		return await _proxy_websocket(request, session, url)
+
+	try:
+		async with session.request(request.method,
+		                           url,
+		                           headers=_forwarded_headers(request.headers),
+		                           data=await request.read(),
+		                           allow_redirects=False) as response:
+			body = await response.read()
+			return aiohttp.web.Response(status=response.status,
+			                            headers=_forwarded_headers(
+			                                response.headers),
+			                            body=body)
+	except aiohttp.ClientConnectionError as ex:
+		logging.error("Worker not reachable: %s.", ex)
+		raise aiohttp.web.HTTPBadGateway(text="Worker not reachable.")
+
+
+async def _proxy_websocket(request, session, url):
+	headers = {}
+	if "Cookie" in request.headers:
+		headers["Cookie"] = request.headers["Cookie"]
+	try:
+		upstream = await session.ws_connect(url, headers=headers)
+	except aiohttp.WSServerHandshakeError as ex:
+		return aiohttp.web.Response(status=ex.status, text=ex.message)
+	except aiohttp.ClientConnectionError as ex:
+		logging.error("Worker not reachable: %s.", ex)
+		raise aiohttp.web.HTTPBadGateway(text="Worker not reachable.")
+
+	ws = aiohttp.web.WebSocketResponse()
+	await ws.prepare(request)
+
+	async def pump(source, destination):
+		async for msg in source:
+			if msg.type == aiohttp.WSMsgType.TEXT:
+				await destination.send_str(msg.data)
+			elif msg.type == aiohttp.WSMsgType.BINARY:
+				await destination.send_bytes(msg.data)
+
+	tasks = [
+	    asyncio.ensure_future(pump(ws, upstream)),
+	    asyncio.ensure_future(pump(upstream, ws))
+	]
+	try:
+		await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+	finally:
+		# When either side closes, close the other one as well.
+		for task in tasks:
+			task.cancel()
+		await upstream.close()
+		await ws.close()
+	return ws
+
+
+def make_app(sockets):
+	"""The router app for workers listening on the Unix sockets."""
+	app = aiohttp.web.Application()
+	app["ring"] = HashRing(range(len(sockets)))
+	app["next_worker"] = itertools.cycle(range(len(sockets)))
+
+	async def start_sessions(app):
+		# The cookies belong to the clients, so the sessions must not keep
+		# them. The responses are forwarded still compressed.
+		app["sessions"] = [
+		    aiohttp.ClientSession(connector=aiohttp.UnixConnector(path=path),
+		                          cookie_jar=aiohttp.DummyCookieJar(),
+		                          auto_decompress=False) for path in sockets
+		]
+
+	async def close_sessions(app):
+		for session in app["sessions"]:
+			await session.close()
+
+	app.on_startup.append(start_sessions)
+	app.on_cleanup.append(close_sessions)
+	app.router.add_route("*", "/{path:.*}", proxy_handler)
+	return app
@@ -0,0 +1,146 @@
+import itertools
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import aiohttp
+import aiohttp.web
+from aiohttp.test_utils import AioHTTPTestCase, unittest_run_loop
+
+import pubsub
+import realtimechess
+import router
+
+
+class TestHashRing(unittest.TestCase):
+	def setUp(self):
+		self.keys = [os.urandom(8).hex() for _ in range(1000)]
+
+	def test_spread(self):
+		ring = router.HashRing(range(4))
+		counts = [0] * 4
+		for key in self.keys:
+			counts[ring.node(key)] += 1
+		for count in counts:
+			self.assertGreater(count, 150)
+
+	def test_same_node(self):
+		ring = router.HashRing(range(4))
+		other_ring = router.HashRing(range(4))
+		for key in self.keys:
+			self.assertEqual(ring.node(key), other_ring.node(key))
+
+	def test_add_node(self):
+		ring = router.HashRing(range(4))
+		new_ring = router.HashRing(range(5))
+		for key in self.keys:
+			# Keys only move to the new node.
+			self.assertIn(new_ring.node(key), [ring.node(key), 4])
+
+
+class TestRouter(AioHTTPTestCase):
+	async def get_application(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.patcher = mock.patch.object(
+		    realtimechess, "GAMES_DB", os.path.join(self.tmp.name, "games.db"))
+		self.patcher.start()
+
+		sockets = [
+		    os.path.join(self.tmp.name, "worker{}.sock".format(i))
+		    for i in range(2)
+		]
+		# The workers run in this process, so they can share a LocalBus.
+		bus = pubsub.LocalBus()
+		self.workers = []
+		self.runners = []
+		for i, path in enumerate(sockets):
+			app = realtimechess.make_app(True, (i, len(sockets)), bus)
+			runner = aiohttp.web.AppRunner(app)
+			await runner.setup()
+			await aiohttp.web.UnixSite(runner, path).start()
+			self.workers.append(app)
+			self.runners.append(runner)
+		return router.make_app(sockets)
+
+	async def tearDownAsync(self):
+		for runner in self.runners:
+			await runner.cleanup()
+		self.patcher.stop()
+		self.tmp.cleanup()
+
+	async def login(self, name, worker=None):
+		"""Logs in and returns the key of the new game, which is created
+		on worker if it is given."""
+		self.client.session._cookie_jar = aiohttp.CookieJar(unsafe=True)
+		next_worker = self.app["next_worker"]
+		if worker is not None:
+			# The requests without a game key go to the workers in turn.
+			self.app["next_worker"] = itertools.repeat(worker)
+		try:
+			response = await self.client.request("POST",
+			                                     "/anonymous_login",
+			                                     data={"name": name})
+		finally:
+			self.app["next_worker"] = next_worker
+		response.raise_for_status()
+		return response.url.query["g"]
+
+	def owner(self, key):
+		return self.app["ring"].node(key)
+
+	@unittest_run_loop
+	async def test_game_on_owner(self):
+		key = await self.login("user1")
+		owner = self.owner(key)
+		self.assertIsNotNone(self.workers[owner]["game_manager"].get(key))
+		self.assertIsNone(self.workers[1 - owner]["game_manager"].get(key))
+
+		ws = await self.client.ws_connect("/websocket?g=" + key)
+		await ws.send_str("/ping?g=" + key)
+		message = await ws.receive_json()
+		self.assertEqual(message["key"], key)
+		self.assertEqual(message["userXname"], "user1")
+		await ws.close()
+
+	@unittest_run_loop
+	async def test_shared_lobby(self):
+		key = await self.login("user1", worker=0)
+		other_key = await self.login("user2", worker=1)
+		self.assertEqual(0, self.owner(key))
+		self.assertEqual(1, self.owner(other_key))
+
+		response = await self.client.request("GET", "/?g=" + other_key)
+		self.assertIn("/?g=" + key, await response.text())
+
+	@unittest_run_loop
+	async def test_watchers_on_all_workers(self):
+		key = await self.login("user1")
+		cookie_jar = self.client.session._cookie_jar
+		# Websockets without a login go to the workers in turn.
+		self.client.session._cookie_jar = aiohttp.CookieJar(unsafe=True)
+		watchers = [
+		    await self.client.ws_connect("/websocket?g=" + key)
+		    for _ in range(2)
+		]
+		other_worker = self.workers[1 - self.owner(key)]
+		self.assertEqual(
+		    1, other_worker["game_manager"].observer_counts().get(key))
+
+		self.client.session._cookie_jar = cookie_jar
+		response = await self.client.request("POST", "/opened?g=" + key)
+		response.raise_for_status()
+		for ws in watchers:
+			message = await ws.receive_json()
+			self.assertEqual(message["userXname"], "user1")
+			await ws.close()
+
+	@unittest_run_loop
+	async def test_websocket_game_not_found(self):
+		with self.assertRaises(aiohttp.ClientResponseError) as cm:
+			await self.client.ws_connect("/websocket?g=deadbeef")
+		self.assertEqual(404, cm.exception.status)
+
+
+if __name__ == '__main__':
+	unittest.main()
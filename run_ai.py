@@ -1,5 +1,4 @@
 import asyncio
-import json
 import os
 import random
 import signal
@@ -12,6 +11,11 @@ import board
 import constants
 import protocol
 
+# The frames with a game state. The others are skipped.
+STATE_FRAMES = {
+    protocol.FRAME_STATE, protocol.FRAME_DELTA, protocol.FRAME_DEFLATE
+}
+
 
 class AiPlayer:
 	def __init__(self, loop, session, base_url):
@@ -30,8 +34,6 @@ class AiPlayer:
 			self.all_piece_ids.append("p" + str(i))
 
 		self.my_pieces = []
-		self.last_update_timestamp = 0
-		self.latest_ping_scheduled_at = 0
 		self.board = None
 
 	async def connect(self):
@@ -45,59 +47,68 @@ class AiPlayer:
 			print("Created game", "{}?g={}".format(self.base_url, self.game))
 
 	async def play(self):
-		async with self.session.ws_connect(self.base_url + 'websocket?g=' +
+		async with self.session.ws_connect(self.base_url +
+		                                   'websocket?binary=1&g=' +
 		                                   self.game) as self.ws:
 			print("Websocket connected.")
 
 			def callback():
-				loop.create_task(self._poll())
-				self.loop.call_later(self.poll_interval, callback)
-
-			self.loop.call_soon(callback)
-			is_ready = False
-			async for msg in self.ws:
-				if msg.type == aiohttp.WSMsgType.TEXT:
-					data = json.loads(msg.data)
-					self.state = int(data["state"])
-
-					if self.state == constants.STATE_START and not is_ready:
-						await self._call("ready", {"ready": 1})
-						print("Ready for playing.")
-						is_ready = True
-					else:
-						is_ready = False
-
-					self.pieces = []
-					pieces_str = []
-					for id in self.all_piece_ids:
-						pieces_str.append(data[id])
-						if data[id]:
-							self.pieces.append(protocol.Piece(data[id]))
-					self.board = board.Board(pieces_str)
-
-					self.last_update_timestamp = float(data["time_stamp"])
-					something_happens_at = 1e100
-					self.my_pieces = []
-					for piece in self.pieces:
-						if piece.color == self.my_color:
-							self.my_pieces.append(piece)
-							if piece.moving or piece.sleeping:
-								something_happens_at = min(
-								    something_happens_at, piece.end_time)
-					if something_happens_at < 1e100:
-						asyncio.ensure_future(
-						    self._send_ping_at(something_happens_at + 0.05),
-						    loop=self.loop)
-
-					await self._dodge_incoming()
-
-					print(":", end="", flush=True)
-				elif msg.type == aiohttp.WSMsgType.CLOSED:
-					print("Websocket closed.")
-					break
-				elif msg.type == aiohttp.WSMsgType.ERROR:
-					print("Websocket error.")
-					break
+				self.loop.create_task(self._poll())
+				self._poll_handle = self.loop.call_later(
+				    self.poll_interval, callback)
+
+			self._poll_handle = self.loop.call_soon(callback)
+			try:
+				await self._read()
+			finally:
+				self._poll_handle.cancel()
+
+	async def _read(self):
+		is_ready = False
+		async for msg in self.ws:
+			if msg.type == aiohttp.WSMsgType.BINARY:
+				frame_type = msg.data[0] if msg.data else None
+				if frame_type == protocol.FRAME_THROTTLED:
+					# The server dropped a move because we sent too many.
+					print("T", end="", flush=True)
+					continue
+				if frame_type not in STATE_FRAMES:
+					print("Unknown frame type:", frame_type)
+					continue
+				data = protocol.unpack_frame(msg.data)
+				self.state = int(data["state"])
+
+				if self.state == constants.STATE_START and not is_ready:
+					await self._call("ready", {"ready": 1})
+					print("Ready for playing.")
+					is_ready = True
+				else:
+					is_ready = False
+
+				self.pieces = []
+				pieces_str = []
+				for id in self.all_piece_ids:
+					pieces_str.append(data[id])
+					if data[id]:
+						self.pieces.append(protocol.Piece.from_state(data[id]))
+				self.board = board.BitBoard(pieces_str)
+
+				# The server sends an update when our pieces arrive or
+				# wake up, so there is no need to ping it.
+				self.my_pieces = [
+				    piece for piece in self.pieces
+				    if piece.color == self.my_color
+				]
+
+				await self._dodge_incoming()
+
+				print(":", end="", flush=True)
+			elif msg.type == aiohttp.WSMsgType.CLOSED:
+				print("Websocket closed.")
+				break
+			elif msg.type == aiohttp.WSMsgType.ERROR:
+				print("Websocket error.")
+				break
 
 	async def _dodge_incoming(self):
 		for piece in self.pieces:
@@ -108,29 +119,7 @@ class AiPlayer:
 					possible = self.board.get_moves(my_piece.pos)
 					if possible:
 						to = random.choice(possible)
-						await self._call_ws("move", {
-						    "from": my_piece.pos,
-						    "to": to
-						})
-
-	async def _send_ping_at(self, timestamp):
-		self.latest_ping_scheduled_at = max(self.latest_ping_scheduled_at,
-		                                    timestamp)
-
-		# Wait for timestamp to arrive.
-		delay = timestamp - self.last_update_timestamp
-		await asyncio.sleep(delay)
-
-		# Do we already have more recent info?
-		if timestamp <= self.last_update_timestamp:
-			return
-		# Is this ping almost uneccessary?
-		diff = self.latest_ping_scheduled_at - timestamp
-		if diff > 0 and diff < 1.0:
-			# There will be another ping soon.
-			return
-
-		await self._call_ws("ping")
+						await self._send_move(my_piece.pos, to)
 
 	async def _call(self, name, params={}):
 		encoded_params = urllib.parse.urlencode(params)
@@ -143,10 +132,8 @@ class AiPlayer:
 			data = await resp.text()
 		return data
 
-	async def _call_ws(self, name, params={}):
-		encoded_params = urllib.parse.urlencode(params)
-		url = self.base_url + name + "?g=" + self.game + "&" + encoded_params
-		await self.ws.send_str(url)
+	async def _send_move(self, from_pos, to_pos):
+		await self.ws.send_bytes(protocol.pack_move(from_pos, to_pos))
 
 	async def _poll(self):
 		print(".", end='', flush=True)
@@ -163,7 +150,7 @@ class AiPlayer:
 				continue
 
 			to = random.choice(all_to)
-			tasks.append(self._call_ws("move", {"from": frm, "to": to}))
+			tasks.append(self._send_move(frm, to))
 		await asyncio.gather(*tasks)
 
 
@@ -0,0 +1,45 @@
+import unittest
+
+import aiohttp.web
+from aiohttp.test_utils import AioHTTPTestCase, unittest_run_loop
+
+import auth
+import clock
+import constants
+import game_storage
+import protocol
+import run_ai
+
+
+class TestAiPlayer(AioHTTPTestCase):
+	async def get_application(self):
+		app = aiohttp.web.Application()
+		app.router.add_get("/websocket", self.websocket_handler)
+		return app
+
+	async def websocket_handler(self, request):
+		game = game_storage.Game("key", clock.VirtualClock(1000.0))
+		game.userX = auth.User("white", 1000, 0, 0)
+		game.userO = auth.User("black", 1000, 0, 0)
+		game.state = constants.STATE_PLAY
+
+		ws = aiohttp.web.WebSocketResponse()
+		await ws.prepare(request)
+		await ws.send_bytes(bytes([protocol.FRAME_THROTTLED]))
+		await ws.send_bytes(game.get_binary_message())
+		await ws.close()
+		return ws
+
+	@unittest_run_loop
+	async def test_throttled_frame(self):
+		player = run_ai.AiPlayer(self.loop, self.client.session,
+		                         str(self.client.make_url("/")))
+		player.game = "key"
+		await player.play()
+		# The state frame after the throttled frame was read.
+		self.assertEqual(constants.STATE_PLAY, player.state)
+		self.assertEqual(32, len(player.pieces))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,74 @@
+import asyncio
+import heapq
+import logging
+import math
+
+
+class Scheduler:
+	"""Updates the games when their pieces arrive or wake up and sends the
+	updates to the observers, so that the clients do not have to ping the
+	server for that.
+
+	There is one heap of (time, game key) for all games and one event loop
+	timer for the earliest time in it.
+	"""
+
+	def __init__(self, game_manager, broadcast):
+		self.game_manager = game_manager
+		# Coroutine function that is called with a game after it has been
+		# updated.
+		self.broadcast = broadcast
+		self.heap = []
+		# The earliest time in the heap for each game key. Other entries for
+		# the game are skipped when popped.
+		self.scheduled = {}
+		self._handle = None
+		self._handle_time = None
+
+	def schedule(self, game):
+		"""Makes sure that game is updated at its next timer."""
+		t = game.next_timer()
+		if t is None or self.scheduled.get(game.key, math.inf) <= t:
+			return
+		self.scheduled[game.key] = t
+		heapq.heappush(self.heap, (t, game.key))
+		self._arm()
+
+	def _arm(self):
+		t = self.heap[0][0]
+		if self._handle is not None:
+			if self._handle_time <= t:
+				return
+			self._handle.cancel()
+		game_clock = self.game_manager.clock
+		delay = max(0.0, game_clock.wall_delay(t - game_clock.time()))
+		self._handle = asyncio.get_event_loop().call_later(delay, self._wake)
+		self._handle_time = t
+
+	def _wake(self):
+		self._handle = None
+		asyncio.ensure_future(self.run_due())
+
+	async def run_due(self):
+		"""Updates and broadcasts the games with timers that have expired."""
+		now = self.game_manager.clock.time()
+		keys = []
+		while self.heap and self.heap[0][0] <= now:
+			t, key = heapq.heappop(self.heap)
+			if self.scheduled.get(key) == t:
+				del self.scheduled[key]
+				keys.append(key)
+
+		for key in keys:
+			# Updates the game.
+			game = self.game_manager.get(key)
+			if game is None:
+				continue
+			try:
+				await self.broadcast(game)
+			except Exception:
+				logging.exception("Could not send the update of %s.", key)
+			self.schedule(game)
+
+		if self.heap:
+			self._arm()
@@ -0,0 +1,110 @@
+import asyncio
+import unittest
+
+import clock
+import game_storage
+import scheduler
+import testutil
+
+
+class TestScheduler(unittest.TestCase):
+	def setUp(self):
+		self.loop = asyncio.new_event_loop()
+		asyncio.set_event_loop(self.loop)
+		self.clock = clock.VirtualClock(testutil.START_TIME)
+		self.game_manager = game_storage.GameManager(self.clock)
+		self.white, black = testutil.players()
+		self.game, self.key = self.game_manager.new(self.white)
+		testutil.start_game(self.game, self.white, black)
+
+		self.broadcasts = []
+
+		async def broadcast(game):
+			self.broadcasts.append(
+			    (self.clock.time(), game.pieces[8].state()))
+
+		self.scheduler = scheduler.Scheduler(self.game_manager, broadcast)
+
+	def tearDown(self):
+		self.loop.close()
+		asyncio.set_event_loop(None)
+
+	def run_due(self):
+		self.loop.run_until_complete(self.scheduler.run_due())
+
+	def test_arrival_and_wake_up(self):
+		self.game.move(self.white, "A2", "A3")
+		self.scheduler.schedule(self.game)
+		self.assertEqual(self.scheduler.heap, [(1001.0, self.key)])
+
+		self.clock.advance(0.5)
+		self.run_due()
+		self.assertEqual(self.broadcasts, [])
+
+		self.clock.advance(0.5)
+		self.run_due()
+		self.assertEqual(self.broadcasts, [(1001.0, "1,6;S,1004.0,A3")])
+		# The game is scheduled again for the wake up.
+		self.assertEqual(self.scheduler.scheduled, {self.key: 1004.0})
+
+		self.clock.advance(3.0)
+		self.run_due()
+		self.assertEqual(self.broadcasts[-1], (1004.0, "1,6;A3"))
+		self.assertEqual(self.scheduler.scheduled, {})
+
+	def test_earlier_timer(self):
+		self.game.move(self.white, "A2", "A4")
+		self.scheduler.schedule(self.game)
+		self.game.move(self.white, "B2", "B3")
+		self.scheduler.schedule(self.game)
+		self.assertEqual(self.scheduler.scheduled, {self.key: 1001.0})
+		self.assertEqual(self.scheduler._handle_time, 1001.0)
+
+		self.clock.advance(1.0)
+		self.run_due()
+		self.assertEqual(len(self.broadcasts), 1)
+		self.assertEqual(self.scheduler.scheduled, {self.key: 1002.0})
+
+	def test_nothing_to_schedule(self):
+		self.scheduler.schedule(self.game)
+		self.assertEqual(self.scheduler.heap, [])
+		self.assertIsNone(self.scheduler._handle)
+
+	def test_event_loop_timer(self):
+		# The timer is already due, so the loop timer runs immediately.
+		self.game.move(self.white, "A2", "A3")
+		self.clock.advance(1.0)
+		self.scheduler.schedule(self.game)
+		self.loop.run_until_complete(asyncio.sleep(0.01))
+		self.assertEqual(self.broadcasts, [(1001.0, "1,6;S,1004.0,A3")])
+
+
+class TestSchedulerAccelerated(unittest.TestCase):
+	def test_wall_delay(self):
+		loop = asyncio.new_event_loop()
+		asyncio.set_event_loop(loop)
+		self.addCleanup(asyncio.set_event_loop, None)
+		self.addCleanup(loop.close)
+		game_clock = clock.AcceleratedClock(1000.0)
+		game_manager = game_storage.GameManager(game_clock)
+		white, black = testutil.players()
+		game, key = game_manager.new(white)
+		testutil.start_game(game, white, black)
+		broadcasts = []
+
+		async def broadcast(game):
+			broadcasts.append(game.pieces[8].state())
+
+		s = scheduler.Scheduler(game_manager, broadcast)
+		game.move(white, "A2", "A3")
+		s.schedule(game)
+		# The move takes a second of game time, which is a millisecond of
+		# wall time.
+		self.assertLessEqual(s._handle.when() - loop.time(), 0.001)
+		loop.run_until_complete(asyncio.sleep(0.05))
+		self.assertEqual(len(broadcasts), 2)
+		self.assertEqual(broadcasts[-1], "1,6;A3")
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,196 @@
+#!/usr/bin/python3
+"""Plays many games in one process directly against game_storage.Game on
+a virtual clock, without the web server, and reports the throughput.
+
+	$ python3 simulate.py --games 100 --white ai --black random
+
+A policy is a function (game, color, rng) returning a list of
+(from_pos, to_pos) moves to make. The players call their policies at fixed
+intervals of virtual time, like AiPlayer in run_ai.py does.
+"""
+
+import argparse
+import logging
+import random
+import time
+
+import auth
+import clock
+from constants import *
+import game_storage
+from util import HttpCodeException
+
+
+def push_pawns(game, color, rng):
+	"""Moves about two thirds of the pawns that can move. The same as
+	AiPlayer._poll."""
+	moves = []
+	for frm, all_to in game.board.get_possible_moves(color):
+		if rng.choice([1, 2, 3]) == 1:
+			continue
+		if game.board.piece(frm).type != PAWN:
+			continue
+		moves.append((frm, rng.choice(all_to)))
+	return moves
+
+
+def dodge_incoming(game, color, rng):
+	"""Moves pieces away from squares that opponent pieces are moving to.
+	The same as AiPlayer._dodge_incoming."""
+	moves = []
+	for piece in game.pieces:
+		if piece is not None and piece.moving and piece.color != color:
+			my_piece = game.board.piece(piece.pos)
+			if my_piece:
+				possible = game.board.get_moves(my_piece.pos)
+				if possible:
+					moves.append((my_piece.pos, rng.choice(possible)))
+	return moves
+
+
+def random_move(game, color, rng):
+	"""Makes one random move with any piece that is not sleeping."""
+	all_moves = [(frm, all_to)
+	             for frm, all_to in game.board.get_possible_moves(color)
+	             if not game.board.piece(frm).sleeping]
+	if not all_moves:
+		return []
+	frm, all_to = rng.choice(all_moves)
+	return [(frm, rng.choice(all_to))]
+
+
+# Named lists of (interval, policy). A policy with interval 0 is called
+# after every update, like the AI does when it receives a game message.
+POLICIES = {
+    "ai": [(1.0, push_pawns), (0.0, dodge_incoming)],
+    "pawns": [(1.0, push_pawns)],
+    "random": [(0.5, random_move)],
+    "random-dodge": [(0.5, random_move), (0.0, dodge_incoming)],
+}
+
+
+class Stats:
+	def __init__(self):
+		self.games = 0
+		self.wins = {WHITE: 0, BLACK: 0, None: 0}
+		self.moves = 0
+		self.rejected_moves = 0
+		self.updates = 0
+		self.update_seconds = 0.0
+		self.virtual_seconds = 0.0
+		self.wall_seconds = 0.0
+
+	def report(self):
+		wall = max(self.wall_seconds, 1e-9)
+		lines = [
+		    "Games:           {}".format(self.games),
+		    "White/black/timeout: {}/{}/{}".format(self.wins[WHITE],
+		                                           self.wins[BLACK],
+		                                           self.wins[None]),
+		    "Games/s:         {:.2f}".format(self.games / wall),
+		    "Moves/s:         {:.0f} ({} rejected)".format(
+		        self.moves / wall, self.rejected_moves),
+		    "Time per update: {:.3f} ms".format(1000 * self.update_seconds /
+		                                        max(self.updates, 1)),
+		    "Speed:           {:.0f}x real time".format(self.virtual_seconds /
+		                                                wall),
+		]
+		return "\n".join(lines)
+
+
+class Simulator:
+	def __init__(self,
+	             white_policies,
+	             black_policies,
+	             seed=0,
+	             tick=0.1,
+	             max_time=600.0):
+		self.players = [(WHITE, white_policies), (BLACK, black_policies)]
+		self.rng = random.Random(seed)
+		# Virtual seconds between updates.
+		self.tick = tick
+		# Games that have not ended after this many virtual seconds are
+		# counted as timeouts.
+		self.max_time = max_time
+		self.stats = Stats()
+
+	def play(self, num_games):
+		start = time.perf_counter()
+		for i in range(num_games):
+			self.play_game("sim" + str(i))
+		self.stats.wall_seconds += time.perf_counter() - start
+		return self.stats
+
+	def play_game(self, key):
+		"""Plays one game to the end and returns the winner, or None if
+		the game timed out."""
+		game_clock = clock.VirtualClock(1000.0)
+		game = game_storage.Game(key, game_clock)
+		game.userX = auth.User("white", 1000, 0, 0)
+		game.userO = auth.User("black", 1000, 0, 0)
+		game.state = STATE_PLAY
+		users = {WHITE: game.userX, BLACK: game.userO}
+
+		end_time = game_clock.time() + self.max_time
+		next_call = {}
+		while game.state != STATE_GAMEOVER and game_clock.time() < end_time:
+			game_clock.advance(self.tick)
+			self._update(game)
+			for color, policies in self.players:
+				for interval, policy in policies:
+					now = game_clock.time()
+					if next_call.get((color, policy), now) > now:
+						continue
+					next_call[color, policy] = now + interval
+					for frm, to in policy(game, color, self.rng):
+						self._move(game, users[color], frm, to)
+
+		self.stats.games += 1
+		self.stats.wins[game.winner] += 1
+		self.stats.virtual_seconds += game_clock.time() - (end_time -
+		                                                   self.max_time)
+		return game.winner
+
+	def _update(self, game):
+		start = time.perf_counter()
+		game.update()
+		self.stats.update_seconds += time.perf_counter() - start
+		self.stats.updates += 1
+
+	def _move(self, game, user, frm, to):
+		if game.state == STATE_GAMEOVER:
+			return
+		# The web server updates the game before every move.
+		self._update(game)
+		try:
+			moved = game.move(user, frm, to)
+		except HttpCodeException:
+			moved = False
+		if moved:
+			self.stats.moves += 1
+		else:
+			self.stats.rejected_moves += 1
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--games", type=int, default=100)
+	parser.add_argument("--white", choices=sorted(POLICIES), default="ai")
+	parser.add_argument("--black", choices=sorted(POLICIES), default="random")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--tick",
+	                    type=float,
+	                    default=0.1,
+	                    help="Virtual seconds between updates.")
+	parser.add_argument(
+	    "--max-time",
+	    type=float,
+	    default=600.0,
+	    help="Virtual seconds before a game is counted as a timeout.")
+	args = parser.parse_args()
+	# Rejected moves are logged as warnings by the game.
+	logging.basicConfig(level=logging.ERROR)
+
+	simulator = Simulator(POLICIES[args.white], POLICIES[args.black],
+	                      args.seed, args.tick, args.max_time)
+	print(simulator.play(args.games).report())
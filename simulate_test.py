@@ -0,0 +1,37 @@
+import unittest
+
+from constants import *
+import simulate
+
+
+class TestSimulator(unittest.TestCase):
+	def test_random_games_end(self):
+		simulator = simulate.Simulator(simulate.POLICIES["random"],
+		                               simulate.POLICIES["random"])
+		stats = simulator.play(3)
+		self.assertEqual(stats.games, 3)
+		self.assertEqual(stats.wins[WHITE] + stats.wins[BLACK], 3)
+		self.assertGreater(stats.moves, 0)
+		self.assertGreater(stats.updates, 0)
+
+	def test_deterministic(self):
+		results = []
+		for _ in range(2):
+			simulator = simulate.Simulator(simulate.POLICIES["ai"],
+			                               simulate.POLICIES["random"],
+			                               seed=1,
+			                               max_time=60.0)
+			stats = simulator.play(2)
+			results.append((stats.wins, stats.moves, stats.rejected_moves,
+			                stats.virtual_seconds))
+		self.assertEqual(results[0], results[1])
+
+	def test_timeout(self):
+		simulator = simulate.Simulator([], [], max_time=5.0)
+		self.assertIsNone(simulator.play_game("key"))
+		self.assertEqual(simulator.stats.wins[None], 1)
+		self.assertAlmostEqual(simulator.stats.virtual_seconds, 5.0)
+
+
+if __name__ == '__main__':
+	unittest.main()
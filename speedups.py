@@ -0,0 +1,80 @@
+"""Optional faster implementations of the event loop and of JSON.
+
+The server picks them at startup with use_event_loop and use_json. An
+implementation that is not installed falls back to the standard library.
+The JSON messages are encoded and decoded with json_dumps and json_loads,
+which always return and accept str.
+"""
+
+import asyncio
+import importlib
+import json
+
+# In order of preference for "auto".
+EVENT_LOOPS = ["uvloop", "asyncio"]
+JSON_CODECS = ["orjson", "ujson", "json"]
+
+json_name = "json"
+json_dumps = json.dumps
+json_loads = json.loads
+
+
+def _import(name):
+	try:
+		return importlib.import_module(name)
+	except ImportError:
+		return None
+
+
+def event_loop_policy(name):
+	"""Returns the event loop policy of the implementation, or None if it
+	is not installed."""
+	if name == "asyncio":
+		return asyncio.DefaultEventLoopPolicy()
+	if name not in EVENT_LOOPS:
+		return None
+	module = _import(name)
+	return module.EventLoopPolicy() if module else None
+
+
+def json_codec(name):
+	"""Returns (dumps, loads) of the implementation, or None if it is not
+	installed."""
+	if name == "json":
+		return json.dumps, json.loads
+	if name not in JSON_CODECS:
+		return None
+	module = _import(name)
+	if module is None:
+		return None
+	if name == "orjson":
+		# orjson encodes to bytes.
+		return lambda obj: module.dumps(obj).decode("utf-8"), module.loads
+	return module.dumps, module.loads
+
+
+def use_event_loop(name="auto"):
+	"""Sets the event loop policy and returns the name of the active
+	implementation."""
+	for candidate in EVENT_LOOPS if name == "auto" else [name, "asyncio"]:
+		policy = event_loop_policy(candidate)
+		if policy is not None:
+			asyncio.set_event_loop_policy(policy)
+			return candidate
+
+
+def use_json(name="auto"):
+	"""Sets json_dumps and json_loads and returns the name of the active
+	implementation."""
+	global json_name, json_dumps, json_loads
+	for candidate in JSON_CODECS if name == "auto" else [name, "json"]:
+		codec = json_codec(candidate)
+		if codec is not None:
+			json_name = candidate
+			json_dumps, json_loads = codec
+			return candidate
+
+
+def available(names, get):
+	"""The names of the installed implementations."""
+	return [name for name in names if get(name) is not None]
@@ -0,0 +1,53 @@
+import asyncio
+import json
+import sys
+import types
+import unittest
+from unittest import mock
+
+import speedups
+
+
+class TestSpeedups(unittest.TestCase):
+	def tearDown(self):
+		speedups.use_json("json")
+		asyncio.set_event_loop_policy(None)
+
+	def test_stdlib(self):
+		self.assertEqual("json", speedups.use_json("json"))
+		self.assertIs(json.dumps, speedups.json_dumps)
+		self.assertEqual("asyncio", speedups.use_event_loop("asyncio"))
+
+	def test_not_installed(self):
+		with mock.patch.dict(sys.modules, {
+		    "orjson": None,
+		    "ujson": None,
+		    "uvloop": None
+		}):
+			self.assertEqual("json", speedups.use_json("orjson"))
+			self.assertEqual("json", speedups.use_json("auto"))
+			self.assertEqual("asyncio", speedups.use_event_loop("uvloop"))
+			self.assertEqual("asyncio", speedups.use_event_loop("auto"))
+		self.assertIs(json.loads, speedups.json_loads)
+		self.assertIsInstance(asyncio.get_event_loop_policy(),
+		                      asyncio.DefaultEventLoopPolicy)
+
+	def test_unknown(self):
+		self.assertEqual("json", speedups.use_json("pickle"))
+		self.assertEqual("asyncio", speedups.use_event_loop("pickle"))
+
+	def test_installed(self):
+		orjson = types.ModuleType("orjson")
+		orjson.dumps = lambda obj: json.dumps(obj).encode("utf-8")
+		orjson.loads = json.loads
+		with mock.patch.dict(sys.modules, {"orjson": orjson}):
+			self.assertEqual("orjson", speedups.use_json("auto"))
+			self.assertEqual(["orjson", "json"],
+			                 speedups.available(["orjson", "json"],
+			                                    speedups.json_codec))
+		# Encoded to str, like the standard library.
+		self.assertEqual('{"a": 1}', speedups.json_dumps({"a": 1}))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,42 @@
+"""Fakes and setup shared by the tests."""
+
+import json
+
+import auth
+import constants
+import protocol
+
+# The time of the virtual clocks of the tests.
+START_TIME = 1000.0
+
+
+class FakeConnection:
+	"""Stands in for connection.Connection. Records the frames sent to it
+	and decodes them to messages."""
+
+	def __init__(self):
+		self.closed = False
+		self.frames = []
+		self.messages = []
+
+	def disconnect(self):
+		self.closed = True
+
+	def send(self, data, full=True):
+		self.frames.append(data)
+		if isinstance(data, bytes):
+			self.messages.append(protocol.unpack_frame(data))
+		else:
+			self.messages.append(json.loads(data))
+
+
+def players():
+	"""Returns the users white and black."""
+	return auth.User("white", 1000, 0, 0), auth.User("black", 1000, 0, 0)
+
+
+def start_game(game, white, black):
+	"""Puts game in STATE_PLAY between white and black."""
+	game.userX = white
+	game.userO = black
+	game.state = constants.STATE_PLAY
@@ -1,4 +1,4 @@
-import aiohttp
+import aiohttp.web
 import logging
 
 